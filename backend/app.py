@@ -3,19 +3,28 @@ from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
 load_dotenv()
 
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, Response, g, request, jsonify, send_from_directory, session
 from flask_cors import CORS
 import copy, math, random, itertools
-from collections import defaultdict
+import bisect, csv, heapq, io, queue, socket, threading, time, uuid
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
 import json
-import smtplib
-import urllib.request
-import urllib.error
-from email.mime.text import MIMEText
-from email.utils import formataddr
-from pymongo import MongoClient
+import base64, hashlib, hmac, secrets
+from collections import OrderedDict
+import bson
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, leases always granted
+    fcntl = None
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -66,6 +75,9 @@ PUBLISHED_TIMETABLE_FILE = os.path.join(DATA_DIR, "published_timetable.json")
 RESCHEDULE_REQUESTS_FILE = os.path.join(DATA_DIR, "reschedule_requests.json")
 PENDING_REGISTRATIONS_FILE = os.path.join(DATA_DIR, "pending_registrations.json")
 ACTIVITY_LOG_FILE = os.path.join(DATA_DIR, "activity_log.json")
+SESSION_REVOCATIONS_FILE = os.path.join(DATA_DIR, "session_revocations.json")
+EMAIL_OUTBOX_FILE = os.path.join(DATA_DIR, "email_outbox.json")
+EVENTS_LOG_FILE = os.path.join(DATA_DIR, "events.log")
 SEED_USERS_FILE = os.path.join(BASE_DIR, "users.json")
 
 USERS = {}
@@ -73,8 +85,154 @@ PUBLISHED_TIMETABLE = None
 RESCHEDULE_REQUESTS = []
 PENDING_REGISTRATIONS = []
 ACTIVITY_LOGS = []
+PUBLISHED_READ_MODEL = {}
+USER_INDEX = {}
+WARMUP_STATE = {"ready": False, "pid": None, "started_at": None, "finished_at": None, "duration_ms": None, "error": None}
 MONGO_CLIENT = None
 MONGO_STATE_COLLECTION = None
+EXPIRY_SCHEDULER_ENABLED = os.environ.get("EXPIRY_SCHEDULER", "1") == "1"
+EXPIRY_RESCAN_SECONDS = max(1, int(os.environ.get("EXPIRY_RESCAN_SECONDS", "30")))
+EXPIRY_LEASE_SECONDS = max(3, int(os.environ.get("EXPIRY_LEASE_SECONDS", "60")))
+PENDING_REGISTRATION_STATUSES = ("pending_email_verification", "pending_admin_approval")
+# Set by gunicorn.conf.py when the app is imported once in the master and forked.
+PRELOADED_APP = os.environ.get("SERENE_PRELOAD", "0") == "1"
+PASSWORD_HASH_ITERATIONS = max(1000, int(os.environ.get("PASSWORD_HASH_ITERATIONS", "260000")))
+LOGIN_CACHE_TTL_SECONDS = max(0, int(os.environ.get("LOGIN_CACHE_TTL_SECONDS", "300")))
+LOGIN_CACHE_SIZE = max(0, int(os.environ.get("LOGIN_CACHE_SIZE", "1024")))
+SESSION_TOKEN_MAX_AGE = max(60, int(os.environ.get("SESSION_TOKEN_MAX_AGE", str(12 * 3600))))
+REVOCATION_CHECK_SECONDS = max(0.0, float(os.environ.get("REVOCATION_CHECK_SECONDS", "2")))
+EMAIL_MAX_ATTEMPTS = max(1, int(os.environ.get("EMAIL_MAX_ATTEMPTS", "5")))
+EMAIL_RETRY_BASE_SECONDS = 5
+EMAIL_RETRY_MAX_SECONDS = 300
+EMAIL_BATCH_SIZE = 20
+EMAIL_POLL_SECONDS = 2
+EMAIL_LEASE_SECONDS = 60
+EMAIL_IDLE_CLOSE_SECONDS = 60
+BULK_IMPORT_MAX_ROWS = max(1, int(os.environ.get("BULK_IMPORT_MAX_ROWS", "5000")))
+BATCH_GENERATION_MAX_DEPARTMENTS = max(1, int(os.environ.get("BATCH_GENERATION_MAX_DEPARTMENTS", "8")))
+SWEEP_MAX_COMBINATIONS = max(1, int(os.environ.get("SWEEP_MAX_COMBINATIONS", "48")))
+SWEEP_MAX_WORKERS = max(1, int(os.environ.get("SWEEP_MAX_WORKERS", str(os.cpu_count() or 1))))
+GENERATION_PROFILE_MODE = os.environ.get("GENERATION_PROFILE", "request").strip().lower()
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "").strip()
+
+
+# ----------------- Metrics -----------------
+# Prometheus metrics are kept per worker process; scrape each instance/worker
+# directly (or aggregate with sum by ()) rather than through the load balancer.
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_DEFINITIONS = {
+    "serene_http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+    "serene_http_requests_in_flight": ("gauge", "HTTP requests currently being served, by route."),
+    "serene_storage_operation_duration_seconds": ("histogram", "State store read/write latency by state key."),
+    "serene_storage_bytes_total": ("counter", "Bytes read from or written to the state store, by state key."),
+    "serene_storage_errors_total": ("counter", "Failed state store operations, by state key."),
+    "serene_mongo_operation_duration_seconds": ("histogram", "MongoDB operation latency by operation."),
+    "serene_generation_jobs_in_progress": ("gauge", "Timetable generation jobs currently running (queue depth)."),
+    "serene_generation_duration_seconds": ("histogram", "Wall time of timetable generation jobs."),
+    "serene_cache_requests_total": ("counter", "Read-model cache lookups by cache and result."),
+    "serene_startup_duration_seconds": ("gauge", "Time spent in each startup phase of this process."),
+    "serene_email_deliveries_total": ("counter", "Outbox delivery attempts by transport and result."),
+    "serene_events_published_total": ("counter", "Dashboard events published by this process, by type."),
+    "serene_event_subscribers": ("gauge", "Open SSE event streams on this process."),
+}
+_METRICS_LOCK = threading.Lock()
+_METRIC_VALUES = {}  # (name, labels) -> float, or histogram state dict
+
+
+def _metric_key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc_metric(name, amount=1, **labels):
+    """Increment a counter or gauge (negative amounts for gauges)."""
+    key = _metric_key(name, labels)
+    with _METRICS_LOCK:
+        _METRIC_VALUES[key] = _METRIC_VALUES.get(key, 0) + amount
+
+
+def set_metric(name, value, **labels):
+    with _METRICS_LOCK:
+        _METRIC_VALUES[_metric_key(name, labels)] = value
+
+
+def observe_metric(name, value, **labels):
+    key = _metric_key(name, labels)
+    with _METRICS_LOCK:
+        hist = _METRIC_VALUES.get(key)
+        if hist is None:
+            hist = _METRIC_VALUES[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+@contextmanager
+def timed_metric(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_metric(name, time.perf_counter() - start, **labels)
+
+
+def record_cache_lookup(cache, hit):
+    inc_metric("serene_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def prometheus_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_metric_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{prometheus_label_value(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus_metrics():
+    """Prometheus text exposition (format 0.0.4) of this process's metrics."""
+    with _METRICS_LOCK:
+        snapshot = {
+            key: (copy.deepcopy(value) if isinstance(value, dict) else value)
+            for key, value in _METRIC_VALUES.items()
+        }
+
+    by_name = defaultdict(list)
+    for (name, labels), value in snapshot.items():
+        by_name[name].append((labels, value))
+
+    lines = []
+    for name, (kind, help_text) in METRIC_DEFINITIONS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name.get(name, [])):
+            if kind != "histogram":
+                lines.append(f"{name}{format_metric_labels(labels)} {value}")
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, value["buckets"]):
+                lines.append(f"{name}_bucket{format_metric_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{format_metric_labels(labels, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{format_metric_labels(labels)} {value['sum']:.6f}")
+            lines.append(f"{name}_count{format_metric_labels(labels)} {value['count']}")
+
+    # hit ratio per cache, derived from the lookup counter
+    lookups = defaultdict(lambda: {"hit": 0, "miss": 0})
+    for labels, value in by_name.get("serene_cache_requests_total", []):
+        label_map = dict(labels)
+        lookups[label_map.get("cache")][label_map.get("result")] += value
+    lines.append("# HELP serene_cache_hit_ratio Share of read-model cache lookups served from cache.")
+    lines.append("# TYPE serene_cache_hit_ratio gauge")
+    for cache, counts in sorted(lookups.items()):
+        total = counts["hit"] + counts["miss"]
+        ratio = counts["hit"] / total if total else 0
+        lines.append(f'serene_cache_hit_ratio{{cache="{prometheus_label_value(cache)}"}} {ratio:.4f}')
+
+    lines.extend(generation_profile_prometheus_lines())
+    return "\n".join(lines) + "\n"
 
 
 def init_mongo():
@@ -85,7 +243,8 @@ def init_mongo():
     db_name = os.environ.get("MONGO_DB_NAME", "serene_scheduler").strip() or "serene_scheduler"
     try:
         MONGO_CLIENT = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
-        MONGO_CLIENT.admin.command("ping")
+        with timed_metric("serene_mongo_operation_duration_seconds", op="ping"):
+            MONGO_CLIENT.admin.command("ping")
         MONGO_STATE_COLLECTION = MONGO_CLIENT[db_name]["app_state"]
         print(f"[storage] Using MongoDB database '{db_name}'")
     except Exception as exc:
@@ -99,33 +258,183 @@ def state_key_for_path(path):
 
 
 def read_json_file(path, default_value):
-    if MONGO_STATE_COLLECTION is not None:
-        try:
-            doc = MONGO_STATE_COLLECTION.find_one({"_id": state_key_for_path(path)})
-            if doc is None or "value" not in doc:
+    key = state_key_for_path(path)
+    with timed_metric("serene_storage_operation_duration_seconds", key=key, op="read"):
+        if MONGO_STATE_COLLECTION is not None:
+            try:
+                with timed_metric("serene_mongo_operation_duration_seconds", op="find_one"):
+                    doc = MONGO_STATE_COLLECTION.find_one({"_id": key})
+                if doc is None or "value" not in doc:
+                    return copy.deepcopy(default_value)
+                # Size recorded by the last write; re-encoding every read just for the metric is not worth it.
+                inc_metric("serene_storage_bytes_total", doc.get("bytes", 0), key=key, op="read")
+                return doc["value"]
+            except Exception:
+                inc_metric("serene_storage_errors_total", key=key, op="read")
                 return copy.deepcopy(default_value)
-            return doc["value"]
+        if not os.path.exists(path):
+            return copy.deepcopy(default_value)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            inc_metric("serene_storage_bytes_total", len(raw), key=key, op="read")
+            return json.loads(raw.decode("utf-8-sig"))
         except Exception:
+            inc_metric("serene_storage_errors_total", key=key, op="read")
             return copy.deepcopy(default_value)
-    if not os.path.exists(path):
-        return copy.deepcopy(default_value)
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return copy.deepcopy(default_value)
+
+
+def mongo_state_set(key, value):
+    """`$set` for a state value, with its BSON size kept alongside for the read metrics."""
+    size = len(bson.encode({"_id": key, "value": value}))
+    inc_metric("serene_storage_bytes_total", size, key=key, op="write")
+    return {"value": value, "bytes": size}
 
 
 def write_json_file(path, data):
+    key = state_key_for_path(path)
+    with timed_metric("serene_storage_operation_duration_seconds", key=key, op="write"):
+        if MONGO_STATE_COLLECTION is not None:
+            try:
+                with timed_metric("serene_mongo_operation_duration_seconds", op="update_one"):
+                    # `rev` lets readers detect changes without fetching the value (see state_revision).
+                    MONGO_STATE_COLLECTION.update_one(
+                        {"_id": key}, {"$set": mongo_state_set(key, data), "$inc": {"rev": 1}}, upsert=True
+                    )
+            except Exception:
+                inc_metric("serene_storage_errors_total", key=key, op="write")
+                raise
+            return
+        payload = json.dumps(data, indent=2).encode("utf-8")
+        # Write-then-rename so concurrent readers never see a half-written file.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        inc_metric("serene_storage_bytes_total", len(payload), key=key, op="write")
+
+
+@contextmanager
+def state_file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a+") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+KEEP_STATE = object()
+
+
+def swap_json_state(path, default_value, compute, retries=10):
+    """Read-compute-write one state key without losing concurrent updates.
+
+    `compute(value)` returns (new_value, result); returning KEEP_STATE as the new
+    value skips the write. Files are serialized with a lock file; Mongo uses the
+    `rev` counter as a compare-and-swap and calls `compute` again on conflict.
+    """
+    key = state_key_for_path(path)
+    if MONGO_STATE_COLLECTION is None:
+        with state_file_lock(path):
+            value, result = compute(read_json_file(path, default_value))
+            if value is not KEEP_STATE:
+                write_json_file(path, value)
+            return result
+
+    for _ in range(retries):
+        doc = MONGO_STATE_COLLECTION.find_one({"_id": key})
+        current = copy.deepcopy(doc["value"]) if doc and "value" in doc else copy.deepcopy(default_value)
+        value, result = compute(current)
+        if value is KEEP_STATE:
+            return result
+        with timed_metric("serene_mongo_operation_duration_seconds", op="compare_and_swap"):
+            if doc is None:
+                try:
+                    MONGO_STATE_COLLECTION.insert_one({"_id": key, **mongo_state_set(key, value), "rev": 1})
+                    return result
+                except DuplicateKeyError:
+                    continue
+            updated = MONGO_STATE_COLLECTION.update_one(
+                {"_id": key, "rev": doc.get("rev")}, {"$set": mongo_state_set(key, value), "$inc": {"rev": 1}}
+            )
+        if updated.matched_count:
+            return result
+    raise RuntimeError(f"Concurrent updates to '{key}' kept conflicting")
+
+
+def update_json_state(path, default_value, mutate, retries=10, write_if=None):
+    """Read-modify-write one state key: `mutate` changes the value in place.
+
+    `write_if(result)` returning False skips the write (nothing changed).
+    """
+    def compute(value):
+        result = mutate(value)
+        return (value if write_if is None or write_if(result) else KEEP_STATE), result
+
+    return swap_json_state(path, default_value, compute, retries)
+
+
+def commit_state_batch(values):
+    """Write several state keys as one unit: {path: value}.
+
+    Mongo runs a multi-document transaction when the deployment supports it
+    (replica set / sharded, e.g. Atlas) and one ordered bulk_write otherwise.
+    Files are all written to temp files first and then renamed in turn.
+    """
     if MONGO_STATE_COLLECTION is not None:
-        MONGO_STATE_COLLECTION.replace_one(
-            {"_id": state_key_for_path(path)},
-            {"_id": state_key_for_path(path), "value": data},
-            upsert=True
-        )
+        ops = [
+            UpdateOne(
+                {"_id": state_key_for_path(path)},
+                {"$set": mongo_state_set(state_key_for_path(path), value), "$inc": {"rev": 1}},
+                upsert=True
+            )
+            for path, value in values.items()
+        ]
+        transactional = MONGO_CLIENT.topology_description.topology_type_name in ("ReplicaSetWithPrimary", "Sharded")
+        with timed_metric("serene_mongo_operation_duration_seconds", op="bulk_write"):
+            if transactional:
+                with MONGO_CLIENT.start_session() as mongo_session:
+                    with mongo_session.start_transaction():
+                        MONGO_STATE_COLLECTION.bulk_write(ops, ordered=True, session=mongo_session)
+            else:
+                MONGO_STATE_COLLECTION.bulk_write(ops, ordered=True)
         return
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+
+    staged = []
+    try:
+        for path, value in values.items():
+            payload = json.dumps(value, indent=2).encode("utf-8")
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            staged.append((tmp_path, path, len(payload)))
+        for tmp_path, path, size in staged:
+            os.replace(tmp_path, path)
+            inc_metric("serene_storage_bytes_total", size, key=state_key_for_path(path), op="write")
+    finally:
+        for tmp_path, _, _ in staged:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def state_revision(path):
+    """Cheap change marker for a state key: file (mtime, size, inode) or the Mongo `rev` counter."""
+    if MONGO_STATE_COLLECTION is not None:
+        try:
+            with timed_metric("serene_mongo_operation_duration_seconds", op="find_one"):
+                doc = MONGO_STATE_COLLECTION.find_one({"_id": state_key_for_path(path)}, {"rev": 1})
+        except Exception:
+            return None
+        return ("mongo", doc.get("rev", 0)) if doc else ("mongo", None)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ("file", None)
+    return ("file", st.st_mtime_ns, st.st_size, st.st_ino)
 
 
 def read_seed_users():
@@ -140,73 +449,81 @@ def read_seed_users():
 
 
 def load_users():
-    users = read_json_file(USERS_FILE, {})
-    if not isinstance(users, dict):
-        users = {}
+    """Stored users, seeding the admin and demo accounts in one locked update if missing."""
+    def seed(users):
+        if not isinstance(users, dict):
+            users = {}
+
+        changed = False
+        if not users:
+            seed_users = read_seed_users()
+            for username, record in seed_users.items():
+                if username in users or not isinstance(record, dict):
+                    continue
+                users[username] = record
+                changed = True
 
-    changed = False
-    if not users:
-        seed_users = read_seed_users()
-        for username, record in seed_users.items():
-            if username in users or not isinstance(record, dict):
-                continue
-            users[username] = record
+        if "admin" not in users:
+            users["admin"] = {
+                "username": "admin",
+                "password": hash_password(os.environ.get("DEFAULT_ADMIN_PASSWORD", "admin123")),
+                "role": "admin",
+                "name": "Administrator"
+            }
             changed = True
 
-    if "admin" not in users:
-        users["admin"] = {
-            "username": "admin",
-            "password": os.environ.get("DEFAULT_ADMIN_PASSWORD", "admin123"),
-            "role": "admin",
-            "name": "Administrator"
-        }
-        changed = True
+        demo_teachers = [
+            ("t_dr_karambir", "Dr. Karambir"),
+            ("t_dr_sona", "Dr. Sona"),
+            ("t_mr_divyansh", "Mr. Divyansh"),
+            ("t_ms_pooja", "Ms. Pooja"),
+        ]
+        for username, teacher_name in demo_teachers:
+            if username in users:
+                continue
+            users[username] = {
+                "username": username,
+                "password": hash_password(os.environ.get("DEFAULT_TEACHER_PASSWORD", "teacher123")),
+                "role": "teacher",
+                "name": teacher_name,
+                "teacher_name": teacher_name,
+                "email": f"{username}@demo.local",
+                "status": "active"
+            }
+            changed = True
+        return (users if changed else KEEP_STATE), users
 
-    demo_teacher_password = os.environ.get("DEFAULT_TEACHER_PASSWORD", "teacher123")
-    demo_teachers = [
-        ("t_dr_karambir", "Dr. Karambir"),
-        ("t_dr_sona", "Dr. Sona"),
-        ("t_mr_divyansh", "Mr. Divyansh"),
-        ("t_ms_pooja", "Ms. Pooja"),
-    ]
-    for username, teacher_name in demo_teachers:
-        if username in users:
-            continue
-        users[username] = {
-            "username": username,
-            "password": demo_teacher_password,
-            "role": "teacher",
-            "name": teacher_name,
-            "teacher_name": teacher_name,
-            "email": f"{username}@demo.local",
-            "status": "active"
-        }
-        changed = True
+    return swap_json_state(USERS_FILE, {}, seed)
 
-    if changed:
-        write_json_file(USERS_FILE, users)
-    return users
 
+def add_user_account(user):
+    """Add one account in a locked update; False if the username is already taken."""
+    def add(users):
+        if normalize_identity(user["username"]) in {normalize_identity(name) for name in users}:
+            return False
+        users[user["username"]] = user
+        return True
 
-def save_users():
-    write_json_file(USERS_FILE, USERS)
+    return update_json_state(USERS_FILE, {}, add, write_if=bool)
 
 
 def load_published_timetable():
     return read_json_file(PUBLISHED_TIMETABLE_FILE, None)
 
 
-def save_published_timetable():
-    write_json_file(PUBLISHED_TIMETABLE_FILE, PUBLISHED_TIMETABLE)
-
-
 def get_latest_published_timetable():
-    """Always refresh from disk so multiple server workers stay consistent."""
+    """Always refresh from disk so multiple server workers stay consistent.
+
+    Expired temporary changes are applied by the expiry scheduler, so this stays
+    read-only unless the scheduler has been disabled.
+    """
     global PUBLISHED_TIMETABLE
-    PUBLISHED_TIMETABLE = load_published_timetable()
-    if PUBLISHED_TIMETABLE:
-        refresh_temporary_changes()
-    return PUBLISHED_TIMETABLE
+    published = load_published_timetable()
+    if published and not EXPIRY_SCHEDULER_ENABLED and temporary_changes_due(published):
+        run_expiry_pass({"temporary_changes"})
+        published = load_published_timetable()
+    PUBLISHED_TIMETABLE = published
+    return published
 
 
 def parse_iso_utc(value):
@@ -218,54 +535,45 @@ def parse_iso_utc(value):
         return None
 
 
-def rebuild_timetable_from_active_changes():
-    global PUBLISHED_TIMETABLE
-    if not PUBLISHED_TIMETABLE:
+def utc_timestamp(value):
+    """Seconds since the epoch for a naive UTC datetime."""
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+def rebuild_timetable_from_active_changes(published=None):
+    published = PUBLISHED_TIMETABLE if published is None else published
+    if not published:
         return
 
-    base_data = copy.deepcopy(PUBLISHED_TIMETABLE.get("baseTimetableData") or PUBLISHED_TIMETABLE.get("timetableData") or {})
-    rows = base_data.get("timetable", [])
-    input_data = PUBLISHED_TIMETABLE.get("inputData", {})
-    changes = sorted(PUBLISHED_TIMETABLE.get("temporary_changes", []), key=lambda c: c.get("appliedAt", ""))
+    base_data = published.get("baseTimetableData") or published.get("timetableData") or {}
+    input_data = published.get("inputData", {})
+    changes = sorted(published.get("temporary_changes", []), key=lambda c: c.get("appliedAt", ""))
+    if changes:
+        # the replay builds fresh rows, so the base snapshot never needs copying
+        rows = replay_temporary_changes(input_data, base_data.get("timetable", []), changes)
+    else:
+        rows = copy.deepcopy(base_data.get("timetable", []))
 
-    for change in changes:
-        if change.get("type") == "reslot_theory":
-            try:
-                rows = apply_theory_reslot(
-                    rows,
-                    change.get("teacher"),
-                    change.get("day"),
-                    change.get("fromSlot"),
-                    change.get("toSlot"),
-                    input_data.get("slots", [])
-                )
-            except Exception:
-                continue
-        else:
-            rows = run_teacher_reset(
-                input_data,
-                rows,
-                change.get("teacher"),
-                change.get("day"),
-                change.get("slot")
-            )
+    published.setdefault("timetableData", {})
+    published["timetableData"]["timetable"] = rows
 
-    PUBLISHED_TIMETABLE.setdefault("timetableData", {})
-    PUBLISHED_TIMETABLE["timetableData"]["timetable"] = rows
 
+def expire_temporary_changes(published, now=None):
+    """Drop expired temporary changes from `published` and rebuild it in place.
 
-def refresh_temporary_changes():
-    global PUBLISHED_TIMETABLE
-    if not PUBLISHED_TIMETABLE:
-        return
+    Returns True when the document changed and needs to be saved.
+    """
+    if not published:
+        return False
 
+    changed = False
     # Ensure a stable base snapshot exists for revert/rebuild.
-    if "baseTimetableData" not in PUBLISHED_TIMETABLE and PUBLISHED_TIMETABLE.get("timetableData"):
-        PUBLISHED_TIMETABLE["baseTimetableData"] = copy.deepcopy(PUBLISHED_TIMETABLE["timetableData"])
-        save_published_timetable()
+    if "baseTimetableData" not in published and published.get("timetableData"):
+        published["baseTimetableData"] = copy.deepcopy(published["timetableData"])
+        changed = True
 
-    now = datetime.utcnow()
-    existing = PUBLISHED_TIMETABLE.get("temporary_changes", [])
+    now = now or datetime.utcnow()
+    existing = published.get("temporary_changes", [])
     active = []
     for change in existing:
         exp = parse_iso_utc(change.get("expiresAt"))
@@ -273,18 +581,156 @@ def refresh_temporary_changes():
             active.append(change)
 
     if len(active) != len(existing):
-        PUBLISHED_TIMETABLE["temporary_changes"] = active
-        rebuild_timetable_from_active_changes()
-        PUBLISHED_TIMETABLE["publishedAt"] = datetime.utcnow().isoformat() + "Z"
-        save_published_timetable()
+        rows_before = published.get("timetableData", {}).get("timetable", [])
+        published["temporary_changes"] = active
+        rebuild_timetable_from_active_changes(published)
+        published["publishedAt"] = datetime.utcnow().isoformat() + "Z"
+        record_published_version(published, rows_before)
+        changed = True
+    return changed
 
 
-def load_reschedule_requests():
-    return read_json_file(RESCHEDULE_REQUESTS_FILE, [])
+# ----------------- Published Versions -----------------
+# Every change to the published rows bumps an integer `version` and stores the
+# value diff (rows added / removed) in a bounded `history`, so clients holding
+# version N can fetch just what changed since. A new publish starts from a
+# millisecond timestamp, so versions never repeat across publishes.
+
+PUBLISHED_HISTORY_LIMIT = 20
+
+
+ROW_MARKER_FIELDS = ("moved", "moved_from")
+
+
+def timetable_row_key(row):
+    """Placement key of a row; the moved markers alone do not make a row different."""
+    return json.dumps({k: v for k, v in row.items() if k not in ROW_MARKER_FIELDS}, sort_keys=True)
+
+
+def diff_timetable_rows(before_rows, after_rows):
+    before, after = defaultdict(list), defaultdict(list)
+    for row in before_rows:
+        before[timetable_row_key(row)].append(row)
+    for row in after_rows:
+        after[timetable_row_key(row)].append(row)
+    added, removed = [], []
+    for key, rows in after.items():
+        added.extend(rows[len(before.get(key, ())):])
+    for key, rows in before.items():
+        removed.extend(rows[len(after.get(key, ())):])
+    return {"added": added, "removed": removed}
+
+
+def start_published_version(published):
+    published["version"] = int(time.time() * 1000)
+    published["history"] = []
+
+
+def record_published_version(published, rows_before, row_changes=None):
+    """Bump the version and log its diff; `row_changes` (before/after pairs from
+    row_version_diff) skips the full-timetable comparison."""
+    if row_changes is not None:
+        row_changes = [c for c in row_changes if timetable_row_key(c["before"]) != timetable_row_key(c["after"])]
+        diff = {"added": [c["after"] for c in row_changes], "removed": [c["before"] for c in row_changes]}
+    else:
+        diff = diff_timetable_rows(rows_before, published.get("timetableData", {}).get("timetable", []))
+    published["version"] = (published.get("version") or 0) + 1
+    history = published.setdefault("history", [])
+    history.append({"version": published["version"], **copy.deepcopy(diff)})
+    del history[:-PUBLISHED_HISTORY_LIMIT]
+
+
+def published_delta_since(published, since):
+    """Net rows added/removed/moved from version `since` to now, or None if history does not reach back."""
+    version = published.get("version")
+    if version is None or since > version:
+        return None
+    entries = [h for h in published.get("history", []) if h.get("version", 0) > since]
+    if since != version and (not entries or entries[0]["version"] != since + 1):
+        return None
+
+    # Net counts per placement key; each side keeps the rows it saw, markers included.
+    added, removed = defaultdict(list), defaultdict(list)
+    for entry in entries:
+        for row in entry.get("removed", []):
+            key = timetable_row_key(row)
+            if added[key]:
+                added[key].pop()
+            else:
+                removed[key].append(row)
+        for row in entry.get("added", []):
+            key = timetable_row_key(row)
+            if removed[key]:
+                removed[key].pop()
+            else:
+                added[key].append(row)
+    return pair_moved_rows(
+        [row for rows in added.values() for row in rows],
+        [row for rows in removed.values() for row in rows]
+    )
+
+
+def pair_moved_rows(added, removed):
+    """Report an added and a removed row of the same class session as one move."""
+    def identity(row):
+        return (row.get("section"), row.get("subject"), row.get("teacher"), row.get("group"))
+
+    pending = defaultdict(list)
+    for row in added:
+        pending[identity(row)].append(row)
+    moved, removed_only = [], []
+    for row in removed:
+        candidates = pending.get(identity(row))
+        if candidates:
+            moved.append({"from": row, "to": candidates.pop(0)})
+        else:
+            removed_only.append(row)
+    added_only = [row for rows in pending.values() for row in rows]
+    return {"added": added_only, "removed": removed_only, "moved": moved}
+
 
+def filter_row_delta(delta, matches):
+    """Restrict a delta to one teacher's or section's rows; half-visible moves become adds/removes."""
+    result = {
+        "added": [r for r in delta["added"] if matches(r)],
+        "removed": [r for r in delta["removed"] if matches(r)],
+        "moved": []
+    }
+    for move in delta["moved"]:
+        before, after = matches(move["from"]), matches(move["to"])
+        if before and after:
+            result["moved"].append(move)
+        elif before:
+            result["removed"].append(move["from"])
+        elif after:
+            result["added"].append(move["to"])
+    return result
+
+
+def timetable_since_arg():
+    raw = request.args.get("since")
+    if raw in (None, ""):
+        return None, None
+    try:
+        return int(raw), None
+    except ValueError:
+        return None, "since must be an integer version"
+
+
+def temporary_changes_due(published, now=None):
+    """True when expire_temporary_changes would change `published`."""
+    if "baseTimetableData" not in published and published.get("timetableData"):
+        return True
+    now = now or datetime.utcnow()
+    for change in published.get("temporary_changes", []):
+        exp = parse_iso_utc(change.get("expiresAt"))
+        if not exp or exp <= now:
+            return True
+    return False
 
-def save_reschedule_requests():
-    write_json_file(RESCHEDULE_REQUESTS_FILE, RESCHEDULE_REQUESTS)
+
+def load_reschedule_requests():
+    return read_json_file(RESCHEDULE_REQUESTS_FILE, [])
 
 
 def get_latest_reschedule_requests():
@@ -299,8 +745,28 @@ def load_pending_registrations():
     return read_json_file(PENDING_REGISTRATIONS_FILE, [])
 
 
-def save_pending_registrations():
-    write_json_file(PENDING_REGISTRATIONS_FILE, PENDING_REGISTRATIONS)
+def take_state_item(path, item_id, check=None, missing="Not found"):
+    """Remove the entry with `item_id` from a state list in one locked update.
+
+    `check(item)` may return an (error, status) pair to leave the entry in place.
+    Returns (item, None) or (None, (error, status)); a missing id is (`missing`, 404).
+    """
+    def take(items):
+        item = next((i for i in items if i.get("id") == item_id), None)
+        if item is None:
+            return None, (missing, 404)
+        error = check(item) if check else None
+        if error:
+            return None, error
+        items[:] = [i for i in items if i is not item]
+        return item, None
+
+    return update_json_state(path, [], take, write_if=lambda result: result[0] is not None)
+
+
+def restore_state_item(path, item):
+    """Put back an entry taken with take_state_item when the follow-up write failed."""
+    update_json_state(path, [], lambda items: items.append(item))
 
 
 def get_latest_pending_registrations():
@@ -309,14 +775,26 @@ def get_latest_pending_registrations():
     return PENDING_REGISTRATIONS
 
 
-def cleanup_pending_registrations():
-    regs = get_latest_pending_registrations()
+def registration_is_live(reg, now=None):
+    """True while a registration still reserves its username and email."""
+    status = reg.get("status")
+    if status not in PENDING_REGISTRATION_STATUSES + ("approved",):
+        return False
+    if status == "pending_email_verification":
+        expires = parse_iso_utc(reg.get("verification_expires_at"))
+        if expires and expires <= (now or datetime.utcnow()):
+            return False
+    return True
+
+
+def prune_pending_registrations(regs, now=None):
+    """Return (kept, changed) after dropping resolved and expired registrations."""
     kept = []
     changed = False
-    now = datetime.utcnow()
+    now = now or datetime.utcnow()
     for reg in regs:
         status = reg.get("status")
-        if status not in ("pending_email_verification", "pending_admin_approval"):
+        if status not in PENDING_REGISTRATION_STATUSES:
             changed = True
             continue
         if status == "pending_email_verification":
@@ -330,36 +808,26 @@ def cleanup_pending_registrations():
                 reg.pop("verification_expires_at", None)
                 changed = True
         kept.append(reg)
-    if changed or len(kept) != len(regs):
-        PENDING_REGISTRATIONS[:] = kept
-        save_pending_registrations()
+    return kept, changed or len(kept) != len(regs)
 
 
-def cleanup_reschedule_requests():
-    requests = get_latest_reschedule_requests()
+def prune_reschedule_requests(requests):
     kept = [r for r in requests if r.get("status") == "pending"]
-    if len(kept) != len(requests):
-        RESCHEDULE_REQUESTS[:] = kept
-        save_reschedule_requests()
+    return kept, len(kept) != len(requests)
 
 
 def load_activity_logs():
     return read_json_file(ACTIVITY_LOG_FILE, [])
 
 
-def save_activity_logs():
-    write_json_file(ACTIVITY_LOG_FILE, ACTIVITY_LOGS)
-
-
 def get_latest_activity_logs():
     global ACTIVITY_LOGS
     ACTIVITY_LOGS = load_activity_logs()
     return ACTIVITY_LOGS
 
 
-def cleanup_activity_logs(days_to_keep=2):
-    logs = get_latest_activity_logs()
-    now = datetime.utcnow()
+def prune_activity_logs(logs, days_to_keep=2, now=None):
+    now = now or datetime.utcnow()
     keep = []
     for entry in logs:
         ts = parse_iso_utc(entry.get("createdAt"))
@@ -367,13 +835,10 @@ def cleanup_activity_logs(days_to_keep=2):
             continue
         if ts >= now - timedelta(days=days_to_keep):
             keep.append(entry)
-    if len(keep) != len(logs):
-        ACTIVITY_LOGS[:] = keep
-        save_activity_logs()
+    return keep, len(keep) != len(logs)
 
 
 def add_activity_log(event_type, message, data=None):
-    logs = get_latest_activity_logs()
     entry = {
         "id": int(datetime.utcnow().timestamp() * 1000) + random.randint(10, 999),
         "type": event_type,
@@ -381,241 +846,1067 @@ def add_activity_log(event_type, message, data=None):
         "createdAt": datetime.utcnow().isoformat() + "Z",
         "data": data or {}
     }
-    logs.append(entry)
-    cleanup_activity_logs()
-    save_activity_logs()
-    return entry
 
+    def append(logs):
+        logs.append(entry)
+        logs[:] = prune_activity_logs(logs)[0]
 
-def is_username_taken(username):
-    global USERS
-    USERS = load_users()
-    cleanup_pending_registrations()
-    uname = (username or "").strip().lower()
-    for user in USERS.values():
-        if (user.get("username") or "").strip().lower() == uname:
-            return True
+    # Append and prune in one locked update; the old reload-then-save dropped the new entry.
+    update_json_state(ACTIVITY_LOG_FILE, [], append)
+    return entry
 
-    regs = get_latest_pending_registrations()
-    for reg in regs:
-        if (reg.get("username") or "").strip().lower() == uname and reg.get("status") in (
-            "pending_email_verification", "pending_admin_approval", "approved"
-        ):
-            return True
-    return False
 
+# ----------------- Activity Feed Index -----------------
+# Activity entries sorted by (createdAt in microseconds, id) so feed pages and since-polls are
+# bisects. Both this index and the pending summary are rebuilt only when their
+# state keys' revisions change.
 
-def is_email_taken(email):
-    global USERS
-    USERS = load_users()
-    cleanup_pending_registrations()
-    normalized = (email or "").strip().lower()
-    if not normalized:
-        return False
+ACTIVITY_INDEX = {}
+PENDING_SUMMARY = {}
+ACTIVITY_FEED_MAX_LIMIT = 200
 
-    for user in USERS.values():
-        if (user.get("email") or "").strip().lower() == normalized:
-            return True
 
-    regs = get_latest_pending_registrations()
-    for reg in regs:
-        if (reg.get("email") or "").strip().lower() == normalized and reg.get("status") in (
-            "pending_email_verification", "pending_admin_approval", "approved"
-        ):
-            return True
-    return False
+def activity_entry_key(entry):
+    ts = parse_iso_utc(entry.get("createdAt"))
+    return (round(utc_timestamp(ts) * 1000000) if ts else 0, int(entry.get("id") or 0))
 
 
-def email_taken_source(email):
-    global USERS
-    USERS = load_users()
-    cleanup_pending_registrations()
-    normalized = (email or "").strip().lower()
-    if not normalized:
-        return None
+def encode_activity_cursor(key):
+    return f"{key[0]}-{key[1]}"
 
-    for username, user in USERS.items():
-        if (user.get("email") or "").strip().lower() == normalized:
-            return {
-                "source": "users",
-                "username": username,
-                "role": user.get("role"),
-                "status": user.get("status", "active")
-            }
 
-    regs = get_latest_pending_registrations()
-    for reg in regs:
-        if (reg.get("email") or "").strip().lower() == normalized and reg.get("status") in (
-            "pending_email_verification", "pending_admin_approval", "approved"
-        ):
-            return {
-                "source": "pending_registrations",
-                "username": reg.get("username"),
-                "role": reg.get("role"),
-                "status": reg.get("status"),
-                "registration_id": reg.get("id")
-            }
-    return None
+def decode_activity_cursor(value):
+    try:
+        micros, entry_id = value.split("-", 1)
+        return int(micros), int(entry_id)
+    except (AttributeError, ValueError):
+        return None
 
 
-def send_verification_email(email, code):
-    resend_api_key = os.environ.get("RESEND_API_KEY")
-    resend_from_email = os.environ.get("RESEND_FROM_EMAIL")
-    resend_from_name = os.environ.get("RESEND_FROM_NAME", "Serene Scheduler")
-
-    if resend_api_key and resend_from_email:
-        from_value = f"{resend_from_name} <{resend_from_email}>" if resend_from_name else resend_from_email
-        payload = {
-            "from": from_value,
-            "to": [email],
-            "subject": "Serene Scheduler Email Verification",
-            "html": (
-                f"<p>Your Serene Scheduler verification code is: <strong>{code}</strong></p>"
-                "<p>This code expires in 15 minutes.</p>"
-            ),
-            "text": f"Your Serene Scheduler verification code is: {code}\nThis code expires in 15 minutes."
-        }
-        req = urllib.request.Request(
-            "https://api.resend.com/emails",
-            data=json.dumps(payload).encode("utf-8"),
-            headers={
-                "Authorization": f"Bearer {resend_api_key}",
-                "Content-Type": "application/json"
-            },
-            method="POST"
-        )
-        try:
-            with urllib.request.urlopen(req, timeout=20) as response:
-                if 200 <= response.status < 300:
-                    return True, "Verification email sent via Resend"
-                body = response.read().decode("utf-8", errors="ignore")
-                return False, f"Resend failed ({response.status}): {body}"
-        except urllib.error.HTTPError as e:
-            details = e.read().decode("utf-8", errors="ignore")
-            return False, f"Resend HTTP error ({e.code}): {details}"
-        except Exception as e:
-            return False, f"Resend request failed: {e}"
-
-    smtp_host = os.environ.get("SMTP_HOST")
-    smtp_port = int(os.environ.get("SMTP_PORT", "587"))
-    smtp_user = os.environ.get("SMTP_USER")
-    smtp_pass = os.environ.get("SMTP_PASS")
-    smtp_from_email = (
-        os.environ.get("SMTP_FROM_EMAIL")
-        or os.environ.get("SMTP_FROM")
-        or smtp_user
+def get_activity_index():
+    global ACTIVITY_INDEX
+    revision = state_revision(ACTIVITY_LOG_FILE)
+    hit = ACTIVITY_INDEX.get("revision") == revision and revision is not None
+    record_cache_lookup("activity_index", hit)
+    if hit:
+        return ACTIVITY_INDEX
+    pairs = sorted(
+        ((activity_entry_key(e), e) for e in load_activity_logs() if isinstance(e, dict)),
+        key=lambda pair: pair[0]
     )
-    smtp_from_name = os.environ.get("SMTP_FROM_NAME", "Serene Scheduler")
-
-    if not smtp_host or not smtp_user or not smtp_pass or not smtp_from_email:
-        return False, "Email service not configured"
-
-    msg = MIMEText(
-        f"Your Serene Scheduler verification code is: {code}\nThis code expires in 15 minutes.",
-        "plain",
-        "utf-8"
+    ACTIVITY_INDEX = {
+        "revision": revision,
+        "keys": [key for key, _ in pairs],
+        "entries": [entry for _, entry in pairs]
+    }
+    return ACTIVITY_INDEX
+
+
+def get_pending_summary():
+    """Pending reschedule requests and teacher registrations, newest first, with counts."""
+    global PENDING_SUMMARY
+    revision = (state_revision(RESCHEDULE_REQUESTS_FILE), state_revision(PENDING_REGISTRATIONS_FILE))
+    hit = PENDING_SUMMARY.get("revision") == revision and None not in revision
+    record_cache_lookup("pending_summary", hit)
+    if hit:
+        return PENDING_SUMMARY
+
+    reschedules = sorted(
+        [r for r in load_reschedule_requests() if r.get("status") == "pending"],
+        key=lambda r: r.get("createdAt", ""),
+        reverse=True
     )
-    msg["Subject"] = "Serene Scheduler Email Verification"
-    msg["From"] = formataddr((smtp_from_name, smtp_from_email))
-    msg["To"] = email
-
-    with smtplib.SMTP(smtp_host, smtp_port, timeout=15) as server:
-        server.starttls()
-        server.login(smtp_user, smtp_pass)
-        server.sendmail(smtp_from_email, [email], msg.as_string())
+    teacher_regs = sorted(
+        [r for r in load_pending_registrations() if r.get("role") == "teacher" and r.get("status") == "pending_admin_approval"],
+        key=lambda r: r.get("created_at", ""),
+        reverse=True
+    )
+    PENDING_SUMMARY = {
+        "revision": revision,
+        "rescheduleRequests": reschedules,
+        "teacherRegistrations": teacher_regs,
+        "counts": {
+            "pendingRescheduleRequests": len(reschedules),
+            "pendingTeacherRegistrations": len(teacher_regs),
+            "totalPending": len(reschedules) + len(teacher_regs)
+        }
+    }
+    return PENDING_SUMMARY
 
-    return True, "Verification email sent"
 
+# ----------------- Expiry Scheduler -----------------
 
-def build_user_from_registration(reg):
-    role = reg.get("role")
-    base = {
-        "username": reg.get("username"),
-        "password": reg.get("password"),
-        "role": role,
-        "name": reg.get("name"),
-        "email": reg.get("email"),
-        "status": "active"
-    }
-    if role == "teacher":
-        base["teacher_name"] = reg.get("teacher_name") or reg.get("name")
-    if role == "student":
-        base["section"] = reg.get("section")
-        base["stream"] = reg.get("stream")
-        base["semester"] = reg.get("semester")
-        base["batch"] = reg.get("batch")
-        base["division"] = reg.get("division")
-    return base
+_BACKGROUND_LOCK = threading.Lock()
+_EXPIRY_THREAD_PID = None
+_WORKER_ID = None
 
 
-def slugify_username(value):
-    safe = "".join(ch.lower() if ch.isalnum() else "_" for ch in str(value))
-    safe = "_".join([part for part in safe.split("_") if part])
-    return safe or "user"
+def current_worker_id():
+    """Stable id for this process; regenerated after a fork."""
+    global _WORKER_ID
+    if not _WORKER_ID or _WORKER_ID[1] != os.getpid():
+        _WORKER_ID = (f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}", os.getpid())
+    return _WORKER_ID[0]
 
 
-def parse_semester_number(value):
-    raw = (value or "").strip().lower()
-    digits = "".join(ch for ch in raw if ch.isdigit())
-    if digits:
+def acquire_state_lease(name, owner, ttl_seconds):
+    """Take or renew a named lease in the state store. Returns True if `owner` holds it."""
+    now = time.time()
+    if MONGO_STATE_COLLECTION is not None:
         try:
-            return int(digits)
+            with timed_metric("serene_mongo_operation_duration_seconds", op="find_one_and_update"):
+                doc = MONGO_STATE_COLLECTION.find_one_and_update(
+                    {"_id": f"lease:{name}", "$or": [{"owner": owner}, {"expires": {"$lt": now}}]},
+                    {"$set": {"owner": owner, "expires": now + ttl_seconds}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            return bool(doc) and doc.get("owner") == owner
+        except DuplicateKeyError:
+            return False
         except Exception:
-            return None
-    words = {
-        "first": 1, "second": 2, "third": 3, "fourth": 4,
-        "fifth": 5, "sixth": 6, "seventh": 7, "eighth": 8
-    }
-    return words.get(raw)
+            return False
 
+    path = os.path.join(DATA_DIR, f"{name}.lease")
+    try:
+        with open(path, "a+", encoding="utf-8") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                current = json.loads(f.read() or "{}")
+            except ValueError:
+                current = {}
+            if current.get("owner") not in (None, owner) and current.get("expires", 0) > now:
+                return False
+            f.seek(0)
+            f.truncate()
+            json.dump({"owner": owner, "expires": now + ttl_seconds}, f)
+            f.flush()
+            return True
+    except OSError:
+        return False
 
-def to_roman_semester(value):
-    mapping = {1: "I", 2: "II", 3: "III", 4: "IV", 5: "V", 6: "VI", 7: "VII", 8: "VIII"}
-    sem_num = parse_semester_number(value)
-    if sem_num in mapping:
-        return mapping[sem_num]
-    return (value or "").strip().upper()
 
+def collect_expiry_deadlines(now=None):
+    """Return (epoch_seconds, kind) for every pending expiry in the state store."""
+    now = now or datetime.utcnow()
+    due_now = utc_timestamp(now)
+    deadlines = []
 
-def sync_users_from_timetable(timetable_rows):
-    teacher_names = sorted({(row.get("teacher") or "").strip() for row in timetable_rows if row.get("teacher")})
-    sections = sorted({(row.get("section") or "").strip() for row in timetable_rows if row.get("section")})
+    published = load_published_timetable()
+    if published:
+        if "baseTimetableData" not in published and published.get("timetableData"):
+            deadlines.append((due_now, "temporary_changes"))
+        for change in published.get("temporary_changes", []):
+            exp = parse_iso_utc(change.get("expiresAt"))
+            deadlines.append((utc_timestamp(exp) if exp else due_now, "temporary_changes"))
 
-    for teacher_name in teacher_names:
-        username = f"t_{slugify_username(teacher_name)}"
-        if username not in USERS:
-            USERS[username] = {
-                "username": username,
-                "password": os.environ.get("DEFAULT_TEACHER_PASSWORD", "teacher123"),
-                "role": "teacher",
-                "name": teacher_name,
-                "teacher_name": teacher_name
-            }
+    regs = load_pending_registrations()
+    if prune_pending_registrations(copy.deepcopy(regs), now)[1]:
+        deadlines.append((due_now, "pending_registrations"))
+    for reg in regs:
+        if reg.get("status") == "pending_email_verification":
+            exp = parse_iso_utc(reg.get("verification_expires_at"))
+            if exp:
+                deadlines.append((utc_timestamp(exp), "pending_registrations"))
 
-    for section in sections:
-        username = f"s_{slugify_username(section)}"
-        if username not in USERS:
-            USERS[username] = {
-                "username": username,
-                "password": os.environ.get("DEFAULT_STUDENT_PASSWORD", "student123"),
-                "role": "student",
-                "name": section,
-                "section": section
-            }
+    if prune_reschedule_requests(load_reschedule_requests())[1]:
+        deadlines.append((due_now, "reschedule_requests"))
 
-    save_users()
+    oldest_log = None
+    for entry in load_activity_logs():
+        ts = parse_iso_utc(entry.get("createdAt"))
+        if not ts:
+            oldest_log = now - timedelta(days=2)
+            break
+        if oldest_log is None or ts < oldest_log:
+            oldest_log = ts
+    if oldest_log:
+        deadlines.append((utc_timestamp(oldest_log + timedelta(days=2)), "activity_logs"))
+    return deadlines
 
 
-def get_current_user():
-    username = session.get("username")
-    if not username:
+def run_expiry_pass(kinds):
+    """Apply due expiries for the given kinds straight against the store.
+
+    Works on fresh copies rather than the module globals so request handlers in
+    the same process never see half-applied state. Each kind is one
+    update_json_state read-modify-write, so a registration, approval or log
+    entry written by a request meanwhile is never overwritten.
+    """
+    now = datetime.utcnow()
+    if "temporary_changes" in kinds:
+        def expire(published):
+            # The rows list is replaced on rebuild, so keeping the reference is enough.
+            before_changes = list((published or {}).get("temporary_changes", []))
+            before_rows = (published or {}).get("timetableData", {}).get("timetable", [])
+            return expire_temporary_changes(published, now), before_changes, before_rows
+
+        changed, before_changes, before_rows = update_json_state(
+            PUBLISHED_TIMETABLE_FILE, None, expire, write_if=lambda result: result[0]
+        )
+        if changed:
+            published = load_published_timetable() or {}
+            expired = [c for c in before_changes if c not in published.get("temporary_changes", [])]
+            if expired:
+                teachers, sections = changed_rows_audience(before_rows, published.get("timetableData", {}).get("timetable", []))
+                publish_event(
+                    "change_expired",
+                    {"changes": expired, "publishedAt": published.get("publishedAt")},
+                    teachers=teachers + [c.get("teacher") for c in expired],
+                    sections=sections
+                )
+
+    def prune_with(prune):
+        def mutate(value):
+            kept, changed = prune(value)
+            value[:] = kept
+            return changed
+        return mutate
+
+    if "pending_registrations" in kinds:
+        update_json_state(PENDING_REGISTRATIONS_FILE, [], prune_with(lambda regs: prune_pending_registrations(regs, now)),
+                          write_if=bool)
+    if "reschedule_requests" in kinds:
+        update_json_state(RESCHEDULE_REQUESTS_FILE, [], prune_with(prune_reschedule_requests), write_if=bool)
+    if "activity_logs" in kinds:
+        update_json_state(ACTIVITY_LOG_FILE, [], prune_with(lambda logs: prune_activity_logs(logs, now=now)),
+                          write_if=bool)
+
+
+def expiry_worker_loop():
+    """Elected expiry worker: only the lease holder keeps a heap and applies expiries."""
+    owner = current_worker_id()
+    heap = []
+    next_rescan = 0
+    while True:
+        try:
+            if not acquire_state_lease("expiry_worker", owner, EXPIRY_LEASE_SECONDS):
+                heap = []
+                next_rescan = 0
+                time.sleep(EXPIRY_LEASE_SECONDS / 3)
+                continue
+
+            now = time.time()
+            if now >= next_rescan:
+                heap = collect_expiry_deadlines()
+                heapq.heapify(heap)
+                next_rescan = now + EXPIRY_RESCAN_SECONDS
+
+            due = set()
+            while heap and heap[0][0] <= now:
+                due.add(heapq.heappop(heap)[1])
+            if due:
+                run_expiry_pass(due)
+                next_rescan = 0
+                continue
+
+            wake = min(next_rescan, heap[0][0]) if heap else next_rescan
+            time.sleep(max(0.05, min(wake - time.time(), EXPIRY_LEASE_SECONDS / 3)))
+        except Exception as exc:
+            print(f"[expiry] worker pass failed: {exc}")
+            time.sleep(EXPIRY_RESCAN_SECONDS)
+
+
+def start_expiry_scheduler():
+    """Start the expiry worker thread once per process (again after a fork)."""
+    global _EXPIRY_THREAD_PID
+    if not EXPIRY_SCHEDULER_ENABLED or _EXPIRY_THREAD_PID == os.getpid():
+        return
+    with _BACKGROUND_LOCK:
+        if _EXPIRY_THREAD_PID == os.getpid():
+            return
+        threading.Thread(target=expiry_worker_loop, name="expiry-worker", daemon=True).start()
+        _EXPIRY_THREAD_PID = os.getpid()
+
+
+# ----------------- User Index -----------------
+# Normalized usernames/emails across accounts and live registrations. Rebuilt
+# only when either state key's revision changes, so uniqueness checks are a
+# dict lookup and never write.
+
+def normalize_identity(value):
+    return (value or "").strip().lower()
+
+
+def registration_expiry(reg):
+    if reg.get("status") != "pending_email_verification":
         return None
-    user = USERS.get(username)
-    if not user:
+    expires = parse_iso_utc(reg.get("verification_expires_at"))
+    return utc_timestamp(expires) if expires else None
+
+
+def build_user_index(users, regs):
+    usernames = {}
+    emails = {}
+    for username, user in users.items():
+        entry = {
+            "source": "users",
+            "username": username,
+            "role": user.get("role"),
+            "status": user.get("status", "active"),
+            "expires": None
+        }
+        usernames.setdefault(normalize_identity(user.get("username")), entry)
+        if normalize_identity(user.get("email")):
+            emails.setdefault(normalize_identity(user.get("email")), entry)
+
+    now = datetime.utcnow()
+    for reg in regs:
+        if not registration_is_live(reg, now):
+            continue
+        entry = {
+            "source": "pending_registrations",
+            "username": reg.get("username"),
+            "role": reg.get("role"),
+            "status": reg.get("status"),
+            "registration_id": reg.get("id"),
+            "expires": registration_expiry(reg)
+        }
+        for table, key in ((usernames, normalize_identity(reg.get("username"))),
+                           (emails, normalize_identity(reg.get("email")))):
+            if key and key not in table:
+                table[key] = entry
+    return {"usernames": usernames, "emails": emails}
+
+
+def get_user_index():
+    """Current user index; reloads USERS and registrations only after a store write."""
+    global USER_INDEX, USERS, PENDING_REGISTRATIONS
+    revision = (state_revision(USERS_FILE), state_revision(PENDING_REGISTRATIONS_FILE))
+    index = USER_INDEX
+    hit = index.get("revision") == revision and None not in revision
+    record_cache_lookup("user_index", hit)
+    if hit:
+        return index
+
+    users = read_json_file(USERS_FILE, None)
+    if isinstance(users, dict) and users:
+        USERS = users
+    PENDING_REGISTRATIONS = load_pending_registrations()
+    index = build_user_index(USERS, PENDING_REGISTRATIONS)
+    index["revision"] = revision
+    USER_INDEX = index
+    return index
+
+
+def lookup_identity(kind, value):
+    """Index entry holding a username/email, skipping registrations whose code expired."""
+    key = normalize_identity(value)
+    if not key:
+        return None
+    entry = get_user_index()[kind].get(key)
+    if entry and entry["expires"] is not None and entry["expires"] <= utc_timestamp(datetime.utcnow()):
+        return None
+    return entry
+
+
+def public_identity_details(entry):
+    return {k: v for k, v in entry.items() if k != "expires"} if entry else None
+
+
+def is_username_taken(username):
+    return lookup_identity("usernames", username) is not None
+
+
+def is_email_taken(email):
+    return lookup_identity("emails", email) is not None
+
+
+def email_taken_source(email):
+    return public_identity_details(lookup_identity("emails", email))
+
+
+def check_registration_conflicts(username, email, index=None):
+    """One consistent index lookup for a new registration: (error, details) or (None, None)."""
+    index = index or get_user_index()
+    now = utc_timestamp(datetime.utcnow())
+
+    def live(entry):
+        return entry if entry and (entry["expires"] is None or entry["expires"] > now) else None
+
+    if live(index["usernames"].get(normalize_identity(username))):
+        return "Username already exists", None
+    email_entry = live(index["emails"].get(normalize_identity(email)))
+    if email_entry:
+        return "Email already exists", public_identity_details(email_entry)
+    return None, None
+
+
+# ----------------- Email Outbox -----------------
+# Registration emails are queued in the state store and delivered by one leased
+# sender thread, which keeps its SMTP session / HTTPS connection open between
+# messages and retries transient failures with exponential backoff.
+
+_EMAIL_SENDER_PID = None
+_EMAIL_WAKE = threading.Event()
+_EMAIL_TRANSPORT = {"smtp": None, "http": None, "last_used": 0.0}
+
+
+def email_transport_kind():
+    if os.environ.get("RESEND_API_KEY") and os.environ.get("RESEND_FROM_EMAIL"):
+        return "resend"
+    smtp_from_email = os.environ.get("SMTP_FROM_EMAIL") or os.environ.get("SMTP_FROM") or os.environ.get("SMTP_USER")
+    if os.environ.get("SMTP_HOST") and os.environ.get("SMTP_USER") and os.environ.get("SMTP_PASS") and smtp_from_email:
+        return "smtp"
+    return None
+
+
+def verification_email_message(email, code):
+    return {
+        "to": email,
+        "subject": "Serene Scheduler Email Verification",
+        "html": (
+            f"<p>Your Serene Scheduler verification code is: <strong>{code}</strong></p>"
+            "<p>This code expires in 15 minutes.</p>"
+        ),
+        "text": f"Your Serene Scheduler verification code is: {code}\nThis code expires in 15 minutes."
+    }
+
+
+def enqueue_email(message, message_id=None, ref=None):
+    """Persist a message for the background sender and return its outbox id."""
+    record = {
+        **message,
+        "id": message_id or uuid.uuid4().hex,
+        "ref": ref or {},
+        "status": "queued",
+        "attempts": 0,
+        "next_attempt_at": time.time(),
+        "last_error": None,
+        "created_at": datetime.utcnow().isoformat() + "Z"
+    }
+    update_json_state(EMAIL_OUTBOX_FILE, [], lambda outbox: outbox.append(record))
+    _EMAIL_WAKE.set()
+    start_email_sender()
+    return record["id"]
+
+
+def get_email_status(message_id):
+    for message in read_json_file(EMAIL_OUTBOX_FILE, []):
+        if message.get("id") == message_id:
+            status = message.get("status")
+            if status == "queued" and message.get("attempts"):
+                status = "retrying"
+            return {
+                "email_status": status,
+                "attempts": message.get("attempts", 0),
+                "last_error": message.get("last_error"),
+                "sent_at": message.get("sent_at")
+            }
+    return None
+
+
+def close_email_transport():
+    smtp, http = _EMAIL_TRANSPORT["smtp"], _EMAIL_TRANSPORT["http"]
+    _EMAIL_TRANSPORT.update({"smtp": None, "http": None})
+    for conn, closer in ((smtp, "quit"), (http, "close")):
+        if conn is None:
+            continue
+        try:
+            getattr(conn, closer)()
+        except Exception:
+            pass
+
+
+def deliver_via_resend(message):
+    # Imported lazily: the email stack stays off the worker boot path.
+    import http.client
+
+    from_name = os.environ.get("RESEND_FROM_NAME", "Serene Scheduler")
+    from_email = os.environ.get("RESEND_FROM_EMAIL")
+    payload = {
+        "from": f"{from_name} <{from_email}>" if from_name else from_email,
+        "to": [message["to"]],
+        "subject": message["subject"],
+        "html": message.get("html"),
+        "text": message.get("text")
+    }
+    conn = _EMAIL_TRANSPORT["http"]
+    if conn is None:
+        conn = _EMAIL_TRANSPORT["http"] = http.client.HTTPSConnection("api.resend.com", timeout=20)
+    try:
+        conn.request("POST", "/emails", body=json.dumps(payload).encode("utf-8"), headers={
+            "Authorization": f"Bearer {os.environ.get('RESEND_API_KEY')}",
+            "Content-Type": "application/json"
+        })
+        response = conn.getresponse()
+        body = response.read().decode("utf-8", errors="ignore")
+    except Exception as exc:
+        close_email_transport()
+        return False, f"Resend request failed: {exc}", True
+    if 200 <= response.status < 300:
+        return True, "Verification email sent via Resend", False
+    retryable = response.status == 429 or response.status >= 500
+    return False, f"Resend failed ({response.status}): {body}", retryable
+
+
+def deliver_via_smtp(message):
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.utils import formataddr
+
+    smtp_user = os.environ.get("SMTP_USER")
+    smtp_from_email = os.environ.get("SMTP_FROM_EMAIL") or os.environ.get("SMTP_FROM") or smtp_user
+    msg = MIMEText(message["text"], "plain", "utf-8")
+    msg["Subject"] = message["subject"]
+    msg["From"] = formataddr((os.environ.get("SMTP_FROM_NAME", "Serene Scheduler"), smtp_from_email))
+    msg["To"] = message["to"]
+
+    for attempt in range(2):
+        try:
+            server = _EMAIL_TRANSPORT["smtp"]
+            if server is None:
+                server = smtplib.SMTP(os.environ.get("SMTP_HOST"), int(os.environ.get("SMTP_PORT", "587")), timeout=15)
+                server.starttls()
+                server.login(smtp_user, os.environ.get("SMTP_PASS"))
+                _EMAIL_TRANSPORT["smtp"] = server
+            server.sendmail(smtp_from_email, [message["to"]], msg.as_string())
+            return True, "Verification email sent", False
+        except smtplib.SMTPServerDisconnected as exc:
+            # Reused session timed out on the server side: reconnect once.
+            close_email_transport()
+            if attempt:
+                return False, f"SMTP disconnected: {exc}", True
+        except smtplib.SMTPAuthenticationError as exc:
+            close_email_transport()
+            return False, f"SMTP authentication failed: {exc}", False
+        except smtplib.SMTPRecipientsRefused as exc:
+            return False, f"Recipient refused: {exc}", False
+        except Exception as exc:
+            close_email_transport()
+            return False, f"SMTP send failed: {exc}", True
+    return False, "SMTP send failed", True
+
+
+def deliver_email(message):
+    """Send one message on the shared connection: (sent, detail, retryable)."""
+    kind = email_transport_kind()
+    if kind is None:
+        return False, "Email service not configured", False
+    _EMAIL_TRANSPORT["last_used"] = time.monotonic()
+    sent, detail, retryable = deliver_via_resend(message) if kind == "resend" else deliver_via_smtp(message)
+    inc_metric("serene_email_deliveries_total", transport=kind, result="sent" if sent else ("retry" if retryable else "failed"))
+    return sent, detail, retryable
+
+
+def email_retry_delay(attempts):
+    delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def drain_email_outbox(owner):
+    """Deliver one batch of due messages; returns the epoch time of the next due message.
+
+    Messages are claimed (`sending`, owned by this worker) before delivery and
+    each result is recorded as soon as it is known, so a sender that loses its
+    lease or dies mid-batch never causes a second copy to go out.
+    """
+    now = time.time()
+
+    def claim(outbox):
+        claimed = []
+        for message in outbox:
+            if len(claimed) >= EMAIL_BATCH_SIZE:
+                break
+            due = message.get("status") == "queued" and message.get("next_attempt_at", 0) <= now
+            # A claim left behind by a dead sender is picked up once it runs out.
+            stale = message.get("status") == "sending" and message.get("claim_expires", 0) <= now
+            if due or stale:
+                message.update({"status": "sending", "claimed_by": owner, "claim_expires": now + EMAIL_LEASE_SECONDS})
+                claimed.append(copy.deepcopy(message))
+        return claimed
+
+    def record(message_id, update):
+        def apply(outbox):
+            for message in outbox:
+                if message.get("id") == message_id and message.get("claimed_by") == owner:
+                    message.update(update)
+                    message.pop("claimed_by", None)
+                    message.pop("claim_expires", None)
+                    return True
+            return False
+        update_json_state(EMAIL_OUTBOX_FILE, [], apply, write_if=bool)
+
+    claimed = update_json_state(EMAIL_OUTBOX_FILE, [], claim, write_if=bool)
+    for index, message in enumerate(claimed):
+        if not acquire_state_lease("email_sender", owner, EMAIL_LEASE_SECONDS):
+            # Lost the lease: hand the rest of the batch back untouched.
+            for rest in claimed[index:]:
+                record(rest["id"], {"status": "queued"})
+            break
+        sent, detail, retryable = deliver_email(message)
+        attempts = message.get("attempts", 0) + 1
+        update = {"attempts": attempts, "last_error": None if sent else detail}
+        if sent:
+            # The body holds the verification code; keep only delivery metadata.
+            update.update({"status": "sent", "sent_at": datetime.utcnow().isoformat() + "Z", "text": None, "html": None})
+        elif retryable and attempts < EMAIL_MAX_ATTEMPTS:
+            update.update({"status": "queued", "next_attempt_at": time.time() + email_retry_delay(attempts)})
+        else:
+            update.update({"status": "failed", "text": None, "html": None})
+        record(message["id"], update)
+
+    keep_after = now - 24 * 3600
+    next_due = [None]
+
+    def prune(outbox):
+        kept = []
+        for message in outbox:
+            status = message.get("status")
+            if status in ("sent", "failed"):
+                created = parse_iso_utc(message.get("created_at"))
+                if created and utc_timestamp(created) < keep_after:
+                    continue
+            else:
+                due_at = message.get("next_attempt_at", 0) if status == "queued" else message.get("claim_expires", 0)
+                if next_due[0] is None or due_at < next_due[0]:
+                    next_due[0] = due_at
+            kept.append(message)
+        changed = len(kept) != len(outbox)
+        outbox[:] = kept
+        return changed
+
+    update_json_state(EMAIL_OUTBOX_FILE, [], prune, write_if=bool)
+    return next_due[0]
+
+
+def email_sender_loop():
+    """Elected sender: the lease holder drains the outbox; others stand by."""
+    owner = current_worker_id()
+    while True:
+        try:
+            if not acquire_state_lease("email_sender", owner, EMAIL_LEASE_SECONDS):
+                close_email_transport()
+                _EMAIL_WAKE.wait(EMAIL_LEASE_SECONDS / 3)
+                _EMAIL_WAKE.clear()
+                continue
+            next_due = drain_email_outbox(owner)
+            if next_due is not None and next_due <= time.time():
+                continue
+            if time.monotonic() - _EMAIL_TRANSPORT["last_used"] > EMAIL_IDLE_CLOSE_SECONDS:
+                close_email_transport()
+            wait = EMAIL_POLL_SECONDS if next_due is None else min(EMAIL_POLL_SECONDS, next_due - time.time())
+            _EMAIL_WAKE.wait(max(0.05, wait))
+            _EMAIL_WAKE.clear()
+        except Exception as exc:
+            print(f"[email] sender pass failed: {exc}")
+            close_email_transport()
+            time.sleep(EMAIL_POLL_SECONDS)
+
+
+def start_email_sender():
+    """Start the outbox sender once per process when an email transport is configured."""
+    global _EMAIL_SENDER_PID
+    if email_transport_kind() is None or _EMAIL_SENDER_PID == os.getpid():
+        return
+    with _BACKGROUND_LOCK:
+        if _EMAIL_SENDER_PID == os.getpid():
+            return
+        threading.Thread(target=email_sender_loop, name="email-sender", daemon=True).start()
+        _EMAIL_SENDER_PID = os.getpid()
+
+
+def student_section_from_fields(stream, semester, batch, division, section=""):
+    """Canonical section name for a student from stream/semester/batch/division."""
+    stream_key = stream.replace(" ", "")
+    if stream_key in ("AIML", "AI&ML", "AI/ML"):
+        stream_key = "AI&ML"
+
+    if stream_key == "CSE":
+        sem_label = to_roman_semester(semester)
+        batch_label = (batch or "Batch-1").strip()
+        return f"B.TECH CSE {sem_label} Sem {batch_label} - {division}"
+    if stream_key == "IT":
+        sem_label = to_roman_semester(semester)
+        return f"B.TECH IT {sem_label} Sem - {division}"
+    if stream_key == "AI&ML":
+        sem_label = (semester or "6th").strip()
+        return f"AI & ML {sem_label} Sem - {division}"
+    if stream and semester and division:
+        return f"{stream} {semester} Sem - {division}"
+    return section
+
+
+def parse_registration_fields(payload, require_password=True):
+    """Normalize and validate a registration payload: (fields, error message)."""
+    fields = {
+        "role": (payload.get("role") or "").strip().lower(),
+        "username": (payload.get("username") or "").strip(),
+        "password": payload.get("password") or "",
+        "name": (payload.get("name") or "").strip(),
+        "email": (payload.get("email") or "").strip().lower(),
+        "teacher_name": (payload.get("teacher_name") or "").strip(),
+        "section": (payload.get("section") or "").strip(),
+        "stream": (payload.get("stream") or "").strip().upper(),
+        "semester": (payload.get("semester") or "").strip(),
+        "batch": (payload.get("batch") or "").strip(),
+        "division": (payload.get("division") or "").strip().upper()
+    }
+
+    if fields["role"] not in ("student", "teacher"):
+        return None, "Role must be student or teacher"
+    if not fields["username"] or (require_password and not fields["password"]) or not fields["name"] or not fields["email"]:
+        return None, "username, password, name and email are required"
+    if "@" not in fields["email"]:
+        return None, "Invalid email"
+    if fields["role"] == "student":
+        if not fields["division"]:
+            fields["division"] = "A"
+        fields["section"] = student_section_from_fields(
+            fields["stream"], fields["semester"], fields["batch"], fields["division"], fields["section"]
+        )
+        if not fields["section"]:
+            return None, "Provide section or stream + semester + division for student registration"
+    return fields, None
+
+
+def registration_resolution(reg, status, reason=None):
+    resolved = {
+        "id": reg.get("id"),
+        "username": reg.get("username"),
+        "role": reg.get("role"),
+        "status": status,
+        "resolved_by": current_username(),
+        "resolved_at": datetime.utcnow().isoformat() + "Z"
+    }
+    if reason is not None:
+        resolved["reason"] = reason
+    return resolved
+
+
+def build_user_from_registration(reg):
+    role = reg.get("role")
+    base = {
+        "username": reg.get("username"),
+        "password": reg.get("password"),
+        "role": role,
+        "name": reg.get("name"),
+        "email": reg.get("email"),
+        "status": "active"
+    }
+    if role == "teacher":
+        base["teacher_name"] = reg.get("teacher_name") or reg.get("name")
+    if role == "student":
+        base["section"] = reg.get("section")
+        base["stream"] = reg.get("stream")
+        base["semester"] = reg.get("semester")
+        base["batch"] = reg.get("batch")
+        base["division"] = reg.get("division")
+    return base
+
+
+def slugify_username(value):
+    safe = "".join(ch.lower() if ch.isalnum() else "_" for ch in str(value))
+    safe = "_".join([part for part in safe.split("_") if part])
+    return safe or "user"
+
+
+def parse_semester_number(value):
+    raw = (value or "").strip().lower()
+    digits = "".join(ch for ch in raw if ch.isdigit())
+    if digits:
+        try:
+            return int(digits)
+        except Exception:
+            return None
+    words = {
+        "first": 1, "second": 2, "third": 3, "fourth": 4,
+        "fifth": 5, "sixth": 6, "seventh": 7, "eighth": 8
+    }
+    return words.get(raw)
+
+
+def to_roman_semester(value):
+    mapping = {1: "I", 2: "II", 3: "III", 4: "IV", 5: "V", 6: "VI", 7: "VII", 8: "VIII"}
+    sem_num = parse_semester_number(value)
+    if sem_num in mapping:
+        return mapping[sem_num]
+    return (value or "").strip().upper()
+
+
+def sync_users_from_timetable(timetable_rows):
+    """Create accounts for timetable teachers/sections that do not have one yet.
+
+    Diffs against the stored users (not this worker's USERS copy) and adds all
+    new accounts in one locked read-modify-write, skipping the write when
+    nothing is missing. Returns {"teachers": created, "students": created}.
+    """
+    wanted = {}
+    for row in timetable_rows:
+        teacher_name = (row.get("teacher") or "").strip()
+        if teacher_name:
+            wanted.setdefault(f"t_{slugify_username(teacher_name)}", ("teacher", teacher_name))
+        section = (row.get("section") or "").strip()
+        if section:
+            wanted.setdefault(f"s_{slugify_username(section)}", ("student", section))
+
+    stored = read_json_file(USERS_FILE, {}) or USERS
+    missing = {username: spec for username, spec in wanted.items() if username not in stored}
+    created = {"teachers": 0, "students": 0}
+    if not missing:
+        return created
+
+    # Default passwords get a cheap provisional hash, salted per account and made
+    # before the store update so a Mongo retry of add_missing does not hash again.
+    # The first login upgrades it to the full work factor, so publishing a large
+    # timetable never pays for hundreds of full-strength KDF runs.
+    default_passwords = {
+        "teacher": os.environ.get("DEFAULT_TEACHER_PASSWORD", "teacher123"),
+        "student": os.environ.get("DEFAULT_STUDENT_PASSWORD", "student123")
+    }
+    hashes = {
+        username: hash_password(default_passwords[role], PROVISIONAL_HASH_ITERATIONS)
+        for username, (role, _) in missing.items()
+    }
+
+    def add_missing(users):
+        # Mongo retries this callback on a rev conflict; count only the attempt that commits.
+        created.update(teachers=0, students=0)
+        if not users:
+            # Unreadable or missing store value: never replace the account list with just the new ones.
+            users.update(copy.deepcopy(USERS))
+        for username, (role, display_name) in sorted(missing.items()):
+            if username in users:
+                continue
+            record = {
+                "username": username,
+                "password": hashes[username],
+                "role": role,
+                "name": display_name
+            }
+            record["teacher_name" if role == "teacher" else "section"] = display_name
+            users[username] = record
+            created["teachers" if role == "teacher" else "students"] += 1
+
+    update_json_state(USERS_FILE, {}, add_missing)
+    get_user_index()
+    return created
+
+
+# ----------------- Credentials -----------------
+# Passwords are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>". Plaintext
+# records from older data files are accepted once and rehashed on login, as are
+# hashes below the configured PASSWORD_HASH_ITERATIONS.
+
+PASSWORD_HASH_PREFIX = "pbkdf2_sha256"
+PROVISIONAL_HASH_ITERATIONS = 1000  # synced accounts' shared default passwords, upgraded on first login
+_LOGIN_CACHE = OrderedDict()  # (username, keyed password digest) -> (stored hash, expires)
+_LOGIN_CACHE_LOCK = threading.Lock()
+_LOGIN_CACHE_KEY = secrets.token_bytes(32)
+
+
+def hash_password(password, iterations=None):
+    iterations = iterations or PASSWORD_HASH_ITERATIONS
+    salt = base64.b64encode(secrets.token_bytes(16)).decode("ascii").rstrip("=")
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("ascii"), iterations)
+    return f"{PASSWORD_HASH_PREFIX}${iterations}${salt}${base64.b64encode(digest).decode('ascii')}"
+
+
+def hash_passwords(passwords):
+    """Hash many passwords, each with its own salt; pbkdf2_hmac releases the GIL, so they run in parallel."""
+    if len(passwords) < 2:
+        return [hash_password(password) for password in passwords]
+    with ThreadPoolExecutor(max_workers=min(len(passwords), os.cpu_count() or 1)) as pool:
+        return list(pool.map(hash_password, passwords))
+
+
+def is_password_hash(value):
+    return isinstance(value, str) and value.startswith(PASSWORD_HASH_PREFIX + "$")
+
+
+def verify_password(stored, password):
+    """Return (matches, needs_rehash) for a stored hash or legacy plaintext value."""
+    if not stored or not password:
+        return False, False
+    if not is_password_hash(stored):
+        return hmac.compare_digest(str(stored).encode("utf-8"), password.encode("utf-8")), True
+    try:
+        _, iterations, salt, expected = stored.split("$", 3)
+        iterations = int(iterations)
+    except ValueError:
+        return False, False
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("ascii"), iterations)
+    matches = hmac.compare_digest(base64.b64encode(digest).decode("ascii"), expected)
+    return matches, matches and iterations < PASSWORD_HASH_ITERATIONS
+
+
+def login_cache_key(username, password):
+    # Keyed digest so the cache never holds anything usable as a password verifier offline.
+    return username, hmac.new(_LOGIN_CACHE_KEY, password.encode("utf-8"), hashlib.sha256).digest()
+
+
+def login_cache_hit(key, stored):
+    if not LOGIN_CACHE_TTL_SECONDS or not LOGIN_CACHE_SIZE:
+        return False
+    with _LOGIN_CACHE_LOCK:
+        cached = _LOGIN_CACHE.get(key)
+        if not cached:
+            return False
+        cached_hash, expires = cached
+        # A changed stored hash (password reset, rehash) invalidates the entry.
+        if cached_hash != stored or expires <= time.monotonic():
+            _LOGIN_CACHE.pop(key, None)
+            return False
+        _LOGIN_CACHE.move_to_end(key)
+        return True
+
+
+def remember_login(key, stored):
+    if not LOGIN_CACHE_TTL_SECONDS or not LOGIN_CACHE_SIZE:
+        return
+    with _LOGIN_CACHE_LOCK:
+        _LOGIN_CACHE[key] = (stored, time.monotonic() + LOGIN_CACHE_TTL_SECONDS)
+        _LOGIN_CACHE.move_to_end(key)
+        while len(_LOGIN_CACHE) > LOGIN_CACHE_SIZE:
+            _LOGIN_CACHE.popitem(last=False)
+
+
+def check_user_password(username, user, password):
+    """Verify a login, using the short-TTL cache and migrating weak or plaintext records."""
+    stored = (user or {}).get("password")
+    key = login_cache_key(username, password)
+    hit = login_cache_hit(key, stored)
+    record_cache_lookup("login_verification", hit)
+    if hit:
+        return True
+
+    matches, needs_rehash = verify_password(stored, password)
+    if not matches:
+        return False
+    if needs_rehash:
+        rehashed = hash_password(password)
+
+        def upgrade(users):
+            # Only this record, and only if nobody changed the password meanwhile.
+            record = users.get(username)
+            if not isinstance(record, dict) or record.get("password") != stored:
+                return False
+            record["password"] = rehashed
+            return True
+
+        if update_json_state(USERS_FILE, {}, upgrade, write_if=bool):
+            user["password"] = stored = rehashed
+    remember_login(key, stored)
+    return True
+
+
+# ----------------- Session Tokens -----------------
+# Logins issue a signed, expiring token carrying the public user claims plus a
+# revocation version, so auth checks need no USERS lookup and work the same on
+# every worker. Revocation versions live in the state store and are re-checked
+# at most every REVOCATION_CHECK_SECONDS.
+
+SESSION_TOKEN_CLAIMS = (
+    "username", "role", "name", "teacher_name", "section", "email", "stream", "semester", "batch", "division"
+)
+_REVOCATION_CACHE = {"checked": 0.0, "revision": None, "value": {"all": 0, "users": {}}}
+
+
+def session_serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt="serene-session-token")
+
+
+def load_session_revocations():
+    value = read_json_file(SESSION_REVOCATIONS_FILE, {"all": 0, "users": {}})
+    if not isinstance(value, dict):
+        value = {"all": 0, "users": {}}
+    value.setdefault("all", 0)
+    value.setdefault("users", {})
+    return value
+
+
+def get_session_revocations():
+    cache = _REVOCATION_CACHE
+    now = time.monotonic()
+    if now - cache["checked"] < REVOCATION_CHECK_SECONDS and cache["revision"] is not None:
+        return cache["value"]
+    revision = state_revision(SESSION_REVOCATIONS_FILE)
+    hit = revision == cache["revision"] and revision is not None
+    record_cache_lookup("session_revocations", hit)
+    if not hit:
+        cache["value"] = load_session_revocations()
+        cache["revision"] = revision
+    cache["checked"] = now
+    return cache["value"]
+
+
+def revocation_version(username, revocations=None):
+    revocations = revocations or get_session_revocations()
+    return [revocations.get("all", 0), revocations.get("users", {}).get(username, 0)]
+
+
+def revoke_sessions(username=None):
+    """Invalidate outstanding tokens for one user, or for everyone when username is None."""
+    def bump(revocations):
+        revocations.setdefault("all", 0)
+        users = revocations.setdefault("users", {})
+        if username is None:
+            revocations["all"] += 1
+        else:
+            users[username] = users.get(username, 0) + 1
+        return copy.deepcopy(revocations)
+
+    revocations = update_json_state(SESSION_REVOCATIONS_FILE, {"all": 0, "users": {}}, bump)
+    _REVOCATION_CACHE.update({"checked": 0.0, "revision": None})
+    return revocations
+
+
+def issue_session_token(user):
+    claims = {key: user.get(key) for key in SESSION_TOKEN_CLAIMS}
+    claims["name"] = user.get("name", user.get("username"))
+    claims["rv"] = revocation_version(user.get("username"))
+    return session_serializer().dumps(claims)
+
+
+def read_session_token(token):
+    try:
+        claims = session_serializer().loads(token, max_age=SESSION_TOKEN_MAX_AGE)
+    except (BadSignature, SignatureExpired):
+        return None
+    if not isinstance(claims, dict) or not claims.get("username"):
         return None
+    if claims.get("rv") != revocation_version(claims["username"]):
+        return None
+    return {key: claims.get(key) for key in SESSION_TOKEN_CLAIMS}
+
+
+def request_session_token():
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        return header[len("Bearer "):].strip()
+    return session.get("token")
+
+
+def get_current_user():
+    if "current_user" in g:
+        return g.current_user
+    user = None
+    token = request_session_token()
+    if token:
+        user = read_session_token(token)
+    elif session.get("username"):
+        # Cookie from before session tokens were issued: it predates every
+        # revocation, so honour it only while nothing has been revoked for this
+        # user, and swap it for a token so later revokes reach it too.
+        username = session.pop("username")
+        get_user_index()
+        user = USERS.get(username)
+        if user and revocation_version(username) == [0, 0]:
+            session["token"] = issue_session_token(user)
+            user = read_session_token(session["token"])
+        else:
+            user = None
+    g.current_user = user
     return user
 
 
+def current_username():
+    user = get_current_user()
+    return user.get("username") if user else None
+
+
 def public_user(user):
     if not user:
         return None
@@ -875,57 +2166,387 @@ def make_empty_timetable(data):
 
 
 
-# ----------------- Scheduler Core -----------------
+# ----------------- Generation Profiling -----------------
 
+_PROFILE_LOCAL = threading.local()
+GENERATION_PROFILE_TOTALS = {"runs": 0, "phases": defaultdict(float), "counters": defaultdict(int), "rejections": defaultdict(int)}
+LAST_GENERATION_PROFILE = None
+_PROFILE_TOTALS_LOCK = threading.Lock()
 
-def slot_blocks_order(data, duration=2):
-    slots = data["slots"]
-    blocks = []
-    if duration <= 1:
-        return [[s] for s in slots if s != "Lunch Break"]
-    for i in range(len(slots) - duration + 1):
-        candidate = slots[i:i + duration]
-        # Never allow a single lab block to cross lunch.
-        if "Lunch Break" in candidate:
-            continue
-        blocks.append(candidate)
-    # Prefer earlier contiguous blocks first.
-    return blocks
 
+def new_generation_profile():
+    return {
+        "started": time.perf_counter(),
+        "phases": {},
+        "counters": defaultdict(int),
+        "rejections": {"labs": defaultdict(int), "theory": defaultdict(int)}
+    }
 
 
-def teacher_unavailable_on(teacher, day, slot, data):
-    if not teacher:
-        return False
-    unavail = data.get("teacher_unavailability", {})
-    if teacher not in unavail:
-        return False
-    for u in unavail[teacher]:
-        if u.get("day") == day and u.get("slot") == slot:
-            return True
+def active_profile():
+    return getattr(_PROFILE_LOCAL, "profile", None)
+
+
+@contextmanager
+def generation_profiling(profile):
+    """Make `profile` the active profile for scheduler code on this thread."""
+    previous = active_profile()
+    _PROFILE_LOCAL.profile = profile
+    try:
+        yield profile
+    finally:
+        _PROFILE_LOCAL.profile = previous
+
+
+@contextmanager
+def profile_phase(name):
+    profile = active_profile()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase = profile["phases"].setdefault(name, {"seconds": 0.0, "calls": 0})
+        phase["seconds"] += time.perf_counter() - start
+        phase["calls"] += 1
+
+
+def profile_count(name, amount=1):
+    profile = active_profile()
+    if profile is not None:
+        profile["counters"][name] += amount
+
+
+def profile_rejections(stage):
+    """Probe/rejection counters for `stage` ("labs"/"theory"), or None when not profiling."""
+    profile = active_profile()
+    if profile is None:
+        return None
+    return profile["rejections"][stage]
+
+
+def export_generation_profile(profile):
+    return {
+        "total_seconds": round(time.perf_counter() - profile["started"], 6),
+        "phases": {
+            name: {"seconds": round(phase["seconds"], 6), "calls": phase["calls"]}
+            for name, phase in profile["phases"].items()
+        },
+        "counters": dict(profile["counters"]),
+        "probes": {stage: reasons.get("probes", 0) for stage, reasons in profile["rejections"].items()},
+        "rejections": {
+            stage: {reason: value for reason, value in reasons.items() if reason != "probes"}
+            for stage, reasons in profile["rejections"].items()
+        }
+    }
+
+
+def record_generation_profile(exported):
+    """Fold one exported profile into the process-wide totals used for Prometheus export."""
+    global LAST_GENERATION_PROFILE
+    with _PROFILE_TOTALS_LOCK:
+        GENERATION_PROFILE_TOTALS["runs"] += 1
+        for name, phase in exported["phases"].items():
+            GENERATION_PROFILE_TOTALS["phases"][name] += phase["seconds"]
+        for name, value in exported["counters"].items():
+            GENERATION_PROFILE_TOTALS["counters"][name] += value
+        for stage, value in exported["probes"].items():
+            GENERATION_PROFILE_TOTALS["counters"][f"{stage}_probes"] += value
+        for stage, reasons in exported["rejections"].items():
+            for reason, value in reasons.items():
+                GENERATION_PROFILE_TOTALS["rejections"][(stage, reason)] += value
+        LAST_GENERATION_PROFILE = exported
+
+
+def generation_profile_prometheus_lines():
+    with _PROFILE_TOTALS_LOCK:
+        totals = {
+            "runs": GENERATION_PROFILE_TOTALS["runs"],
+            "phases": dict(GENERATION_PROFILE_TOTALS["phases"]),
+            "counters": dict(GENERATION_PROFILE_TOTALS["counters"]),
+            "rejections": dict(GENERATION_PROFILE_TOTALS["rejections"])
+        }
+    lines = [
+        "# HELP serene_generation_profiled_runs_total Timetable generations that collected a profile.",
+        "# TYPE serene_generation_profiled_runs_total counter",
+        f"serene_generation_profiled_runs_total {totals['runs']}",
+        "# HELP serene_generation_phase_seconds_total Time spent per generation phase.",
+        "# TYPE serene_generation_phase_seconds_total counter",
+    ]
+    for name, seconds in sorted(totals["phases"].items()):
+        lines.append(f'serene_generation_phase_seconds_total{{phase="{prometheus_label_value(name)}"}} {seconds:.6f}')
+    lines += [
+        "# HELP serene_generation_events_total Solver events (probes, placements, swaps).",
+        "# TYPE serene_generation_events_total counter",
+    ]
+    for name, value in sorted(totals["counters"].items()):
+        lines.append(f'serene_generation_events_total{{event="{prometheus_label_value(name)}"}} {value}')
+    lines += [
+        "# HELP serene_generation_rejections_total Placement probes rejected, by stage and reason.",
+        "# TYPE serene_generation_rejections_total counter",
+    ]
+    for (stage, reason), value in sorted(totals["rejections"].items()):
+        lines.append(
+            f'serene_generation_rejections_total{{stage="{prometheus_label_value(stage)}",reason="{prometheus_label_value(reason)}"}} {value}'
+        )
+    return lines
+
+
+# ----------------- Event Bus -----------------
+# Typed events are appended to a shared log (events.log in DATA_DIR, or the
+# app_events collection on Mongo). One reader thread per worker tails it and
+# fans events out to that worker's SSE subscribers, so an event published in
+# any worker reaches every connected dashboard.
+
+EVENTS_LOG_MAX_BYTES = 5 * 1024 * 1024
+EVENT_POLL_SECONDS = 0.25
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_STREAM_MAX_SECONDS = max(30, int(os.environ.get("EVENT_STREAM_MAX_SECONDS", "300")))
+EVENT_QUEUE_SIZE = 256
+# Each open stream holds one gthread worker thread; keep at least two threads for the API.
+EVENT_STREAMS_PER_WORKER = max(1, int(os.environ.get(
+    "EVENT_STREAMS_PER_WORKER", str(max(1, int(os.environ.get("GUNICORN_THREADS", "8")) - 2))
+)))
+EVENT_STREAM_BUSY_RETRY_MS = 15000
+_EVENT_SUBSCRIBERS = set()
+_EVENT_SUBSCRIBERS_LOCK = threading.Lock()
+_EVENT_RECENT = deque(maxlen=500)
+_EVENT_READER_PID = None
+
+
+def events_collection():
+    return MONGO_STATE_COLLECTION.database["app_events"]
+
+
+def publish_event(event_type, data=None, roles=(), teachers=(), sections=()):
+    """Publish an event to dashboards of the given roles, teachers and sections (admins see all)."""
+    event = {
+        "id": f"{time.time_ns()}-{uuid.uuid4().hex[:8]}",
+        "type": event_type,
+        "data": data or {},
+        "audience": {
+            "roles": sorted(set(roles)),
+            "teachers": sorted({t for t in teachers if t}),
+            "sections": sorted({s for s in sections if s})
+        },
+        "createdAt": datetime.utcnow().isoformat() + "Z"
+    }
+    try:
+        if MONGO_STATE_COLLECTION is not None:
+            events_collection().insert_one({**event, "_id": event["id"], "ts_ns": time.time_ns(), "created": datetime.utcnow()})
+        else:
+            line = json.dumps(event) + "\n"
+            with state_file_lock(EVENTS_LOG_FILE):
+                if os.path.exists(EVENTS_LOG_FILE) and os.path.getsize(EVENTS_LOG_FILE) > EVENTS_LOG_MAX_BYTES:
+                    os.replace(EVENTS_LOG_FILE, EVENTS_LOG_FILE + ".1")
+                with open(EVENTS_LOG_FILE, "a", encoding="utf-8") as f:
+                    f.write(line)
+        inc_metric("serene_events_published_total", type=event_type)
+    except Exception as exc:
+        # Notifications are best effort; the state change itself already succeeded.
+        print(f"[events] publish failed: {exc}")
+    start_event_reader()
+    return event
+
+
+def dispatch_event(event):
+    event = {k: v for k, v in event.items() if k not in ("_id", "ts_ns", "created")}
+    _EVENT_RECENT.append(event)
+    with _EVENT_SUBSCRIBERS_LOCK:
+        subscribers = list(_EVENT_SUBSCRIBERS)
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            # Slow consumer: end its stream; the client reconnects with Last-Event-ID.
+            with _EVENT_SUBSCRIBERS_LOCK:
+                _EVENT_SUBSCRIBERS.discard(subscriber)
+            try:
+                subscriber.get_nowait()
+                subscriber.put_nowait(None)
+            except (queue.Empty, queue.Full):
+                pass
+
+
+def tail_event_log():
+    handle, inode = None, None
+    # Only events published after this worker started are delivered; a log
+    # created later is read from its first line.
+    skip_existing = os.path.exists(EVENTS_LOG_FILE)
+    while True:
+        if handle is None:
+            try:
+                handle = open(EVENTS_LOG_FILE, "r", encoding="utf-8")
+            except FileNotFoundError:
+                time.sleep(EVENT_POLL_SECONDS)
+                continue
+            inode = os.fstat(handle.fileno()).st_ino
+            if skip_existing:
+                handle.seek(0, os.SEEK_END)
+        position = handle.tell()
+        line = handle.readline()
+        if line.endswith("\n"):
+            try:
+                dispatch_event(json.loads(line))
+            except ValueError:
+                pass
+            continue
+        handle.seek(position)  # partial line: wait for the writer to finish it
+        try:
+            rotated = os.stat(EVENTS_LOG_FILE).st_ino != inode
+        except FileNotFoundError:
+            rotated = False
+        if rotated and not line:
+            # The renamed file is fully read; continue at the start of the new one.
+            handle.close()
+            handle = open(EVENTS_LOG_FILE, "r", encoding="utf-8")
+            inode = os.fstat(handle.fileno()).st_ino
+            continue
+        time.sleep(EVENT_POLL_SECONDS)
+
+
+def tail_event_collection():
+    collection = events_collection()
+    try:
+        collection.create_index("ts_ns")
+        collection.create_index("created", expireAfterSeconds=24 * 3600)
+    except Exception:
+        pass
+    try:
+        with collection.watch([{"$match": {"operationType": "insert"}}], full_document="updateLookup") as stream:
+            for change in stream:
+                dispatch_event(change["fullDocument"])
+    except Exception as exc:
+        # Change streams need a replica set; poll on standalone servers.
+        print(f"[events] change stream unavailable, polling: {exc}")
+    last = time.time_ns()
+    while True:
+        for doc in collection.find({"ts_ns": {"$gt": last}}).sort("ts_ns", 1):
+            last = doc["ts_ns"]
+            dispatch_event(doc)
+        time.sleep(EVENT_POLL_SECONDS * 4)
+
+
+def event_reader_loop():
+    while True:
+        try:
+            if MONGO_STATE_COLLECTION is not None:
+                tail_event_collection()
+            else:
+                tail_event_log()
+        except Exception as exc:
+            print(f"[events] reader failed: {exc}")
+            time.sleep(1)
+
+
+def start_event_reader():
+    global _EVENT_READER_PID
+    if _EVENT_READER_PID == os.getpid():
+        return
+    with _BACKGROUND_LOCK:
+        if _EVENT_READER_PID == os.getpid():
+            return
+        _EVENT_RECENT.clear()
+        threading.Thread(target=event_reader_loop, name="event-reader", daemon=True).start()
+        _EVENT_READER_PID = os.getpid()
+
+
+def event_visible_to(event, user):
+    if user.get("role") == "admin":
+        return True
+    audience = event.get("audience") or {}
+    if user.get("role") in audience.get("roles", []):
+        return True
+    if user.get("role") == "teacher":
+        teachers = {normalize_identity(t) for t in audience.get("teachers", [])}
+        return normalize_identity(teacher_display_name(user)) in teachers
+    if user.get("role") == "student":
+        return user.get("section") in audience.get("sections", [])
+    return False
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def changed_rows_audience(before_rows, after_rows):
+    """Teachers and sections whose rows differ between two row lists."""
+    def row_key(row):
+        return tuple(sorted((k, str(v)) for k, v in row.items()))
+
+    before = {row_key(r): r for r in before_rows}
+    after = {row_key(r): r for r in after_rows}
+    changed = [before[k] for k in before.keys() - after.keys()] + [after[k] for k in after.keys() - before.keys()]
+    return (
+        sorted({r.get("teacher") for r in changed if r.get("teacher")}),
+        sorted({r.get("section") for r in changed if r.get("section")})
+    )
+
+
+# ----------------- Scheduler Core -----------------
+
+
+def slot_blocks_order(data, duration=2):
+    slots = data["slots"]
+    blocks = []
+    if duration <= 1:
+        return [[s] for s in slots if s != "Lunch Break"]
+    for i in range(len(slots) - duration + 1):
+        candidate = slots[i:i + duration]
+        # Never allow a single lab block to cross lunch.
+        if "Lunch Break" in candidate:
+            continue
+        blocks.append(candidate)
+    # Prefer earlier contiguous blocks first.
+    return blocks
+
+
+
+def teacher_unavailable_on(teacher, day, slot, data):
+    if not teacher:
+        return False
+    unavail = data.get("teacher_unavailability", {})
+    if teacher not in unavail:
+        return False
+    for u in unavail[teacher]:
+        if u.get("day") == day and u.get("slot") == slot:
+            return True
     return False
 
 
 
 def can_place_block(timetable, secname, day, block_slots, room, teacher, used_rooms, used_teachers, data):
+    reason = block_rejection_reason(timetable, secname, day, block_slots, room, teacher, used_rooms, used_teachers, data)
+    if reason is None:
+        return True
+    rejections = profile_rejections("labs")
+    if rejections is not None:
+        rejections[reason] += 1
+    return False
+
+
+def block_rejection_reason(timetable, secname, day, block_slots, room, teacher, used_rooms, used_teachers, data):
+    """Why a block cannot be placed, or None when it fits."""
     max_teacher_daily = int(data.get("constraints", {}).get("max_lectures_per_day_teacher", 5))
     if teacher:
         current_teacher_hours = sum(1 for t, d, _ in used_teachers if t == teacher and d == day)
         if current_teacher_hours + len(block_slots) > max_teacher_daily:
-            return False
+            return "teacher_daily_cap"
     for slot in block_slots:
         existing = timetable[secname][day][slot]
         if any(entry and entry[0] not in ("FREE",) for entry in existing):
-            return False
+            return "section_busy"
         if room and (room, day, slot) in used_rooms:
-            return False
+            return "room_clash"
         if teacher and (teacher, day, slot) in used_teachers:
-            return False
+            return "teacher_clash"
         if teacher and has_adjacent_lab_for_teacher(timetable, teacher, day, slot, data):
-            return False
+            return "adjacency"
         if teacher_unavailable_on(teacher, day, slot, data):
-            return False
-    return True
+            return "unavailability"
+    return None
 
 
 def has_adjacent_lab_for_teacher(timetable, teacher, day, slot, data):
@@ -952,7 +2573,14 @@ def has_adjacent_lab_for_teacher(timetable, teacher, day, slot, data):
     return False
 
 
-def assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms):
+def seed_reserved_occupancy(used_rooms, used_teachers, reserved):
+    """Pre-book (room, day, slot) / (teacher, day, slot) keys held by other timetables."""
+    if reserved:
+        used_rooms |= reserved.get("rooms", set())
+        used_teachers |= reserved.get("teachers", set())
+
+
+def assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms, reserved=None):
     days = data["days"]
     lab_rooms_map = data.get("lab_rooms", {})
     lab_groups_map = get_lab_groups_map(data)
@@ -960,6 +2588,7 @@ def assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms):
     default_lab_duration = int(constraints.get("lab_session_duration", 2))
     max_teacher_daily = int(constraints.get("max_lectures_per_day_teacher", 5))
     lab_durations = data.get("lab_durations", {})
+    rejections = profile_rejections("labs")
 
 
     tasks = []
@@ -984,6 +2613,7 @@ def assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms):
 
     used_rooms = set()
     used_teachers = set()
+    seed_reserved_occupancy(used_rooms, used_teachers, reserved)
     used_group_day = set()  # (section, group_index, day)
     group_session_count = defaultdict(int)  # (section, group_index) -> assigned labs count
     slots_no_lunch = [s for s in data.get("slots", []) if s != "Lunch Break"]
@@ -1015,154 +2645,147 @@ def assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms):
     max_duration = max((t.get("duration", 2) for t in tasks), default=2)
     blocks_by_duration = {d: slot_blocks_order(data, d) for d in range(1, max_duration + 1)}
 
-    for duration in range(max_duration, 0, -1):
-        duration_tasks_exist = any((not t["assigned"]) and t.get("duration", 2) == duration for t in tasks)
-        if not duration_tasks_exist:
-            continue
-        slot_blocks = blocks_by_duration.get(duration, [])
-        for block in slot_blocks:
-            if all(t["assigned"] for t in tasks):
-                break
-            for day in days:
+    with profile_phase("labs.primary"):
+        for duration in range(max_duration, 0, -1):
+            duration_tasks_exist = any((not t["assigned"]) and t.get("duration", 2) == duration for t in tasks)
+            if not duration_tasks_exist:
+                continue
+            slot_blocks = blocks_by_duration.get(duration, [])
+            for block in slot_blocks:
                 if all(t["assigned"] for t in tasks):
                     break
-                for sec in data["sections"]:
-                    secname = sec["name"]
-                    pending = [
-                        t for t in tasks
-                        if (not t["assigned"]) and t["section"] == secname and t.get("duration", 2) == duration
-                    ]
-                    if not pending:
-                        continue
-                    # Fairness: prefer groups with fewer assigned labs; rotate ties by day.
-                    day_index = days.index(day)
-                    total_groups = lab_groups_map[secname]
-                    pending = sorted(
-                        pending,
-                        key=lambda t: (
-                            group_session_count[(secname, t["group_index"])],
-                            ((t["group_index"] - day_index) % max(1, total_groups))
+                for day in days:
+                    if all(t["assigned"] for t in tasks):
+                        break
+                    for sec in data["sections"]:
+                        secname = sec["name"]
+                        pending = [
+                            t for t in tasks
+                            if (not t["assigned"]) and t["section"] == secname and t.get("duration", 2) == duration
+                        ]
+                        if not pending:
+                            continue
+                        # Fairness: prefer groups with fewer assigned labs; rotate ties by day.
+                        day_index = days.index(day)
+                        total_groups = lab_groups_map[secname]
+                        pending = sorted(
+                            pending,
+                            key=lambda t: (
+                                group_session_count[(secname, t["group_index"])],
+                                ((t["group_index"] - day_index) % max(1, total_groups))
+                            )
                         )
-                    )
-                    parallel_cap = min(lab_groups_map[secname], 3)
-                    assigned_in_this_block = False
-                    for k in range(parallel_cap, 0, -1):
-                        for combo in itertools.combinations(pending, k):
-                            group_idxs = {c["group_index"] for c in combo}
-                            labs_set = {c["lab"] for c in combo}
-                            if len(group_idxs) != k or len(labs_set) != k:
-                                continue
-                            ok = True
-                            temp_rooms = set()
-                            temp_teachers = set()
-                            combo_rooms = {}
-                            for c in combo:
-                                gi = c["group_index"]
-                                lab = c["lab"]
-                                if (secname, gi, day) in used_group_day:
-                                    ok = False
-                                    break
-                                room = pick_room_for_block(day, block, lab, gi, temp_rooms=temp_rooms)
-                                teacher = fixed_teachers.get((secname, lab))
-                                if room is None and (lab_rooms_map.get(lab) or data.get("labs")):
-                                    ok = False
-                                    break
-                                if teacher:
-                                    current_teacher_hours = sum(1 for t, d, _ in used_teachers if t == teacher and d == day)
-                                    if current_teacher_hours + len(block) > max_teacher_daily:
-                                        ok = False
-                                        break
-                                for slot in block:
-                                    if any(entry and entry[0] not in ("FREE",) for entry in timetable[secname][day][slot]):
-                                        ok = False
-                                        break
-                                    if room and (room, day, slot) in used_rooms:
-                                        ok = False
-                                        break
-                                    if teacher and (teacher, day, slot) in used_teachers:
-                                        ok = False
-                                        break
-                                    if room and (room, day, slot) in temp_rooms:
-                                        ok = False
-                                        break
-                                    if teacher and (teacher, day, slot) in temp_teachers:
+                        parallel_cap = min(lab_groups_map[secname], 3)
+                        assigned_in_this_block = False
+                        for k in range(parallel_cap, 0, -1):
+                            for combo in itertools.combinations(pending, k):
+                                group_idxs = {c["group_index"] for c in combo}
+                                labs_set = {c["lab"] for c in combo}
+                                if len(group_idxs) != k or len(labs_set) != k:
+                                    continue
+                                ok = True
+                                temp_rooms = set()
+                                temp_teachers = set()
+                                combo_rooms = {}
+                                reason = None
+                                if rejections is not None:
+                                    rejections["probes"] += 1
+                                for c in combo:
+                                    gi = c["group_index"]
+                                    lab = c["lab"]
+                                    if (secname, gi, day) in used_group_day:
                                         ok = False
+                                        reason = "group_day_taken"
                                         break
-                                    if teacher and has_adjacent_lab_for_teacher(timetable, teacher, day, slot, data):
+                                    room = pick_room_for_block(day, block, lab, gi, temp_rooms=temp_rooms)
+                                    teacher = fixed_teachers.get((secname, lab))
+                                    if room is None and (lab_rooms_map.get(lab) or data.get("labs")):
                                         ok = False
+                                        reason = "room_clash"
                                         break
-                                    if teacher_unavailable_on(teacher, day, slot, data):
-                                        ok = False
+                                    if teacher:
+                                        current_teacher_hours = sum(1 for t, d, _ in used_teachers if t == teacher and d == day)
+                                        if current_teacher_hours + len(block) > max_teacher_daily:
+                                            ok = False
+                                            reason = "teacher_daily_cap"
+                                            break
+                                    for slot in block:
+                                        if any(entry and entry[0] not in ("FREE",) for entry in timetable[secname][day][slot]):
+                                            ok = False
+                                            reason = "section_busy"
+                                            break
+                                        if room and (room, day, slot) in used_rooms:
+                                            ok = False
+                                            reason = "room_clash"
+                                            break
+                                        if teacher and (teacher, day, slot) in used_teachers:
+                                            ok = False
+                                            reason = "teacher_clash"
+                                            break
+                                        if room and (room, day, slot) in temp_rooms:
+                                            ok = False
+                                            reason = "room_clash"
+                                            break
+                                        if teacher and (teacher, day, slot) in temp_teachers:
+                                            ok = False
+                                            reason = "teacher_clash"
+                                            break
+                                        if teacher and has_adjacent_lab_for_teacher(timetable, teacher, day, slot, data):
+                                            ok = False
+                                            reason = "adjacency"
+                                            break
+                                        if teacher_unavailable_on(teacher, day, slot, data):
+                                            ok = False
+                                            reason = "unavailability"
+                                            break
+                                    if not ok:
                                         break
+                                    combo_rooms[(c["group_index"], c["lab"])] = room
+                                    for slot in block:
+                                        if room:
+                                            temp_rooms.add((room, day, slot))
+                                        if teacher:
+                                            temp_teachers.add((teacher, day, slot))
                                 if not ok:
-                                    break
-                                combo_rooms[(c["group_index"], c["lab"])] = room
-                                for slot in block:
-                                    if room:
-                                        temp_rooms.add((room, day, slot))
-                                    if teacher:
-                                        temp_teachers.add((teacher, day, slot))
-                            if not ok:
-                                continue
-                            # commit combo
-                            for c in combo:
-                                gi = c["group_index"]
-                                lab = c["lab"]
-                                room = combo_rooms.get((gi, lab))
-                                teacher = fixed_teachers.get((secname, lab))
-                                label = c["group_label"]
-                                duration_val = c.get("duration", 2)
-                                for slot in block:
-                                    timetable[secname][day][slot].append((lab, room, teacher, label, duration_val))
-                                    if room:
-                                        used_rooms.add((room, day, slot))
-                                    if teacher:
-                                        used_teachers.add((teacher, day, slot))
-                                c["assigned"] = True
-                                used_group_day.add((secname, gi, day))
-                                group_session_count[(secname, gi)] += 1
-                            assigned_in_this_block = True
-                            break
-                        if assigned_in_this_block:
-                            break
+                                    if rejections is not None:
+                                        rejections[reason] += 1
+                                    continue
+                                # commit combo
+                                for c in combo:
+                                    gi = c["group_index"]
+                                    lab = c["lab"]
+                                    room = combo_rooms.get((gi, lab))
+                                    teacher = fixed_teachers.get((secname, lab))
+                                    label = c["group_label"]
+                                    duration_val = c.get("duration", 2)
+                                    for slot in block:
+                                        timetable[secname][day][slot].append((lab, room, teacher, label, duration_val))
+                                        if room:
+                                            used_rooms.add((room, day, slot))
+                                        if teacher:
+                                            used_teachers.add((teacher, day, slot))
+                                    c["assigned"] = True
+                                    used_group_day.add((secname, gi, day))
+                                    group_session_count[(secname, gi)] += 1
+                                profile_count("lab_sessions_placed", len(combo))
+                                assigned_in_this_block = True
+                                break
+                            if assigned_in_this_block:
+                                break
+
 
 
     # secondary pass: one-by-one
-    for tsk in tasks:
-        if tsk["assigned"]:
-            continue
-        secname = tsk["section"]
-        lab = tsk["lab"]
-        gi = tsk["group_index"]
-        duration = tsk.get("duration", 2)
-        teacher = fixed_teachers.get((secname, lab))
-        placed = False
-        for block in blocks_by_duration.get(duration, slot_blocks_order(data, duration)):
-            for day in days:
-                if (secname, gi, day) in used_group_day:
-                    continue
-                room = pick_room_for_block(day, block, lab, gi)
-                if room is None and (lab_rooms_map.get(lab) or data.get("labs")):
-                    continue
-                if teacher and any(has_adjacent_lab_for_teacher(timetable, teacher, day, s, data) for s in block):
-                    continue
-                if can_place_block(timetable, secname, day, block, room, teacher, used_rooms, used_teachers, data):
-                    label = tsk["group_label"]
-                    for slot in block:
-                        timetable[secname][day][slot].append((lab, room, teacher, label, duration))
-                        if room:
-                            used_rooms.add((room, day, slot))
-                        if teacher:
-                            used_teachers.add((teacher, day, slot))
-                    tsk["assigned"] = True
-                    used_group_day.add((secname, gi, day))
-                    group_session_count[(secname, gi)] += 1
-                    placed = True
-                    break
-            if placed:
-                break
-        if not tsk["assigned"]:
-            # last resort: ignore teacher conflicts
+    with profile_phase("labs.secondary"):
+        for tsk in tasks:
+            if tsk["assigned"]:
+                continue
+            secname = tsk["section"]
+            lab = tsk["lab"]
+            gi = tsk["group_index"]
+            duration = tsk.get("duration", 2)
+            teacher = fixed_teachers.get((secname, lab))
+            placed = False
             for block in blocks_by_duration.get(duration, slot_blocks_order(data, duration)):
                 for day in days:
                     if (secname, gi, day) in used_group_day:
@@ -1170,39 +2793,69 @@ def assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms):
                     room = pick_room_for_block(day, block, lab, gi)
                     if room is None and (lab_rooms_map.get(lab) or data.get("labs")):
                         continue
-                    ok = True
-                    for slot in block:
-                        if any(entry and entry[0] not in ("FREE",) for entry in timetable[secname][day][slot]):
-                            ok = False
-                            break
-                        if room and (room, day, slot) in used_rooms:
-                            ok = False
-                            break
-                    if ok:
+                    if teacher and any(has_adjacent_lab_for_teacher(timetable, teacher, day, s, data) for s in block):
+                        continue
+                    if can_place_block(timetable, secname, day, block, room, teacher, used_rooms, used_teachers, data):
                         label = tsk["group_label"]
                         for slot in block:
-                            timetable[secname][day][slot].append((lab, room, None, label, duration))
+                            timetable[secname][day][slot].append((lab, room, teacher, label, duration))
                             if room:
                                 used_rooms.add((room, day, slot))
+                            if teacher:
+                                used_teachers.add((teacher, day, slot))
                         tsk["assigned"] = True
                         used_group_day.add((secname, gi, day))
                         group_session_count[(secname, gi)] += 1
-                        ok = True
+                        profile_count("lab_sessions_placed")
+                        placed = True
                         break
-                if tsk["assigned"]:
+                if placed:
                     break
-        if not tsk["assigned"]:
-            last_day = days[0]
-            last_slot = data["slots"][-1]
-            timetable[secname][last_day][last_slot].append((f"{lab}-UNSCHED", None, None, tsk["group_label"]))
-            tsk["assigned"] = True
+            if not tsk["assigned"]:
+                # last resort: ignore teacher conflicts
+                for block in blocks_by_duration.get(duration, slot_blocks_order(data, duration)):
+                    for day in days:
+                        if (secname, gi, day) in used_group_day:
+                            continue
+                        room = pick_room_for_block(day, block, lab, gi)
+                        if room is None and (lab_rooms_map.get(lab) or data.get("labs")):
+                            continue
+                        ok = True
+                        for slot in block:
+                            if any(entry and entry[0] not in ("FREE",) for entry in timetable[secname][day][slot]):
+                                ok = False
+                                break
+                            if room and (room, day, slot) in used_rooms:
+                                ok = False
+                                break
+                        if ok:
+                            label = tsk["group_label"]
+                            for slot in block:
+                                timetable[secname][day][slot].append((lab, room, None, label, duration))
+                                if room:
+                                    used_rooms.add((room, day, slot))
+                            tsk["assigned"] = True
+                            used_group_day.add((secname, gi, day))
+                            group_session_count[(secname, gi)] += 1
+                            profile_count("lab_sessions_without_teacher")
+                            ok = True
+                            break
+                    if tsk["assigned"]:
+                        break
+            if not tsk["assigned"]:
+                last_day = days[0]
+                last_slot = data["slots"][-1]
+                timetable[secname][last_day][last_slot].append((f"{lab}-UNSCHED", None, None, tsk["group_label"]))
+                tsk["assigned"] = True
+                profile_count("lab_sessions_unscheduled")
 
 
     return timetable
 
 
 
-def assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms, ignore_teacher_daily_limit=False):
+def assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms, ignore_teacher_daily_limit=False,
+                           reserved=None):
     days = data["days"]
     slots = [s for s in data["slots"] if s != "Lunch Break"]
     slot_index = {s: i for i, s in enumerate(slots)}
@@ -1211,6 +2864,7 @@ def assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms, ig
     max_daily = constraints.get("max_lectures_per_day_section", 6)
     max_teacher_daily = constraints.get("max_lectures_per_day_teacher", 5)
     lecture_req = data.get("lecture_requirements", {})
+    rejections = profile_rejections("theory")
 
 
     used_rooms = set()
@@ -1228,6 +2882,7 @@ def assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms, ig
                         used_rooms.add((room, day, slot))
                     if teacher:
                         used_teachers.add((teacher, day, slot))
+    seed_reserved_occupancy(used_rooms, used_teachers, reserved)
 
 
     remaining = {}
@@ -1258,27 +2913,47 @@ def assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms, ig
                 placed = False
                 for day in candidate_days:
                     if daily_subj_count[secname][day][sub] >= max_subj_per_day:
+                        if rejections is not None:
+                            rejections["subject_daily_cap"] += 1
                         continue
                     if daily_total[secname][day] >= max_daily:
+                        if rejections is not None:
+                            rejections["section_daily_cap"] += 1
                         continue
                     for slot in slots:
+                        if rejections is not None:
+                            rejections["probes"] += 1
                         if any(e and e[0] not in ("FREE",) and (len(e) > 3) for e in timetable[secname][day][slot]):
+                            if rejections is not None:
+                                rejections["section_busy"] += 1
                             continue
                         if any(e and e[0] not in ("FREE",) and (len(e) <= 3 and e[0] != sub) for e in timetable[secname][day][slot]):
+                            if rejections is not None:
+                                rejections["section_busy"] += 1
                             continue
                         if teacher and teacher_unavailable_on(teacher, day, slot, data):
+                            if rejections is not None:
+                                rejections["unavailability"] += 1
                             continue
                         prev_idx = slot_index[slot] - 1
                         if prev_idx >= 0:
                             prev_slot = slots[prev_idx]
                             prev_entries = timetable[secname][day][prev_slot]
                             if any(e[0] == sub for e in prev_entries):
+                                if rejections is not None:
+                                    rejections["adjacency"] += 1
                                 continue
                         if fixed_room and (fixed_room, day, slot) in used_rooms:
+                            if rejections is not None:
+                                rejections["room_clash"] += 1
                             continue
                         if teacher and (teacher, day, slot) in used_teachers:
+                            if rejections is not None:
+                                rejections["teacher_clash"] += 1
                             continue
                         if (not ignore_teacher_daily_limit) and teacher and sum(1 for t, d, _ in used_teachers if t == teacher and d == day) >= max_teacher_daily:
+                            if rejections is not None:
+                                rejections["teacher_daily_cap"] += 1
                             continue
                         timetable[secname][day][slot].append((sub, fixed_room, teacher))
                         used_rooms.add((fixed_room, day, slot))
@@ -1288,16 +2963,19 @@ def assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms, ig
                         req -= 1
                         daily_subj_count[secname][day][sub] += 1
                         daily_total[secname][day] += 1
+                        profile_count("theory_lectures_placed")
                         placed = True
                         break
                     if placed:
                         break
                 if not placed:
                     # local swap/backtrack
+                    profile_count("swaps_attempted")
                     swap_done = try_easy_swap_for_subject(timetable, secname, sub, remaining, fixed_teachers,
                                                          fixed_classrooms, used_rooms, used_teachers, data,
                                                          daily_subj_count, daily_total)
                     if swap_done:
+                        profile_count("swaps_succeeded")
                         remaining[secname][sub] -= 1
                         req -= 1
                         continue
@@ -1347,10 +3025,22 @@ def try_easy_swap_for_subject(timetable, secname, sub, remaining, fixed_teachers
                             continue
                         if any(e and e[0] not in ("FREE",) for e in timetable[secname][target_day][target_slot]):
                             continue
+                        # The moved lecture keeps its room and teacher, so both must be free
+                        # at the target (including keys seeded from other timetables).
+                        room, teacher = entry[1], entry[2]
+                        if room and (room, target_day, target_slot) in used_rooms:
+                            continue
+                        if teacher and ((teacher, target_day, target_slot) in used_teachers
+                                        or teacher_unavailable_on(teacher, target_day, target_slot, data)):
+                            continue
                         timetable[secname][day][slot] = [e for e in timetable[secname][day][slot] if e != entry]
                         if not timetable[secname][day][slot]:
                             timetable[secname][day][slot] = [("FREE", None, None)]
                         timetable[secname][target_day][target_slot].append(entry)
+                        if room:
+                            used_rooms.add((room, target_day, target_slot))
+                        if teacher:
+                            used_teachers.add((teacher, target_day, target_slot))
                         return True
     return False
 
@@ -1359,31 +3049,214 @@ def try_easy_swap_for_subject(timetable, secname, sub, remaining, fixed_teachers
 # ----------------- Suggestion Generator -----------------
 
 
-def generate_suggestions(data, timetable, unfulfilled, fixed_teachers):
+def build_placement_context(data, timetable, extra_slots=0, reserved=None):
+    """
+    Occupancy bitmasks of a nested timetable for suggestion analysis.
+
+    Bits are day-major over the teaching slots plus `extra_slots` empty
+    positions at the end of every day (to model a longer day). Holds busy
+    masks per section/teacher/room, static teacher unavailability, a mask per
+    (section, subject) theory lecture and the per-day theory counters that
+    assign_theory_subjects enforces caps on. `reserved` room/teacher keys held
+    by other timetables (batch generation) are busy in those masks too.
+    """
+    days = data["days"]
+    teaching = [s for s in data["slots"] if s != "Lunch Break"]
+    width = len(teaching) + extra_slots
+    day_index = {day: i for i, day in enumerate(days)}
+    positions = {(day, slot): d * width + i for d, day in enumerate(days) for i, slot in enumerate(teaching)}
+    context = {
+        "days": days,
+        "width": width,
+        "full": (1 << (len(days) * width)) - 1,
+        "sections": defaultdict(int),
+        "teachers": defaultdict(int),
+        "rooms": defaultdict(int),
+        "unavailable": defaultdict(int),
+        "subjects": defaultdict(int),
+        "theory_day": defaultdict(int),
+        "subject_day": defaultdict(int)
+    }
+    for secname, day, slot, entry in timetable_entries(timetable):
+        bit = positions.get((day, slot))
+        if bit is None or str(entry[0]).endswith("-UNSCHED"):
+            continue
+        context["sections"][secname] |= 1 << bit
+        if len(entry) > 1 and entry[1]:
+            context["rooms"][entry[1]] |= 1 << bit
+        if len(entry) > 2 and entry[2]:
+            context["teachers"][entry[2]] |= 1 << bit
+        if len(entry) <= 3:
+            context["subjects"][(secname, entry[0])] |= 1 << bit
+            context["theory_day"][(secname, day_index[day])] += 1
+            context["subject_day"][(secname, entry[0], day_index[day])] += 1
+    for teacher, entries in (data.get("teacher_unavailability") or {}).items():
+        for u in entries or []:
+            bit = positions.get((u.get("day"), u.get("slot")))
+            if bit is not None:
+                context["unavailable"][teacher] |= 1 << bit
+    for kind in ("rooms", "teachers"):
+        for name, day, slot in (reserved or {}).get(kind, ()):
+            bit = positions.get((day, slot))
+            if bit is not None:
+                context[kind][name] |= 1 << bit
+    return context
+
+
+def teacher_free_mask(context, teacher):
+    return context["full"] & ~(context["teachers"].get(teacher, 0) | context["unavailable"].get(teacher, 0))
+
+
+def simulate_placements(context, lectures, constraints, fixed_teachers, fixed_classrooms,
+                        new_teacher_for=None, ignore_rooms=False, ignore_teacher_daily_limit=False):
+    """
+    Greedy re-placement of `lectures` [(section, subject), ...] on a copy of the context masks.
+
+    Uses the same rules as assign_theory_subjects (free section/teacher/room,
+    unavailability, subject/section/teacher daily caps, no back-to-back repeat
+    of a subject). `new_teacher_for` gives that subject one extra, fully free
+    teacher; `ignore_rooms` models an extra room. Returns {(section, subject): placed}.
+    """
+    width = context["width"]
+    n_days = len(context["days"])
+    day_window = (1 << width) - 1
+    max_subj_per_day = constraints.get("max_lectures_per_subject_per_day", 2)
+    max_daily = constraints.get("max_lectures_per_day_section", 6)
+    max_teacher_daily = constraints.get("max_lectures_per_day_teacher", 5)
+
+    sections = dict(context["sections"])
+    teachers = dict(context["teachers"])
+    rooms = dict(context["rooms"])
+    subjects = dict(context["subjects"])
+    theory_day = defaultdict(int, context["theory_day"])
+    subject_day = defaultdict(int, context["subject_day"])
+    unavailable = context["unavailable"]
+    placed = defaultdict(int)
+
+    for secname, sub in lectures:
+        teacher = f"(new {sub} teacher)" if sub == new_teacher_for else fixed_teachers.get((secname, sub))
+        room = None if ignore_rooms else fixed_classrooms.get(secname)
+        for d in sorted(range(n_days), key=lambda i: theory_day[(secname, i)]):
+            if subject_day[(secname, sub, d)] >= max_subj_per_day or theory_day[(secname, d)] >= max_daily:
+                continue
+            busy = sections.get(secname, 0)
+            if teacher:
+                busy |= teachers.get(teacher, 0) | unavailable.get(teacher, 0)
+            if room:
+                busy |= rooms.get(room, 0)
+            free = ~(busy >> (d * width)) & day_window
+            if not free:
+                continue
+            if teacher and not ignore_teacher_daily_limit:
+                if popcount((teachers.get(teacher, 0) >> (d * width)) & day_window) >= max_teacher_daily:
+                    continue
+            # No back-to-back repeat: drop slots right after one of this subject's lectures.
+            same_subject = (subjects.get((secname, sub), 0) >> (d * width)) & day_window
+            free &= ~(same_subject << 1)
+            if not free:
+                continue
+            bit = d * width + ((free & -free).bit_length() - 1)
+            sections[secname] = sections.get(secname, 0) | 1 << bit
+            subjects[(secname, sub)] = subjects.get((secname, sub), 0) | 1 << bit
+            if teacher:
+                teachers[teacher] = teachers.get(teacher, 0) | 1 << bit
+            if room:
+                rooms[room] = rooms.get(room, 0) | 1 << bit
+            theory_day[(secname, d)] += 1
+            subject_day[(secname, sub, d)] += 1
+            placed[(secname, sub)] += 1
+            break
+    return placed
+
+
+def simulate_what_if(data, timetable, unfulfilled, fixed_teachers, fixed_classrooms,
+                     ignore_teacher_daily_limit=False, max_teacher_scenarios=10, reserved=None):
+    """
+    Quantify how many unfulfilled lectures each single change would place.
+
+    `data` carries the constraints of the placement pass that produced
+    `timetable`. Every scenario re-places the unfulfilled lectures on its own
+    copy of the occupancy masks, so scenarios are independent of each other.
+    """
+    lectures = [(secname, sub) for secname, subs in unfulfilled.items() for sub, cnt in subs.items() for _ in range(cnt)]
+    if not lectures:
+        return []
+    constraints = dict(data.get("constraints", {}))
+    context = build_placement_context(data, timetable, reserved=reserved)
+
+    def relaxed(key, default):
+        return {**constraints, key: constraints.get(key, default) + 1}
+
+    scenarios = [
+        ("current", "Re-running placement with the current limits", {}),
+        ("max_lectures_per_subject_per_day",
+         f"Relaxing max_lectures_per_subject_per_day to {constraints.get('max_lectures_per_subject_per_day', 2) + 1}",
+         {"constraints": relaxed("max_lectures_per_subject_per_day", 2)}),
+        ("max_lectures_per_day_section",
+         f"Relaxing max_lectures_per_day_section to {constraints.get('max_lectures_per_day_section', 6) + 1}",
+         {"constraints": relaxed("max_lectures_per_day_section", 6)}),
+        ("extra_room", "Adding one more classroom", {"ignore_rooms": True}),
+        ("extra_slot", "Adding one teaching slot per day", {"extra_slots": 1}),
+    ]
+    if not ignore_teacher_daily_limit:
+        scenarios.insert(3, (
+            "max_lectures_per_day_teacher",
+            f"Relaxing max_lectures_per_day_teacher to {constraints.get('max_lectures_per_day_teacher', 5) + 1}",
+            {"constraints": relaxed("max_lectures_per_day_teacher", 5)}
+        ))
+    for sub in list(dict.fromkeys(sub for _, sub in lectures))[:max_teacher_scenarios]:
+        scenarios.append((f"extra_teacher:{sub}", f"Adding one teacher for {sub}", {"new_teacher_for": sub}))
+
+    extended = None
+    results = []
+    for change, label, options in scenarios:
+        scenario_context = context
+        if options.get("extra_slots"):
+            extended = extended or build_placement_context(
+                data, timetable, extra_slots=options["extra_slots"], reserved=reserved
+            )
+            scenario_context = extended
+        placed = simulate_placements(
+            scenario_context,
+            lectures,
+            options.get("constraints", constraints),
+            fixed_teachers,
+            fixed_classrooms,
+            new_teacher_for=options.get("new_teacher_for"),
+            ignore_rooms=options.get("ignore_rooms", False),
+            ignore_teacher_daily_limit=ignore_teacher_daily_limit
+        )
+        count = sum(placed.values())
+        results.append({
+            "change": change,
+            "label": label,
+            "placed": count,
+            "total": len(lectures),
+            "message": f"{label} places {count} of {len(lectures)} unfulfilled lecture(s)",
+            "by_subject": [
+                {"section": secname, "subject": sub, "placed": n}
+                for (secname, sub), n in sorted(placed.items())
+            ]
+        })
+    results.sort(key=lambda r: -r["placed"])
+    return results
+
+
+def generate_suggestions(data, timetable, unfulfilled, fixed_teachers, what_if=None, reserved=None):
     """
     For each unfulfilled (section, subject, count) produce suggestions:
       - If too few teachers or teacher-availability insufficient -> suggest more faculty or reassign.
       - If not enough free slots -> suggest increase slots/relax constraints.
       - Else suggest relaxing per-day limits or swapping labs/rooms.
+    Availability comes from one bitmask pass over the timetable; `what_if`
+    (simulate_what_if output) adds the changes that would place this subject;
+    `reserved` keys count as busy, as in simulate_what_if.
     """
-    days = data["days"]
-    slots = [s for s in data["slots"] if s != "Lunch Break"]
-
-
-    # compute used_teachers from final timetable
-    used_teachers = set()
-    for sec in timetable:
-        for d in data["days"]:
-            for s in data["slots"]:
-                for entry in timetable[sec][d][s]:
-                    if not entry:
-                        continue
-                    subj = entry[0]
-                    teach = entry[2]
-                    if subj in ("FREE", "LUNCH"):
-                        continue
-                    if teach:
-                        used_teachers.add((teach, d, s))
+    context = build_placement_context(data, timetable, reserved=reserved)
+    placing = defaultdict(list)
+    for scenario in what_if or []:
+        for item in scenario["by_subject"]:
+            placing[(item["section"], item["subject"])].append((item["placed"], scenario["label"]))
 
 
     suggestions = {}
@@ -1392,14 +3265,7 @@ def generate_suggestions(data, timetable, unfulfilled, fixed_teachers):
     for secname, subs in unfulfilled.items():
         suggestions.setdefault(secname, {})
         # count free slots for this section across the week
-        free_slots = 0
-        free_slot_list = []
-        for d in days:
-            for s in slots:
-                entries = timetable[secname][d][s]
-                if all(e[0] in ("FREE",) for e in entries):
-                    free_slots += 1
-                    free_slot_list.append((d, s))
+        free_slots = popcount(context["full"] & ~context["sections"].get(secname, 0))
 
 
         for sub, cnt in subs.items():
@@ -1413,17 +3279,7 @@ def generate_suggestions(data, timetable, unfulfilled, fixed_teachers):
 
             teacher_count = len(teachers_for_sub)
             # measure per-teacher availability (counts of free slots for that teacher)
-            teacher_avail = {}
-            for t in teachers_for_sub:
-                avail = 0
-                for d in days:
-                    for s in slots:
-                        if (t, d, s) in used_teachers:
-                            continue
-                        if teacher_unavailable_on(t, d, s, data):
-                            continue
-                        avail += 1
-                teacher_avail[t] = avail
+            teacher_avail = {t: popcount(teacher_free_mask(context, t)) for t in teachers_for_sub}
             max_teacher_avail = max(teacher_avail.values()) if teacher_avail else 0
 
 
@@ -1453,6 +3309,9 @@ def generate_suggestions(data, timetable, unfulfilled, fixed_teachers):
                 msgs.append(f"- Lab rooms for this subject are limited. Consider adding another lab room or freeing some lab time slots.")
 
 
+            for placed, label in sorted(placing.get((secname, sub), []), key=lambda item: -item[0])[:2]:
+                msgs.append(f"- Simulation: {label} would place {min(placed, cnt)} of {cnt} lecture(s) of **{sub}**.")
+
             # generic suggestions
             msgs.append("- Other options: reduce group sizes (if lectures are duplicated), allow loading some lectures as remote/self-study, or manually move less-critical lectures to another week.")
 
@@ -1513,137 +3372,505 @@ def filter_student_timetable(rows, section_name):
     return [row for row in rows if (row.get("section") or "").strip().lower() == section_name.strip().lower()]
 
 
-def get_teacher_available_theory_slots(rows, teacher_name, day, from_slot, slots_order):
-    target = next((
-        r for r in rows
-        if (r.get("teacher") or "").strip().lower() == teacher_name.strip().lower()
-        and r.get("day") == day
-        and r.get("slot") == from_slot
-    ), None)
-    if not target:
-        return [], "No assignment found at the selected day/slot"
-    if target.get("group"):
-        return [], "Lab sessions cannot be shifted with theory-slot option"
+def row_index_keys(row):
+    """Index keys for a flat timetable row, one per lookup kind."""
+    day = row.get("day")
+    slot = row.get("slot")
+    keys = [("section", (row.get("section"), day, slot))]
+    teacher_lc = (row.get("teacher") or "").strip().lower()
+    if teacher_lc:
+        keys.append(("teacher", (teacher_lc, day, slot)))
+    if row.get("room"):
+        keys.append(("room", (row.get("room"), day, slot)))
+    return keys
 
-    section = target.get("section")
-    available = []
-    for s in [x for x in slots_order if x != "Lunch Break" and x != from_slot]:
-        section_busy = any(
-            r.get("section") == section and r.get("day") == day and r.get("slot") == s
-            for r in rows
-        )
-        teacher_busy = any(
-            (r.get("teacher") or "").strip().lower() == teacher_name.strip().lower()
-            and r.get("day") == day and r.get("slot") == s
-            for r in rows
-        )
-        if not section_busy and not teacher_busy:
-            available.append(s)
-    return available, None
 
+def build_row_index(rows):
+    """Index rows by (section, day, slot), (teacher, day, slot) and (room, day, slot).
 
-def pull_forward_same_day_for_section(rows, section, day, slots_order, start_slot=None):
-    slots = [s for s in slots_order if s != "Lunch Break"]
-    if not slots:
-        return rows
+    Teacher keys are stripped/lower-cased like every other teacher comparison.
+    Buckets keep row order so lookups return the same first match as a scan.
+    """
+    index = {"section": defaultdict(list), "teacher": defaultdict(list), "room": defaultdict(list)}
+    for row in rows:
+        for kind, key in row_index_keys(row):
+            index[kind][key].append(row)
+    return index
 
-    start_index = 0
-    if start_slot in slots:
-        start_index = slots.index(start_slot)
 
-    for i in range(start_index, len(slots) - 1):
-        free_slot = slots[i]
-        section_has_class = any(
-            r.get("section") == section and r.get("day") == day and r.get("slot") == free_slot
-            for r in rows
-        )
-        if section_has_class:
-            continue
+def copy_row_index(index):
+    """Copy of an index that can be edited with index_add_row/index_remove_row
+    while readers keep using the original: buckets are replaced, never changed."""
+    return {kind: dict(buckets) for kind, buckets in index.items()}
 
-        moved = False
-        for j in range(i + 1, len(slots)):
-            src_slot = slots[j]
-            candidate_idx = next((
-                idx for idx, r in enumerate(rows)
-                if r.get("section") == section
-                and r.get("day") == day
-                and r.get("slot") == src_slot
-                and not r.get("group")
-            ), None)
-            if candidate_idx is None:
-                continue
 
-            candidate = rows[candidate_idx]
-            teacher_lc = (candidate.get("teacher") or "").strip().lower()
-            room = candidate.get("room")
+def index_add_row(index, row):
+    for kind, key in row_index_keys(row):
+        index[kind][key] = index[kind].get(key, []) + [row]
 
-            teacher_busy = any(
-                idx != candidate_idx
-                and (r.get("teacher") or "").strip().lower() == teacher_lc
-                and r.get("day") == day
-                and r.get("slot") == free_slot
-                for idx, r in enumerate(rows)
-            ) if teacher_lc else False
-            if teacher_busy:
-                continue
 
-            room_busy = any(
-                idx != candidate_idx
-                and r.get("room") == room
-                and r.get("day") == day
-                and r.get("slot") == free_slot
-                for idx, r in enumerate(rows)
-            ) if room else False
-            if room_busy:
-                continue
+def index_remove_row(index, row):
+    for kind, key in row_index_keys(row):
+        bucket = index[kind].get(key)
+        if bucket is None:
+            continue
+        bucket = [r for r in bucket if r is not row]
+        if bucket:
+            index[kind][key] = bucket
+        else:
+            del index[kind][key]
 
-            candidate["slot"] = free_slot
-            candidate["moved_from"] = src_slot
-            candidate["moved"] = True
-            moved = True
-            break
 
-        if not moved:
-            continue
+def index_move_row(index, row, new_slot):
+    """Move a row to another slot of the same day, keeping the index in sync."""
+    index_remove_row(index, row)
+    row["slot"] = new_slot
+    index_add_row(index, row)
 
-    return rows
 
+def index_lookup(index, kind, key, day, slot):
+    if kind == "teacher":
+        key = (key or "").strip().lower()
+    return index[kind].get((key, day, slot), [])
 
-def apply_theory_reslot(rows, teacher_name, day, from_slot, to_slot, slots_order=None):
-    updated = copy.deepcopy(rows)
-    target = next((
-        r for r in updated
-        if (r.get("teacher") or "").strip().lower() == teacher_name.strip().lower()
-        and r.get("day") == day
-        and r.get("slot") == from_slot
-    ), None)
-    if not target:
-        raise ValueError("No assignment found for selected slot")
-    if target.get("group"):
-        raise ValueError("Only theory sessions can be shifted to another slot")
 
-    section = target.get("section")
-    section_busy = any(r.get("section") == section and r.get("day") == day and r.get("slot") == to_slot for r in updated)
-    if section_busy:
-        raise ValueError("Selected target slot is not free for this class section")
-    teacher_busy = any(
-        (r.get("teacher") or "").strip().lower() == teacher_name.strip().lower()
-        and r.get("day") == day and r.get("slot") == to_slot
-        for r in updated
-    )
-    if teacher_busy:
-        raise ValueError("Teacher is already occupied in selected target slot")
+def get_published_read_model(published):
+    """Read model over the published rows, rebuilt only when `publishedAt` changes."""
+    global PUBLISHED_READ_MODEL
+    version = published.get("publishedAt")
+    model = PUBLISHED_READ_MODEL
+    hit = model.get("version") == version and model.get("row_index") is not None
+    record_cache_lookup("published_row_index", hit)
+    if not hit:
+        rows = published.get("timetableData", {}).get("timetable", [])
+        model = {"version": version, "rows": rows, "row_index": build_row_index(rows), "grids": {}}
+        PUBLISHED_READ_MODEL = model
+    return model
 
-    target["slot"] = to_slot
-    target["moved_from"] = from_slot
-    target["moved"] = True
-    if slots_order:
-        updated = pull_forward_same_day_for_section(updated, section, day, slots_order, start_slot=from_slot)
-    return updated
 
+def advance_published_read_model(published, rows, row_index):
+    """Carry an incrementally updated row index over to the new `publishedAt`.
 
-def run_teacher_reset(original_input_data, current_list, teacher, day, slot):
-    # Transform to sections-based structure
+    Derived views (grids, room/people occupancy) are dropped and rebuilt lazily.
+    """
+    global PUBLISHED_READ_MODEL
+    PUBLISHED_READ_MODEL = {"version": published.get("publishedAt"), "rows": rows, "row_index": row_index, "grids": {}}
+
+
+def get_published_row_index(published):
+    return get_published_read_model(published)["row_index"]
+
+
+GRID_KINDS = ("section", "teacher", "room")
+
+
+def grid_cell_key(row):
+    return (row.get("section"), row.get("subject"), row.get("teacher"), row.get("room"), row.get("group"))
+
+
+def build_timetable_grid(rows, days, slots):
+    """
+    Pivot flat rows into {day: {slot: [cells]}} in published day/slot order.
+
+    A lab block (same section/subject/teacher/room/group in consecutive slots,
+    up to its `duration`) becomes one cell with `span` on its first slot; the
+    slots it covers get a `{"continues": <first slot>}` marker instead.
+    """
+    slot_pos = {slot: i for i, slot in enumerate(slots)}
+    by_day = defaultdict(list)
+    for row in rows:
+        if row.get("slot") not in slot_pos:
+            continue
+        by_day[row.get("day")].append(row)
+
+    grid = {}
+    for day in days:
+        day_cells = {slot: [] for slot in slots}
+        open_blocks = {}
+        for row in sorted(by_day.get(day, []), key=lambda r: slot_pos[r["slot"]]):
+            pos = slot_pos[row["slot"]]
+            key = grid_cell_key(row)
+            block = open_blocks.get(key)
+            duration = int(row.get("duration") or 1)
+            if block and block["end"] == pos - 1 and block["cell"]["span"] < duration:
+                block["cell"]["span"] += 1
+                block["end"] = pos
+                day_cells[row["slot"]].append({"continues": block["start"], "section": row.get("section"),
+                                               "group": row.get("group")})
+                continue
+            cell = {k: v for k, v in row.items() if k not in ("day", "slot")}
+            cell["span"] = 1
+            day_cells[row["slot"]].append(cell)
+            open_blocks[key] = {"cell": cell, "start": row["slot"], "end": pos}
+        grid[day] = day_cells
+    return grid
+
+
+def get_published_grid(published, kind, key):
+    """Grid for one section/teacher/room, cached on the read model until the next change.
+
+    Returns None for a name with no published rows, so only real names are cached.
+    """
+    model = get_published_read_model(published)
+    key_lc = (key or "").strip().lower()
+    names = model.get("names")
+    if names is None:
+        names = {k: set() for k in GRID_KINDS}
+        for row in model["rows"]:
+            for k in GRID_KINDS:
+                name = (row.get(k) or "").strip().lower()
+                if name:
+                    names[k].add(name)
+        model["names"] = names
+    if key_lc not in names[kind]:
+        return None
+    cached = model["grids"].get((kind, key_lc))
+    record_cache_lookup("published_grid", cached is not None)
+    if cached is None:
+        rows = [
+            row for row in published.get("timetableData", {}).get("timetable", [])
+            if (row.get(kind) or "").strip().lower() == key_lc
+        ]
+        input_data = published.get("inputData", {})
+        cached = build_timetable_grid(rows, input_data.get("days", []), input_data.get("slots", []))
+        model["grids"][(kind, key_lc)] = cached
+    return cached
+
+
+def slot_bit_layout(days, slots):
+    """Bit position of every teaching (day, slot), day-major with lunch left out."""
+    teaching = [s for s in slots if s != "Lunch Break"]
+    return {(day, slot): d * len(teaching) + i for d, day in enumerate(days) for i, slot in enumerate(teaching)}
+
+
+def mask_positions(mask, layout):
+    """(day, slot) pairs whose bit is set in `mask`, in layout order."""
+    return [pos for pos, bit in sorted(layout.items(), key=lambda item: item[1]) if mask >> bit & 1]
+
+
+def block_mask(layout, slots, day, slot, duration):
+    """Mask of `duration` consecutive teaching slots from (day, slot), or None if the block does not fit."""
+    teaching = [s for s in slots if s != "Lunch Break"]
+    if (day, slot) not in layout:
+        return None
+    start = teaching.index(slot)
+    block = teaching[start:start + duration]
+    if len(block) < duration:
+        return None
+    # Labs never cross lunch, so neither does a free-room block.
+    if "Lunch Break" in slots[slots.index(block[0]):slots.index(block[-1]) + 1]:
+        return None
+    mask = 0
+    for s in block:
+        mask |= 1 << layout[(day, s)]
+    return mask
+
+
+def build_room_occupancy(published):
+    """One occupancy bitmask per room over the published rows; every listed room and lab gets an entry."""
+    input_data = published.get("inputData", {})
+    rows = published.get("timetableData", {}).get("timetable", [])
+    layout = slot_bit_layout(input_data.get("days", []), input_data.get("slots", []))
+    rooms = list(dict.fromkeys(
+        list(input_data.get("rooms", [])) + list(input_data.get("labs", [])) + [r.get("room") for r in rows if r.get("room")]
+    ))
+    masks = dict.fromkeys(rooms, 0)
+    rows_by_room = defaultdict(list)
+    for row in rows:
+        room = row.get("room")
+        bit = layout.get((row.get("day"), row.get("slot")))
+        if not room or bit is None:
+            continue
+        masks[room] |= 1 << bit
+        rows_by_room[room].append(row)
+    return {
+        "layout": layout,
+        "rooms": rooms,
+        "labs": set(input_data.get("labs", [])),
+        "by_name": {room.strip().lower(): room for room in rooms},
+        "masks": masks,
+        "rows": rows_by_room
+    }
+
+
+def get_room_occupancy(published):
+    model = get_published_read_model(published)
+    occupancy = model.get("rooms")
+    record_cache_lookup("room_occupancy", occupancy is not None)
+    if occupancy is None:
+        occupancy = build_room_occupancy(published)
+        model["rooms"] = occupancy
+    return occupancy
+
+
+def build_people_occupancy(published):
+    """Busy bitmasks per teacher and per section (lower-cased keys), with static unavailability folded in."""
+    input_data = published.get("inputData", {})
+    rows = published.get("timetableData", {}).get("timetable", [])
+    layout = slot_bit_layout(input_data.get("days", []), input_data.get("slots", []))
+    teachers, sections, names = defaultdict(int), defaultdict(int), {"teacher": {}, "section": {}}
+
+    for pool in (input_data.get("teachers", {}), input_data.get("lab_teachers", {})):
+        for listed in pool.values():
+            for name in (listed if isinstance(listed, list) else [listed]):
+                if name:
+                    names["teacher"].setdefault(name.strip().lower(), name)
+                    teachers[name.strip().lower()] |= 0
+    for row in rows:
+        bit = layout.get((row.get("day"), row.get("slot")))
+        if bit is None:
+            continue
+        if row.get("teacher"):
+            key = row["teacher"].strip().lower()
+            names["teacher"].setdefault(key, row["teacher"])
+            teachers[key] |= 1 << bit
+        if row.get("section"):
+            key = row["section"].strip().lower()
+            names["section"].setdefault(key, row["section"])
+            sections[key] |= 1 << bit
+    for name, entries in (input_data.get("teacher_unavailability") or {}).items():
+        key = name.strip().lower()
+        names["teacher"].setdefault(key, name)
+        for entry in entries or []:
+            bit = layout.get((entry.get("day"), entry.get("slot")))
+            if bit is not None:
+                teachers[key] |= 1 << bit
+    return {"layout": layout, "teacher": dict(teachers), "section": dict(sections), "names": names}
+
+
+def get_people_occupancy(published):
+    model = get_published_read_model(published)
+    occupancy = model.get("people")
+    record_cache_lookup("people_occupancy", occupancy is not None)
+    if occupancy is None:
+        occupancy = build_people_occupancy(published)
+        model["people"] = occupancy
+    return occupancy
+
+
+def active_unavailability_masks(published, layout, now=None):
+    """Extra busy bits from approved `unavailable` changes that have not expired yet."""
+    now = now or datetime.utcnow()
+    masks = defaultdict(int)
+    for change in published.get("temporary_changes", []):
+        if change.get("type") != "unavailable" or not change.get("teacher"):
+            continue
+        exp = parse_iso_utc(change.get("expiresAt"))
+        bit = layout.get((change.get("day"), change.get("slot")))
+        if exp and exp > now and bit is not None:
+            masks[change["teacher"].strip().lower()] |= 1 << bit
+    return masks
+
+
+def find_common_free_slots(published, teachers, sections, duration=1, max_conflicts=0, limit=10):
+    """
+    Rank (day, slot) starts where the given teachers and sections are free.
+
+    Each participant is one busy bitmask; a start whose block mask misses
+    every participant's mask is free for all. Candidates are ordered by
+    conflicts, then by how many participants already have a class right next
+    to the block (no new idle gap), then by how lightly loaded the day is.
+    """
+    occupancy = get_people_occupancy(published)
+    layout = occupancy["layout"]
+    slots = published.get("inputData", {}).get("slots", [])
+    extra = active_unavailability_masks(published, layout)
+    participants = [("teacher", occupancy["names"]["teacher"][t], occupancy["teacher"].get(t, 0) | extra.get(t, 0))
+                    for t in teachers]
+    participants += [("section", occupancy["names"]["section"][s], occupancy["section"][s]) for s in sections]
+
+    teaching = [s for s in slots if s != "Lunch Break"]
+    width = len(teaching)
+    # A class on the other side of lunch does not make the block adjacent.
+    before_lunch = {teaching.index(slots[i - 1]) for i, s in enumerate(slots) if s == "Lunch Break" and i > 0}
+    day_masks = {}
+    for (day, _slot), bit in layout.items():
+        day_masks[day] = day_masks.get(day, 0) | 1 << bit
+
+    busy_any = 0
+    for _kind, _name, mask in participants:
+        busy_any |= mask
+
+    candidates = []
+    for (day, slot), bit in sorted(layout.items(), key=lambda item: item[1]):
+        wanted = block_mask(layout, slots, day, slot, duration)
+        if wanted is None:
+            continue
+        if wanted & busy_any:
+            conflicts = [(kind, name) for kind, name, mask in participants if mask & wanted]
+            if len(conflicts) > max_conflicts:
+                continue
+        else:
+            conflicts = []
+        first, last = bit, bit + duration - 1
+        neighbours = 0
+        if first % width and (first - 1) % width not in before_lunch:
+            neighbours |= 1 << (first - 1)
+        if (last + 1) % width and last % width not in before_lunch:
+            neighbours |= 1 << (last + 1)
+        adjacent = sum(1 for _kind, _name, mask in participants if mask & neighbours)
+        day_load = sum(bin(mask & day_masks[day]).count("1") for _kind, _name, mask in participants)
+        candidates.append({
+            "day": day,
+            "slot": slot,
+            "slots": teaching[first % width:first % width + duration],
+            "conflicts": [{"kind": kind, "name": name} for kind, name in conflicts],
+            "adjacent": adjacent,
+            "day_load": day_load,
+            "_rank": (len(conflicts), -adjacent, day_load, bit)
+        })
+
+    candidates.sort(key=lambda c: c.pop("_rank"))
+    return candidates[:limit], len(candidates)
+
+
+def start_row_version(rows):
+    """Copy-on-write version of `rows`: a new list that shares every row dict with `rows`."""
+    return {"parent": rows, "rows": list(rows), "positions": None, "owned": set(), "replaced": []}
+
+
+def row_for_write(version, row, index=None):
+    """Return a private copy of `row` inside `version`, swapping it into `index` too.
+
+    Only rows passed through here are copied; everything else stays shared with
+    the parent list, so a version costs one list copy plus the rows it touches.
+    """
+    if id(row) in version["owned"]:
+        return row
+    if version["positions"] is None:
+        version["positions"] = {id(r): i for i, r in enumerate(version["rows"])}
+    position = version["positions"].pop(id(row))
+    clone = dict(row)
+    version["rows"][position] = clone
+    version["positions"][id(clone)] = position
+    version["owned"].add(id(clone))
+    version["replaced"].append((row, clone))
+    if index is not None:
+        index_remove_row(index, row)
+        index_add_row(index, clone)
+    return clone
+
+
+def row_version_diff(version):
+    """Rows that changed between a version and its parent, as before/after pairs."""
+    return [{"before": old, "after": new} for old, new in version["replaced"]]
+
+
+def get_teacher_available_theory_slots(rows, teacher_name, day, from_slot, slots_order, index=None):
+    index = index if index is not None else build_row_index(rows)
+    target = next(iter(index_lookup(index, "teacher", teacher_name, day, from_slot)), None)
+    if not target:
+        return [], "No assignment found at the selected day/slot"
+    if target.get("group"):
+        return [], "Lab sessions cannot be shifted with theory-slot option"
+
+    section = target.get("section")
+    available = []
+    for s in [x for x in slots_order if x != "Lunch Break" and x != from_slot]:
+        section_busy = bool(index_lookup(index, "section", section, day, s))
+        teacher_busy = bool(index_lookup(index, "teacher", teacher_name, day, s))
+        if not section_busy and not teacher_busy:
+            available.append(s)
+    return available, None
+
+
+def pull_forward_same_day_for_section(rows, section, day, slots_order, start_slot=None, index=None, version=None):
+    slots = [s for s in slots_order if s != "Lunch Break"]
+    if not slots:
+        return rows
+    index = index if index is not None else build_row_index(rows)
+
+    start_index = 0
+    if start_slot in slots:
+        start_index = slots.index(start_slot)
+
+    for i in range(start_index, len(slots) - 1):
+        free_slot = slots[i]
+        if index_lookup(index, "section", section, day, free_slot):
+            continue
+
+        for j in range(i + 1, len(slots)):
+            src_slot = slots[j]
+            candidate = next((
+                r for r in index_lookup(index, "section", section, day, src_slot)
+                if not r.get("group")
+            ), None)
+            if candidate is None:
+                continue
+
+            teacher = candidate.get("teacher")
+            room = candidate.get("room")
+            teacher_busy = any(
+                r is not candidate for r in index_lookup(index, "teacher", teacher, day, free_slot)
+            ) if (teacher or "").strip() else False
+            if teacher_busy:
+                continue
+
+            room_busy = any(
+                r is not candidate for r in index_lookup(index, "room", room, day, free_slot)
+            ) if room else False
+            if room_busy:
+                continue
+
+            if version is not None:
+                candidate = row_for_write(version, candidate, index)
+            index_move_row(index, candidate, free_slot)
+            candidate["moved_from"] = src_slot
+            candidate["moved"] = True
+            break
+
+    return rows
+
+
+def apply_theory_reslot_version(rows, teacher_name, day, from_slot, to_slot, slots_order=None, index=None):
+    """Move one theory lecture without touching `rows`; returns the new row version.
+
+    A passed `index` must index `rows`; it is updated in place to index the new
+    version (validation errors are raised before anything is touched), so pass a
+    copy_row_index copy when others may be reading it.
+    """
+    version = start_row_version(rows)
+    index = index if index is not None else build_row_index(version["rows"])
+    target = next(iter(index_lookup(index, "teacher", teacher_name, day, from_slot)), None)
+    if not target:
+        raise ValueError("No assignment found for selected slot")
+    if target.get("group"):
+        raise ValueError("Only theory sessions can be shifted to another slot")
+
+    section = target.get("section")
+    if index_lookup(index, "section", section, day, to_slot):
+        raise ValueError("Selected target slot is not free for this class section")
+    if index_lookup(index, "teacher", teacher_name, day, to_slot):
+        raise ValueError("Teacher is already occupied in selected target slot")
+
+    target = row_for_write(version, target, index)
+    index_move_row(index, target, to_slot)
+    target["moved_from"] = from_slot
+    target["moved"] = True
+    if slots_order:
+        pull_forward_same_day_for_section(
+            version["rows"], section, day, slots_order, start_slot=from_slot, index=index, version=version
+        )
+    return version
+
+
+def run_teacher_reset(original_input_data, current_list, teacher, day, slot):
+    changes = []
+    if teacher and day and slot:
+        changes.append({"type": "unavailable", "teacher": teacher, "day": day, "slot": slot})
+    return replay_temporary_changes(original_input_data, current_list, changes)
+
+
+def replay_temporary_changes(original_input_data, current_list, changes):
+    """
+    Apply temporary changes in order against a single timetable/occupancy build.
+
+    Same results as chaining run_teacher_reset / apply_theory_reslot_version once per
+    change, but the nested timetable, room/teacher occupancy and unavailability
+    lookups are built once and only the touched (section, day) pairs are compacted.
+    Rows come back in section/day/slot order with moved markers for every move.
+    """
+    # Transform to sections-based structure
     data = transform_classes_to_sections(original_input_data)
 
     timetable = make_empty_timetable(data)
@@ -1664,67 +3891,35 @@ def run_teacher_reset(original_input_data, current_list, teacher, day, slot):
         else:
             timetable[sec][d][s].append((subj, room, teach))
 
-    changed_sections = set()
-    if teacher and day and slot:
-        for sec in timetable:
-            section_changed = False
-            entries = timetable[sec][day][slot]
-            to_remove = [e for e in entries if len(e) >= 3 and (e[2] or "").strip().lower() == (teacher or "").strip().lower()]
-            # If teacher cancels a lab slot, remove that lab group from all slots of that day (full cancellation).
-            for e in to_remove:
-                if len(e) > 3:
-                    subj = e[0]
-                    grp = e[3]
-                    for s in data["slots"]:
-                        if s == "Lunch Break":
-                            continue
-                        timetable[sec][day][s] = [
-                            x for x in timetable[sec][day][s]
-                            if not (len(x) > 3 and x[0] == subj and x[3] == grp and (x[2] or "").strip().lower() == (teacher or "").strip().lower())
-                        ]
-                        if not timetable[sec][day][s]:
-                            timetable[sec][day][s] = [("FREE", None, None)]
-                        section_changed = True
-
-            new_entries = [e for e in timetable[sec][day][slot] if len(e) < 3 or (e[2] or "").strip().lower() != (teacher or "").strip().lower()]
-            if len(new_entries) != len(entries):
-                if not new_entries:
-                    timetable[sec][day][slot] = [("FREE", None, None)]
-                    section_changed = True
-                else:
-                    timetable[sec][day][slot] = new_entries
-                    section_changed = True
-            if section_changed:
-                changed_sections.add(sec)
+    # occupancy counts, kept up to date as entries are removed and moved
+    used_rooms = defaultdict(int)
+    used_teachers = defaultdict(int)
+    used_teachers_lc = defaultdict(int)
+
+    def occupy(entry, d, s, delta):
+        if not entry or entry[0] in ("FREE", "LUNCH"):
+            return
+        room = entry[1]
+        teach = entry[2]
+        if room:
+            used_rooms[(room, d, s)] += delta
+        if teach:
+            used_teachers[(teach, d, s)] += delta
+            used_teachers_lc[(teach.strip().lower(), d, s)] += delta
 
-    # reconstruct occupancy sets
-    used_rooms = set()
-    used_teachers = set()
     for sec in timetable:
         for d in data["days"]:
             for s in data["slots"]:
                 for entry in timetable[sec][d][s]:
-                    if not entry:
-                        continue
-                    subj = entry[0]
-                    room = entry[1]
-                    teach = entry[2]
-                    if subj in ("FREE", "LUNCH"):
-                        continue
-                    if room:
-                        used_rooms.add((room, d, s))
-                    if teach:
-                        used_teachers.add((teach, d, s))
+                    occupy(entry, d, s, 1)
 
-    slots_all = data["slots"]
-    if "Lunch Break" in slots_all:
-        lunch_idx = slots_all.index("Lunch Break")
-        rightmost_before_lunch = slots_all[lunch_idx - 1] if lunch_idx - 1 >= 0 else None
-        rightmost_after_lunch = slots_all[-1] if len(slots_all) > lunch_idx + 1 else None
-    else:
-        rightmost_before_lunch = slots_all[-2] if len(slots_all) >= 2 else slots_all[0]
-        rightmost_after_lunch = slots_all[-1]
+    unavailable = set()
+    for name, items in data.get("teacher_unavailability", {}).items():
+        for u in items:
+            unavailable.add((name, u.get("day"), u.get("slot")))
 
+    slots_all = data["slots"]
+    slots_no_lunch = [s for s in slots_all if s != "Lunch Break"]
     moved_map = {}  # (section, day, new_slot) -> old_slot
 
     def is_free_slot(sec_name, d, s):
@@ -1747,115 +3942,185 @@ def run_teacher_reset(original_input_data, current_list, teacher, day, slot):
         idxs = sorted(slots_all.index(sname) for sname in slot_names)
         return idxs[0] < lunch_idx < idxs[-1]
 
-    # For each changed section, compact same-day timetable by pulling later entries earlier.
-    for sec in changed_sections:
-        try:
-            slots_no_lunch = [s for s in slots_all if s != "Lunch Break"]
-            i = 0
-            while i < len(slots_no_lunch):
-                dest_slot = slots_no_lunch[i]
-                if not is_free_slot(sec, day, dest_slot):
-                    i += 1
+    def set_slot(sec_name, d, s, entries):
+        for x in timetable[sec_name][d][s]:
+            occupy(x, d, s, -1)
+        if not entries:
+            entries = [("FREE", None, None)]
+            moved_map.pop((sec_name, d, s), None)
+        timetable[sec_name][d][s] = entries
+        for x in entries:
+            occupy(x, d, s, 1)
+
+    def move_entry(sec_name, d, src, dest, entry, same=None):
+        set_slot(sec_name, d, src, [x for x in timetable[sec_name][d][src] if not (same(x, entry) if same else x == entry)])
+        set_slot(sec_name, d, dest, [x for x in timetable[sec_name][d][dest] if x[0] != "FREE"] + [entry])
+        moved_map[(sec_name, d, dest)] = src
+
+    def compact_section_day(sec, day):
+        """Pull later entries of one section's day into earlier free slots."""
+        i = 0
+        while i < len(slots_no_lunch):
+            dest_slot = slots_no_lunch[i]
+            if not is_free_slot(sec, day, dest_slot):
+                i += 1
+                continue
+
+            moved_any = False
+            for j in range(i + 1, len(slots_no_lunch)):
+                src_slot = slots_no_lunch[j]
+                src_entries = [e for e in timetable[sec][day][src_slot] if e and e[0] not in ("FREE", "LUNCH")]
+                if not src_entries:
                     continue
 
-                moved_any = False
-                for j in range(i + 1, len(slots_no_lunch)):
-                    src_slot = slots_no_lunch[j]
-                    src_entries = [e for e in timetable[sec][day][src_slot] if e and e[0] not in ("FREE", "LUNCH")]
-                    if not src_entries:
-                        continue
+                candidate = src_entries[0]
+                room = candidate[1]
+                teach = candidate[2]
 
-                    candidate = src_entries[0]
-                    room = candidate[1]
-                    teach = candidate[2]
+                # Theory single-slot move
+                if len(candidate) <= 3:
+                    if teach and (teach, day, dest_slot) in unavailable:
+                        continue
+                    if teach and used_teachers[(teach, day, dest_slot)] > 0:
+                        continue
+                    if room and used_rooms[(room, day, dest_slot)] > 0:
+                        continue
+                    move_entry(sec, day, src_slot, dest_slot, candidate)
+                    moved_any = True
+                    break
 
-                    # Theory single-slot move
-                    if len(candidate) <= 3:
-                        if teach and teacher_unavailable_on(teach, day, dest_slot, data):
-                            continue
-                        if teach and (teach, day, dest_slot) in used_teachers:
-                            continue
-                        if room and (room, day, dest_slot) in used_rooms:
-                            continue
+                # Lab block move as one full block only (no lunch split)
+                duration = int(candidate[4]) if len(candidate) > 4 and str(candidate[4]).isdigit() else 1
+                duration = max(1, duration)
+                if i + duration > len(slots_no_lunch):
+                    continue
+                if j + duration > len(slots_no_lunch):
+                    continue
 
-                        timetable[sec][day][src_slot] = [x for x in timetable[sec][day][src_slot] if x != candidate]
-                        if not timetable[sec][day][src_slot]:
-                            timetable[sec][day][src_slot] = [("FREE", None, None)]
-                        timetable[sec][day][dest_slot] = [candidate]
+                src_block = slots_no_lunch[j:j + duration]
+                dest_block = slots_no_lunch[i:i + duration]
+                if has_lunch_between(src_block) or has_lunch_between(dest_block):
+                    continue
 
-                        if room:
-                            used_rooms.discard((room, day, src_slot))
-                            used_rooms.add((room, day, dest_slot))
-                        if teach:
-                            used_teachers.discard((teach, day, src_slot))
-                            used_teachers.add((teach, day, dest_slot))
-
-                        moved_map[(sec, day, dest_slot)] = src_slot
-                        moved_any = True
+                # candidate must exist in every source block slot
+                if not all(any(is_same_lab_entry(x, candidate) for x in timetable[sec][day][sb]) for sb in src_block):
+                    continue
+                # destination block must be fully free in section
+                if not all(is_free_slot(sec, day, db) for db in dest_block):
+                    continue
+                # destination global room/teacher availability
+                conflict = False
+                for db in dest_block:
+                    if teach and (teach, day, db) in unavailable:
+                        conflict = True
+                        break
+                    if room and used_rooms[(room, day, db)] > 0:
+                        conflict = True
                         break
+                    if teach and used_teachers[(teach, day, db)] > 0:
+                        conflict = True
+                        break
+                if conflict:
+                    continue
 
-                    # Lab block move as one full block only (no lunch split)
-                    duration = int(candidate[4]) if len(candidate) > 4 and str(candidate[4]).isdigit() else 1
-                    duration = max(1, duration)
-                    if i + duration > len(slots_no_lunch):
-                        continue
-                    if j + duration > len(slots_no_lunch):
-                        continue
+                # move full lab block
+                for sb in src_block:
+                    set_slot(sec, day, sb, [x for x in timetable[sec][day][sb] if not is_same_lab_entry(x, candidate)])
+                for idx, db in enumerate(dest_block):
+                    set_slot(sec, day, db, [candidate])
+                    moved_map[(sec, day, db)] = src_block[idx]
+                moved_any = True
+                break
 
-                    src_block = slots_no_lunch[j:j + duration]
-                    dest_block = slots_no_lunch[i:i + duration]
-                    if has_lunch_between(src_block) or has_lunch_between(dest_block):
-                        continue
+            if not moved_any:
+                i += 1
 
-                    # candidate must exist in every source block slot
-                    if not all(any(is_same_lab_entry(x, candidate) for x in timetable[sec][day][sb]) for sb in src_block):
-                        continue
-                    # destination block must be fully free in section
-                    if not all(is_free_slot(sec, day, db) for db in dest_block):
-                        continue
-                    # destination global room/teacher availability
-                    conflict = False
-                    for db in dest_block:
-                        if teach and teacher_unavailable_on(teach, day, db, data):
-                            conflict = True
-                            break
-                        if room and (room, day, db) in used_rooms:
-                            conflict = True
-                            break
-                        if teach and (teach, day, db) in used_teachers:
-                            conflict = True
-                            break
-                    if conflict:
-                        continue
+    def apply_unavailable(teacher, day, slot):
+        teacher_lc = (teacher or "").strip().lower()
+        changed_sections = []
+        for sec in timetable:
+            section_changed = False
+            entries = timetable[sec][day][slot]
+            to_remove = [e for e in entries if len(e) >= 3 and (e[2] or "").strip().lower() == teacher_lc]
+            # If teacher cancels a lab slot, remove that lab group from all slots of that day (full cancellation).
+            for e in to_remove:
+                if len(e) > 3:
+                    subj = e[0]
+                    grp = e[3]
+                    for s in slots_no_lunch:
+                        set_slot(sec, day, s, [
+                            x for x in timetable[sec][day][s]
+                            if not (len(x) > 3 and x[0] == subj and x[3] == grp and (x[2] or "").strip().lower() == teacher_lc)
+                        ])
+                        section_changed = True
 
-                    # move full lab block
-                    for sb in src_block:
-                        timetable[sec][day][sb] = [x for x in timetable[sec][day][sb] if not is_same_lab_entry(x, candidate)]
-                        if not timetable[sec][day][sb]:
-                            timetable[sec][day][sb] = [("FREE", None, None)]
-                    for db in dest_block:
-                        timetable[sec][day][db] = [candidate]
+            current = timetable[sec][day][slot]
+            new_entries = [e for e in current if len(e) < 3 or (e[2] or "").strip().lower() != teacher_lc]
+            if len(new_entries) != len(current):
+                set_slot(sec, day, slot, new_entries)
+                section_changed = True
+            if section_changed:
+                changed_sections.append(sec)
 
-                    if room:
-                        for sb in src_block:
-                            used_rooms.discard((room, day, sb))
-                        for db in dest_block:
-                            used_rooms.add((room, day, db))
-                    if teach:
-                        for sb in src_block:
-                            used_teachers.discard((teach, day, sb))
-                        for db in dest_block:
-                            used_teachers.add((teach, day, db))
-
-                    for idx in range(duration):
-                        moved_map[(sec, day, dest_block[idx])] = src_block[idx]
-                    moved_any = True
+        # For each changed section, compact same-day timetable by pulling later entries earlier.
+        for sec in changed_sections:
+            try:
+                compact_section_day(sec, day)
+            except Exception:
+                pass
+
+    def apply_reslot(teacher, day, from_slot, to_slot):
+        teacher_lc = (teacher or "").strip().lower()
+        section = None
+        target = None
+        for sec in timetable:
+            for e in timetable[sec][day][from_slot]:
+                if e and e[0] not in ("FREE", "LUNCH") and (e[2] or "").strip().lower() == teacher_lc:
+                    section, target = sec, e
                     break
+            if target:
+                break
+        if not target:
+            raise ValueError("No assignment found for selected slot")
+        if len(target) > 3:
+            raise ValueError("Only theory sessions can be shifted to another slot")
+        if any(e and e[0] not in ("FREE", "LUNCH") for e in timetable[section][day][to_slot]):
+            raise ValueError("Selected target slot is not free for this class section")
+        if used_teachers_lc[(teacher_lc, day, to_slot)] > 0:
+            raise ValueError("Teacher is already occupied in selected target slot")
+
+        move_entry(section, day, from_slot, to_slot, target)
+
+        # pull later theory lectures of the same section/day forward into the gap
+        start_index = slots_no_lunch.index(from_slot) if from_slot in slots_no_lunch else 0
+        for i in range(start_index, len(slots_no_lunch) - 1):
+            free_slot = slots_no_lunch[i]
+            if not is_free_slot(section, day, free_slot):
+                continue
+            for j in range(i + 1, len(slots_no_lunch)):
+                src_slot = slots_no_lunch[j]
+                candidate = next((
+                    e for e in timetable[section][day][src_slot]
+                    if e and e[0] not in ("FREE", "LUNCH") and len(e) <= 3
+                ), None)
+                if candidate is None:
+                    continue
+                cand_teacher_lc = (candidate[2] or "").strip().lower()
+                if cand_teacher_lc and used_teachers_lc[(cand_teacher_lc, day, free_slot)] > 0:
+                    continue
+                if candidate[1] and used_rooms[(candidate[1], day, free_slot)] > 0:
+                    continue
+                move_entry(section, day, src_slot, free_slot, candidate)
+                break
 
-                if not moved_any:
-                    i += 1
-        except Exception:
-            pass
+    for change in changes:
+        if change.get("type") == "reslot_theory":
+            try:
+                apply_reslot(change.get("teacher"), change.get("day"), change.get("fromSlot"), change.get("toSlot"))
+            except Exception:
+                continue
+        elif change.get("teacher") and change.get("day") and change.get("slot"):
+            apply_unavailable(change.get("teacher"), change.get("day"), change.get("slot"))
 
     result = timetable_to_result(timetable, data, moved_map=moved_map)
     return result
@@ -1865,6 +4130,50 @@ def run_teacher_reset(original_input_data, current_list, teacher, day, slot):
 # ----------------- Endpoints -----------------
 
 
+# Handlers run concurrently on threaded workers. Shared state is only written
+# through update_json_state on a fresh copy, and the module-level caches are
+# swapped whole rather than edited, so a reader never sees a half-made change.
+
+
+@app.before_request
+def ensure_background_workers():
+    start_expiry_scheduler()
+    start_email_sender()
+    start_event_reader()
+    start_warm_up()
+
+
+def request_route_label():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    g.metrics_route = request_route_label()
+    inc_metric("serene_http_requests_in_flight", route=g.metrics_route)
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        observe_metric(
+            "serene_http_request_duration_seconds",
+            time.perf_counter() - started,
+            route=g.metrics_route, method=request.method, status=response.status_code
+        )
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    route = g.pop("metrics_route", None)
+    if route is not None:
+        inc_metric("serene_http_requests_in_flight", -1, route=route)
+
+
 @app.route('/auth/login', methods=['POST'])
 def auth_login():
     try:
@@ -1875,12 +4184,15 @@ def auth_login():
         if not username or not password:
             return jsonify({"error": "Username and password are required"}), 400
 
+        get_user_index()  # picks up accounts created or changed by other workers
         user = USERS.get(username)
-        if not user or user.get("password") != password:
+        if not user or not check_user_password(username, user, password):
             return jsonify({"error": "Invalid credentials"}), 401
 
-        session["username"] = username
-        return jsonify({"success": True, "user": public_user(user)})
+        token = issue_session_token(user)
+        session.pop("username", None)
+        session["token"] = token
+        return jsonify({"success": True, "user": public_user(user), "token": token})
     except Exception as e:
         return jsonify({"error": f"Login failed: {str(e)}"}), 500
 
@@ -1888,7 +4200,15 @@ def auth_login():
 @app.route('/auth/logout', methods=['POST'])
 @require_auth
 def auth_logout():
+    """Sign out; bumps the user's revocation version so bearer copies of the token die too.
+
+    Like /admin/sessions/revoke for one user, this ends the user's other sessions as well.
+    """
+    username = current_username()
     session.pop("username", None)
+    session.pop("token", None)
+    if username:
+        revoke_sessions(username)
     return jsonify({"success": True})
 
 
@@ -1905,54 +4225,22 @@ def auth_me():
 @app.route('/auth/register/start', methods=['POST'])
 def auth_register_start():
     try:
-        payload = request.json or {}
-        role = (payload.get("role") or "").strip().lower()
-        username = (payload.get("username") or "").strip()
-        password = payload.get("password") or ""
-        name = (payload.get("name") or "").strip()
-        email = (payload.get("email") or "").strip().lower()
-        teacher_name = (payload.get("teacher_name") or "").strip()
-        section = (payload.get("section") or "").strip()
-        stream = (payload.get("stream") or "").strip().upper()
-        semester = (payload.get("semester") or "").strip()
-        batch = (payload.get("batch") or "").strip()
-        division = (payload.get("division") or "").strip().upper()
-
-        if role not in ("student", "teacher"):
-            return jsonify({"error": "Role must be student or teacher"}), 400
-        if not username or not password or not name or not email:
-            return jsonify({"error": "username, password, name and email are required"}), 400
-        if "@" not in email:
-            return jsonify({"error": "Invalid email"}), 400
-        if role == "student":
-            if not division:
-                division = "A"
-            stream_key = stream.replace(" ", "")
-            if stream_key in ("AIML", "AI&ML", "AI/ML"):
-                stream_key = "AI&ML"
-
-            if stream_key == "CSE":
-                sem_label = to_roman_semester(semester)
-                batch_label = (batch or "Batch-1").strip()
-                section = f"B.TECH CSE {sem_label} Sem {batch_label} - {division}"
-            elif stream_key == "IT":
-                sem_label = to_roman_semester(semester)
-                section = f"B.TECH IT {sem_label} Sem - {division}"
-            elif stream_key == "AI&ML":
-                sem_label = (semester or "6th").strip()
-                section = f"AI & ML {sem_label} Sem - {division}"
-            elif stream and semester and division:
-                section = f"{stream} {semester} Sem - {division}"
-            if not section:
-                return jsonify({"error": "Provide section or stream + semester + division for student registration"}), 400
-
-        if is_username_taken(username):
-            return jsonify({"error": "Username already exists"}), 409
-        if is_email_taken(email):
-            return jsonify({
-                "error": "Email already exists",
-                "details": email_taken_source(email)
-            }), 409
+        fields, error = parse_registration_fields(request.json or {})
+        if error:
+            return jsonify({"error": error}), 400
+        username, password, email = fields["username"], fields["password"], fields["email"]
+
+        def conflict_response(conflict, details):
+            response = {"error": conflict}
+            if details:
+                response["details"] = details
+            return jsonify(response), 409
+
+        # Cheap early reject before paying for the password hash; the check
+        # that counts runs again below, in the same update as the append.
+        conflict, details = check_registration_conflicts(username, email)
+        if conflict:
+            return conflict_response(conflict, details)
 
         now = datetime.utcnow()
         registration_id = int(now.timestamp() * 1000) + random.randint(10, 999)
@@ -1960,57 +4248,142 @@ def auth_register_start():
         expires_at = now + timedelta(minutes=15)
 
         reg = {
+            **fields,
             "id": registration_id,
-            "role": role,
-            "username": username,
-            "password": password,
-            "name": name,
-            "email": email,
-            "teacher_name": teacher_name or name,
-            "section": section,
-            "stream": stream,
-            "semester": semester,
-            "batch": batch,
-            "division": division,
+            "password": hash_password(password),
+            "teacher_name": fields["teacher_name"] or fields["name"],
             "status": "pending_email_verification",
             "verification_code": code,
             "verification_expires_at": expires_at.isoformat() + "Z",
+            # Handed only to the registering client; guards status polling and resends.
+            "status_token": secrets.token_urlsafe(16),
             "created_at": now.isoformat() + "Z"
         }
 
-        regs = get_latest_pending_registrations()
-        regs.append(reg)
-        save_pending_registrations()
-
-        sent = False
-        email_message = ""
-        try:
-            sent, email_message = send_verification_email(email, code)
-        except Exception as mail_error:
-            email_message = f"Failed to send email: {mail_error}"
-
         show_dev_code = os.environ.get("SHOW_DEV_VERIFICATION_CODE", "1") == "1"
-        if not sent and not show_dev_code:
-            regs[:] = [r for r in regs if r.get("id") != registration_id]
-            save_pending_registrations()
+        if email_transport_kind() is None and not show_dev_code:
+            return jsonify({"error": "Email service not configured"}), 502
+        if email_transport_kind() is not None:
+            reg["email_message_id"] = uuid.uuid4().hex
+
+        def register(regs):
+            # Users come from the shared index; registrations from the list being
+            # written, so two sign-ups for the same name cannot both land.
+            for index in (None, build_user_index({}, regs)):
+                conflict, details = check_registration_conflicts(username, email, index)
+                if conflict:
+                    return conflict, details
+            regs.append(reg)
+            return None, None
+
+        conflict, details = update_json_state(
+            PENDING_REGISTRATIONS_FILE, [], register, write_if=lambda result: result[0] is None
+        )
+        if conflict:
+            return conflict_response(conflict, details)
+
+        if reg.get("email_message_id"):
+            enqueue_email(
+                verification_email_message(email, code),
+                message_id=reg["email_message_id"],
+                ref={"registration_id": registration_id}
+            )
             return jsonify({
-                "error": email_message or "Failed to send verification email. Please try again."
-            }), 502
+                "success": True,
+                "registration_id": registration_id,
+                "status_token": reg["status_token"],
+                "email_sent": False,
+                "email_status": "queued",
+                "message": "Verification code is being sent to your email"
+            })
 
-        response = {
+        # Dev fallback: expose code if email is not configured.
+        return jsonify({
             "success": True,
             "registration_id": registration_id,
-            "email_sent": sent,
-            "message": "Verification code sent to your email" if sent else (email_message or "Email delivery failed. Using dev preview code.")
-        }
+            "status_token": reg["status_token"],
+            "email_sent": False,
+            "email_status": "not_configured",
+            "message": "Email service not configured",
+            "verification_code_preview": code
+        })
+    except Exception as e:
+        return jsonify({"error": f"Registration failed: {str(e)}"}), 500
 
-        # Dev fallback: expose code if email is not configured.
-        if not sent and show_dev_code:
-            response["verification_code_preview"] = code
 
-        return jsonify(response)
+def find_registration_for_token(registration_id, token):
+    """Pending registration `registration_id` if `token` is its status token."""
+    reg = next((r for r in get_latest_pending_registrations() if r.get("id") == registration_id), None)
+    if not reg or not reg.get("status_token"):
+        return None
+    if not hmac.compare_digest(str(token or ""), reg["status_token"]):
+        return None
+    return reg
+
+
+@app.route('/auth/register/<int:registration_id>/email_status', methods=['GET'])
+def auth_register_email_status(registration_id):
+    """Poll delivery of the verification email queued by /auth/register/start."""
+    reg = find_registration_for_token(registration_id, request.args.get("token"))
+    if not reg:
+        return jsonify({"error": "Registration request not found"}), 404
+    if not reg.get("email_message_id"):
+        return jsonify({"registration_id": registration_id, "email_status": "not_configured"})
+
+    status = get_email_status(reg["email_message_id"]) or {"email_status": "unknown"}
+    response = {"registration_id": registration_id, **status}
+    show_dev_code = os.environ.get("SHOW_DEV_VERIFICATION_CODE", "1") == "1"
+    if status["email_status"] == "failed" and show_dev_code and reg.get("verification_code"):
+        response["verification_code_preview"] = reg["verification_code"]
+    return jsonify(response)
+
+
+@app.route('/auth/register/<int:registration_id>/resend_email', methods=['POST'])
+def auth_register_resend_email(registration_id):
+    """Queue a fresh verification code after the previous email failed to deliver."""
+    try:
+        payload = request.json or {}
+        reg = find_registration_for_token(registration_id, payload.get("token"))
+        if not reg:
+            return jsonify({"error": "Registration request not found"}), 404
+        if reg.get("status") != "pending_email_verification":
+            return jsonify({"error": f"Registration already {reg.get('status')}"}), 400
+        if email_transport_kind() is None:
+            return jsonify({"error": "Email service not configured"}), 502
+        if reg.get("email_message_id"):
+            status = (get_email_status(reg["email_message_id"]) or {}).get("email_status")
+            if status not in (None, "failed"):
+                return jsonify({"error": f"Verification email is {status}"}), 409
+
+        code = f"{random.randint(100000, 999999)}"
+        message_id = uuid.uuid4().hex
+
+        def reissue(regs):
+            for r in regs:
+                if r.get("id") == registration_id and r.get("status") == "pending_email_verification":
+                    r.update({
+                        "verification_code": code,
+                        "verification_expires_at": (datetime.utcnow() + timedelta(minutes=15)).isoformat() + "Z",
+                        "email_message_id": message_id
+                    })
+                    return True
+            return False
+
+        if not update_json_state(PENDING_REGISTRATIONS_FILE, [], reissue, write_if=bool):
+            return jsonify({"error": "Registration request not found"}), 404
+        enqueue_email(
+            verification_email_message(reg["email"], code),
+            message_id=message_id,
+            ref={"registration_id": registration_id}
+        )
+        return jsonify({
+            "success": True,
+            "registration_id": registration_id,
+            "email_status": "queued",
+            "message": "A new verification code is being sent to your email"
+        })
     except Exception as e:
-        return jsonify({"error": f"Registration failed: {str(e)}"}), 500
+        return jsonify({"error": f"Resend failed: {str(e)}"}), 500
 
 
 @app.route('/auth/register/verify', methods=['POST'])
@@ -2023,51 +4396,63 @@ def auth_register_verify():
         if not registration_id or not code:
             return jsonify({"error": "registration_id and code are required"}), 400
 
-        regs = get_latest_pending_registrations()
-        reg = next((r for r in regs if r.get("id") == int(registration_id)), None)
-        if not reg:
-            return jsonify({"error": "Registration request not found"}), 404
-
-        if reg.get("status") != "pending_email_verification":
-            return jsonify({"error": f"Registration already {reg.get('status')}"}), 400
-
-        expires = parse_iso_utc(reg.get("verification_expires_at"))
-        if not expires or expires <= datetime.utcnow():
-            return jsonify({"error": "Verification code expired. Please register again."}), 400
+        registration_id = int(registration_id)
+        now = datetime.utcnow()
 
-        if code != str(reg.get("verification_code")):
-            return jsonify({"error": "Invalid verification code"}), 400
+        def verify(regs):
+            reg = next((r for r in regs if r.get("id") == registration_id), None)
+            if not reg:
+                return None, None, ("Registration request not found", 404)
+            if reg.get("status") != "pending_email_verification":
+                return None, None, (f"Registration already {reg.get('status')}", 400)
+            expires = parse_iso_utc(reg.get("verification_expires_at"))
+            if not expires or expires <= now:
+                return None, None, ("Verification code expired. Please register again.", 400)
+            if code != str(reg.get("verification_code")):
+                return None, None, ("Invalid verification code", 400)
+
+            original = copy.deepcopy(reg)
+            reg["email_verified"] = True
+            reg["verified_at"] = now.isoformat() + "Z"
+            reg.pop("verification_code", None)
+            reg.pop("verification_expires_at", None)
+            if reg.get("role") == "student":
+                # Students need no approval: claim the registration, the account is added next.
+                regs[:] = [r for r in regs if r is not reg]
+            else:
+                reg["status"] = "pending_admin_approval"
+            return copy.deepcopy(reg), original, None
 
-        reg["email_verified"] = True
-        reg["verified_at"] = datetime.utcnow().isoformat() + "Z"
-        reg.pop("verification_code", None)
-        reg.pop("verification_expires_at", None)
+        reg, original, error = update_json_state(
+            PENDING_REGISTRATIONS_FILE, [], verify, write_if=lambda result: result[2] is None
+        )
+        if error:
+            return jsonify({"error": error[0]}), error[1]
 
         if reg.get("role") == "student":
-            if reg.get("username") in USERS:
+            if not add_user_account(build_user_from_registration(reg)):
+                restore_state_item(PENDING_REGISTRATIONS_FILE, original)
                 return jsonify({"error": "Username already exists"}), 409
-            USERS[reg["username"]] = build_user_from_registration(reg)
-            save_users()
             add_activity_log(
                 "student_registration_approved",
                 f"Student account created: {reg.get('username')}",
                 {"username": reg.get("username")}
             )
-            regs[:] = [r for r in regs if r.get("id") != reg.get("id")]
-            save_pending_registrations()
             return jsonify({
                 "success": True,
                 "status": "approved",
                 "message": "Student registration approved. Please login."
             })
 
-        reg["status"] = "pending_admin_approval"
         add_activity_log(
             "teacher_registration_pending",
             f"Teacher registration pending approval: {reg.get('username')}",
             {"username": reg.get("username")}
         )
-        save_pending_registrations()
+        publish_event(
+            "registration_pending",
+            {"registration_id": reg.get("id"), "username": reg.get("username"), "role": reg.get("role")}
+        )
         return jsonify({
             "success": True,
             "status": "pending_admin_approval",
@@ -2086,39 +4471,35 @@ def admin_registration_requests_api():
     return jsonify({"requests": teacher_regs})
 
 
+def teacher_registration_check(reg):
+    if reg.get("role") != "teacher":
+        return "Only teacher requests require admin approval", 400
+    if reg.get("status") != "pending_admin_approval":
+        return f"Request already {reg.get('status')}", 400
+    return None
+
+
 @app.route('/admin/registration_requests/<int:registration_id>/approve', methods=['POST'])
 @require_roles('admin')
 def admin_approve_registration_request_api(registration_id):
     try:
-        regs = get_latest_pending_registrations()
-        reg = next((r for r in regs if r.get("id") == registration_id), None)
-        if not reg:
-            return jsonify({"error": "Registration request not found"}), 404
-        if reg.get("role") != "teacher":
-            return jsonify({"error": "Only teacher requests require admin approval"}), 400
-        if reg.get("status") != "pending_admin_approval":
-            return jsonify({"error": f"Request already {reg.get('status')}"}), 400
-
-        if reg.get("username") in USERS:
+        # Claim the request first so a concurrent approve/reject cannot resolve it too.
+        reg, error = take_state_item(
+            PENDING_REGISTRATIONS_FILE, registration_id, teacher_registration_check,
+            missing="Registration request not found"
+        )
+        if error:
+            return jsonify({"error": error[0]}), error[1]
+        if not add_user_account(build_user_from_registration(reg)):
+            restore_state_item(PENDING_REGISTRATIONS_FILE, reg)
             return jsonify({"error": "Username already exists"}), 409
 
-        USERS[reg["username"]] = build_user_from_registration(reg)
-        save_users()
-        resolved = {
-            "id": reg.get("id"),
-            "username": reg.get("username"),
-            "role": reg.get("role"),
-            "status": "approved",
-            "resolved_by": session.get("username"),
-            "resolved_at": datetime.utcnow().isoformat() + "Z"
-        }
+        resolved = registration_resolution(reg, "approved")
         add_activity_log(
             "teacher_registration_approved",
             f"Teacher registration approved: {reg.get('username')}",
-            {"username": reg.get("username"), "approvedBy": session.get("username")}
+            {"username": reg.get("username"), "approvedBy": current_username()}
         )
-        regs[:] = [r for r in regs if r.get("id") != reg.get("id")]
-        save_pending_registrations()
 
         return jsonify({"success": True, "request": resolved})
     except Exception as e:
@@ -2129,186 +4510,967 @@ def admin_approve_registration_request_api(registration_id):
 @require_roles('admin')
 def admin_reject_registration_request_api(registration_id):
     try:
-        regs = get_latest_pending_registrations()
-        reg = next((r for r in regs if r.get("id") == registration_id), None)
-        if not reg:
-            return jsonify({"error": "Registration request not found"}), 404
-        if reg.get("role") != "teacher":
-            return jsonify({"error": "Only teacher requests require admin approval"}), 400
-        if reg.get("status") != "pending_admin_approval":
-            return jsonify({"error": f"Request already {reg.get('status')}"}), 400
-
         payload = request.json or {}
         reason = (payload.get("reason") or "Rejected by admin").strip()
 
-        rejected = {
-            "id": reg.get("id"),
-            "username": reg.get("username"),
-            "role": reg.get("role"),
-            "status": "rejected",
-            "reason": reason,
-            "resolved_by": session.get("username"),
-            "resolved_at": datetime.utcnow().isoformat() + "Z"
-        }
+        reg, error = take_state_item(
+            PENDING_REGISTRATIONS_FILE, registration_id, teacher_registration_check,
+            missing="Registration request not found"
+        )
+        if error:
+            return jsonify({"error": error[0]}), error[1]
+
+        rejected = registration_resolution(reg, "rejected", reason)
         add_activity_log(
             "teacher_registration_rejected",
             f"Teacher registration rejected: {reg.get('username')}",
-            {"username": reg.get("username"), "rejectedBy": session.get("username"), "reason": reason}
+            {"username": reg.get("username"), "rejectedBy": current_username(), "reason": reason}
         )
-        regs[:] = [r for r in regs if r.get("id") != reg.get("id")]
-        save_pending_registrations()
 
         return jsonify({"success": True, "request": rejected})
     except Exception as e:
         return jsonify({"error": f"Rejection failed: {str(e)}"}), 500
 
 
-@app.route('/generate_timetable', methods=['POST'])
+@app.route('/admin/registration_requests/bulk', methods=['POST'])
+@require_roles('admin')
+def admin_bulk_registration_requests_api():
+    """Approve or reject many teacher requests: {"action", "ids" | "all": true, "reason"}."""
+    payload = {}
+    try:
+        payload = request.json or {}
+        action = (payload.get("action") or "").strip().lower()
+        if action not in ("approve", "reject"):
+            return jsonify({"error": "action must be approve or reject"}), 400
+        reason = (payload.get("reason") or "Rejected by admin").strip()
+        requested_ids = None if payload.get("all") else (payload.get("ids") or [])
+        if requested_ids is not None and not requested_ids:
+            return jsonify({"error": "Provide ids or all=true"}), 400
+
+        def resolve(regs):
+            # Runs inside update_json_state, so it may run again on a conflict; start clean each time.
+            users = read_json_file(USERS_FILE, {})
+            if requested_ids is None:
+                ids = [r.get("id") for r in regs if r.get("role") == "teacher" and r.get("status") == "pending_admin_approval"]
+            else:
+                ids = requested_ids
+            by_id = {r.get("id"): r for r in regs}
+            taken = {normalize_identity(name) for name in users}
+            results, resolved = [], {}
+            for raw_id in ids:
+                try:
+                    registration_id = int(raw_id)
+                except (TypeError, ValueError):
+                    results.append({"id": raw_id, "status": "error", "error": "Invalid id"})
+                    continue
+                if registration_id in resolved:
+                    results.append({"id": registration_id, "status": "error", "error": "Duplicate id in request"})
+                    continue
+                reg = by_id.get(registration_id)
+                if not reg:
+                    results.append({"id": registration_id, "status": "error", "error": "Registration request not found"})
+                    continue
+                if reg.get("role") != "teacher":
+                    results.append({"id": registration_id, "status": "error", "error": "Only teacher requests require admin approval"})
+                    continue
+                if reg.get("status") != "pending_admin_approval":
+                    results.append({"id": registration_id, "status": "error", "error": f"Request already {reg.get('status')}"})
+                    continue
+                if action == "approve":
+                    if normalize_identity(reg.get("username")) in taken:
+                        results.append({"id": registration_id, "status": "error", "error": "Username already exists"})
+                        continue
+                    taken.add(normalize_identity(reg.get("username")))
+                    results.append(registration_resolution(reg, "approved"))
+                else:
+                    results.append(registration_resolution(reg, "rejected", reason))
+                resolved[registration_id] = reg
+            regs[:] = [r for r in regs if r.get("id") not in resolved]
+            return ids, results, resolved
+
+        # Claim the registrations first: once removed from the pending list no other
+        # request can resolve them, and the accounts are then merged into the latest users.
+        ids, results, resolved = update_json_state(PENDING_REGISTRATIONS_FILE, [], resolve)
+        if not ids:
+            return jsonify({"error": "Provide ids or all=true"}), 400
+
+        if action == "approve" and resolved:
+            def add_accounts(users):
+                clashes = []
+                taken = {normalize_identity(name) for name in users}
+                for registration_id, reg in resolved.items():
+                    if normalize_identity(reg.get("username")) in taken:
+                        clashes.append(registration_id)
+                        continue
+                    users[reg["username"]] = build_user_from_registration(reg)
+                    taken.add(normalize_identity(reg.get("username")))
+                return clashes
+
+            clashes = update_json_state(USERS_FILE, {}, add_accounts)
+            if clashes:
+                # Someone took the username between the two writes: put those requests back.
+                restored = [resolved.pop(registration_id) for registration_id in clashes]
+                update_json_state(PENDING_REGISTRATIONS_FILE, [], lambda regs: regs.extend(restored))
+                results = [
+                    {"id": r["id"], "status": "error", "error": "Username already exists"} if r.get("id") in clashes else r
+                    for r in results
+                ]
+
+        if resolved:
+            get_user_index()
+            verb = "approved" if action == "approve" else "rejected"
+            add_activity_log(
+                f"teacher_registrations_bulk_{verb}",
+                f"{len(resolved)} teacher registration(s) {verb}",
+                {"ids": sorted(resolved), "by": current_username()}
+            )
+
+        return jsonify({
+            "success": True,
+            "summary": {
+                "requested": len(ids),
+                "resolved": len(resolved),
+                "errors": len(ids) - len(resolved)
+            },
+            "results": results
+        })
+    except Exception as e:
+        return jsonify({"error": f"Bulk {payload.get('action', 'update')} failed: {str(e)}"}), 500
+
+
+def import_format():
+    fmt = (request.args.get("format") or "").strip().lower()
+    if fmt in ("csv", "ndjson", "jsonl"):
+        return "csv" if fmt == "csv" else "ndjson"
+    mimetype = request.mimetype or ""
+    if mimetype in ("text/csv", "application/csv"):
+        return "csv"
+    if mimetype in ("application/x-ndjson", "application/jsonl", "application/x-jsonlines", "application/json-lines"):
+        return "ndjson"
+    return None
+
+
+def iter_import_rows(stream, fmt):
+    """Yield (row number, row dict, parse error) from a CSV or JSON-lines request body."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for row_no, row in enumerate(csv.DictReader(text), start=2):
+            yield row_no, {k.strip(): v for k, v in row.items() if k}, None
+        return
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_no, None, f"Invalid JSON: {exc}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "Each line must be a JSON object"
+            continue
+        yield line_no, row, None
+
+
+@app.route('/admin/users/import', methods=['POST'])
+@require_roles('admin')
+def admin_import_users_api():
+    """Create active accounts from a streamed CSV / JSON-lines body (?dry_run=1 validates only)."""
+    fmt = import_format()
+    if not fmt:
+        return jsonify({"error": "Send text/csv or application/x-ndjson, or pass ?format=csv|ndjson"}), 400
+    dry_run = (request.args.get("dry_run") or "").strip().lower() in ("1", "true", "yes")
+
+    try:
+        users = read_json_file(USERS_FILE, {}) or dict(USERS)
+        index = build_user_index(users, load_pending_registrations())
+        seen_usernames, seen_emails = set(), set()
+        results = []
+        accepted = []
+
+        for row_no, row, parse_error in iter_import_rows(request.stream, fmt):
+            if len(results) >= BULK_IMPORT_MAX_ROWS:
+                return jsonify({"error": f"Import is limited to {BULK_IMPORT_MAX_ROWS} rows"}), 413
+            if parse_error:
+                results.append({"row": row_no, "status": "invalid", "error": parse_error})
+                continue
+            fields, error = parse_registration_fields(row, require_password=False)
+            if error:
+                results.append({"row": row_no, "username": row.get("username"), "status": "invalid", "error": error})
+                continue
+
+            username_key = normalize_identity(fields["username"])
+            email_key = normalize_identity(fields["email"])
+            conflict, _ = check_registration_conflicts(fields["username"], fields["email"], index)
+            if not conflict and username_key in seen_usernames:
+                conflict = "Username repeated in import"
+            if not conflict and email_key in seen_emails:
+                conflict = "Email repeated in import"
+            if conflict:
+                results.append({"row": row_no, "username": fields["username"], "status": "duplicate", "error": conflict})
+                continue
+
+            seen_usernames.add(username_key)
+            seen_emails.add(email_key)
+            if not fields["password"]:
+                env_name = "DEFAULT_TEACHER_PASSWORD" if fields["role"] == "teacher" else "DEFAULT_STUDENT_PASSWORD"
+                fields["password"] = os.environ.get(env_name, "teacher123" if fields["role"] == "teacher" else "student123")
+            fields["teacher_name"] = fields["teacher_name"] or fields["name"]
+            accepted.append(fields)
+            results.append({"row": row_no, "username": fields["username"], "status": "valid" if dry_run else "created"})
+
+        if accepted and not dry_run:
+            hashes = hash_passwords([fields["password"] for fields in accepted])
+            new_users = [
+                build_user_from_registration({**fields, "password": hashed})
+                for fields, hashed in zip(accepted, hashes)
+            ]
+
+            def add_accounts(current):
+                # Merged into the latest stored users; accounts created meanwhile win.
+                taken = {normalize_identity(name) for name in current}
+                skipped = set()
+                for user in new_users:
+                    if normalize_identity(user["username"]) in taken:
+                        skipped.add(user["username"])
+                        continue
+                    current[user["username"]] = user
+                return skipped
+
+            skipped = update_json_state(USERS_FILE, {}, add_accounts)
+            for result in results:
+                if result["status"] == "created" and result["username"] in skipped:
+                    result.update({"status": "duplicate", "error": "Username already exists"})
+            get_user_index()
+            if len(accepted) > len(skipped):
+                add_activity_log(
+                    "users_imported",
+                    f"Imported {len(accepted) - len(skipped)} account(s)",
+                    {"count": len(accepted) - len(skipped), "by": current_username()}
+                )
+
+        counts = defaultdict(int)
+        for result in results:
+            counts[result["status"]] += 1
+        return jsonify({
+            "success": True,
+            "dry_run": dry_run,
+            "summary": {
+                "rows": len(results),
+                "created": counts["created"],
+                "valid": counts["created"] + counts["valid"],
+                "duplicate": counts["duplicate"],
+                "invalid": counts["invalid"]
+            },
+            "results": results
+        })
+    except Exception as e:
+        return jsonify({"error": f"Import failed: {str(e)}"}), 500
+
+
+def generation_profile_requested():
+    if GENERATION_PROFILE_MODE == "always":
+        return True
+    if GENERATION_PROFILE_MODE == "off":
+        return False
+    return (request.args.get("profile") or "").strip().lower() in ("1", "true", "yes")
+
+
+def run_theory_passes(data, timetable, fixed_teachers, fixed_classrooms, reserved=None):
+    """
+    Place theory lectures on a timetable that already holds its labs.
+
+    Up to three passes: normal, relaxed subject cap, then teacher-overflow.
+    Returns (timetable, unfulfilled, placement_data, teacher_limit_ignored),
+    where placement_data carries the constraints of the last pass that ran.
+    """
+    # Assign theory
+    with profile_phase("theory.normal"):
+        timetable, unfulfilled = assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms,
+                                                        reserved=reserved)
+    # Constraints of the last theory pass, so what-if simulations start from what was really enforced.
+    placement_data = data
+    teacher_limit_ignored = False
+
+    # If some unfulfilled, do a relaxed re-try (existing logic)
+    if unfulfilled:
+        with profile_phase("theory.relaxed"):
+            for sec in timetable:
+                for day in data["days"]:
+                    for slot in data["slots"]:
+                        if slot == "Lunch Break":
+                            continue
+                        new_entries = []
+                        for entry in timetable[sec][day][slot]:
+                            if len(entry) > 3:
+                                new_entries.append(entry)
+                        timetable[sec][day][slot] = new_entries
+            data_relaxed = copy.deepcopy(data)
+            if "constraints" not in data_relaxed:
+                data_relaxed["constraints"] = {}
+            data_relaxed["constraints"]["max_lectures_per_subject_per_day"] = data_relaxed["constraints"].get("max_lectures_per_subject_per_day", 2) + 1
+            timetable, unfulfilled2 = assign_theory_subjects(data_relaxed, timetable, fixed_teachers, fixed_classrooms,
+                                                             reserved=reserved)
+            unfulfilled = unfulfilled2
+            placement_data = data_relaxed
+
+    # Final fallback: if still unfulfilled, allow teacher daily-hour overflow to maximize placement.
+    if unfulfilled:
+        with profile_phase("theory.overflow"):
+            for sec in timetable:
+                for day in data["days"]:
+                    for slot in data["slots"]:
+                        if slot == "Lunch Break":
+                            continue
+                        timetable[sec][day][slot] = [entry for entry in timetable[sec][day][slot] if len(entry) > 3]
+
+            data_overflow = copy.deepcopy(data)
+            if "constraints" not in data_overflow:
+                data_overflow["constraints"] = {}
+            data_overflow["constraints"]["max_lectures_per_subject_per_day"] = data_overflow["constraints"].get("max_lectures_per_subject_per_day", 2) + 1
+            data_overflow["constraints"]["max_lectures_per_day_section"] = data_overflow["constraints"].get("max_lectures_per_day_section", 6) + 1
+            timetable, unfulfilled = assign_theory_subjects(
+                data_overflow,
+                timetable,
+                fixed_teachers,
+                fixed_classrooms,
+                ignore_teacher_daily_limit=True,
+                reserved=reserved
+            )
+            placement_data = data_overflow
+            teacher_limit_ignored = True
+
+    return timetable, unfulfilled, placement_data, teacher_limit_ignored
+
+
+def run_generation_pipeline(request_data, reserved=None):
+    """
+    Generate a timetable for validated classes-based input.
+
+    Labs first, then up to three theory passes (normal, relaxed subject cap,
+    teacher-overflow), suggestions for anything still unfulfilled and stats.
+    Each step is timed when a generation profile is active. `reserved` holds
+    room/teacher slots already taken by other timetables (see batch generation).
+    """
+    # Transform classes-based structure to sections-based structure
+    with profile_phase("transform"):
+        data = transform_classes_to_sections(request_data)
+
+    print(f"Processing {len(data['sections'])} sections from {len(request_data.get('classes', []))} classes")
+
+    with profile_phase("setup"):
+        fixed_classrooms = assign_fixed_classrooms(data)
+        fixed_teachers = create_fixed_teacher_mapping(data)
+        timetable = make_empty_timetable(data)
+
+    # Assign labs first
+    with profile_phase("labs"):
+        timetable = assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms, reserved=reserved)
+    # Then theory
+    timetable, unfulfilled, placement_data, teacher_limit_ignored = run_theory_passes(
+        data, timetable, fixed_teachers, fixed_classrooms, reserved=reserved
+    )
+
+    # Generate suggestions if any unfulfilled remain
+    suggestions = {}
+    what_if = []
+    if unfulfilled:
+        with profile_phase("suggestions"):
+            what_if = simulate_what_if(placement_data, timetable, unfulfilled, fixed_teachers, fixed_classrooms,
+                                       ignore_teacher_daily_limit=teacher_limit_ignored, reserved=reserved)
+            suggestions = generate_suggestions(data, timetable, unfulfilled, fixed_teachers, what_if=what_if,
+                                               reserved=reserved)
+
+    # Calculate statistics
+    with profile_phase("stats"):
+        stats = calculate_timetable_stats(timetable, request_data)
+
+    with profile_phase("serialize"):
+        result = timetable_to_result(timetable, data)
+    profile_count("unfulfilled_lectures", sum(sum(subs.values()) for subs in unfulfilled.values()))
+
+    return {
+        "timetable": result,
+        "unfulfilled": unfulfilled,
+        "suggestions": suggestions,
+        "what_if": what_if,
+        "statistics": stats
+    }
+
+
+def rows_occupancy(rows):
+    """(room, day, slot) and (teacher, day, slot) keys booked by result rows."""
+    occupancy = {"rooms": set(), "teachers": set()}
+    for row in rows:
+        if row.get("room"):
+            occupancy["rooms"].add((row["room"], row["day"], row["slot"]))
+        if row.get("teacher"):
+            occupancy["teachers"].add((row["teacher"], row["day"], row["slot"]))
+    return occupancy
+
+
+def count_cross_clashes(occupancies, limit=20):
+    """Keys booked by more than one department; each extra booking counts as one clash."""
+    totals = {"rooms": 0, "teachers": 0}
+    examples = []
+    for kind in totals:
+        owners = defaultdict(list)
+        for name, occupancy in occupancies:
+            for key in occupancy[kind]:
+                owners[key].append(name)
+        for (resource, day, slot), names in sorted(owners.items()):
+            if len(names) < 2:
+                continue
+            totals[kind] += len(names) - 1
+            if len(examples) < limit:
+                examples.append({"kind": kind[:-1], "name": resource, "day": day, "slot": slot, "departments": names})
+    return {**totals, "total": totals["rooms"] + totals["teachers"], "examples": examples}
+
+
+def shared_resources(inputs):
+    """Rooms, labs and teachers listed by more than one department input."""
+    seen = {"rooms": defaultdict(set), "teachers": defaultdict(set)}
+    for name, input_data in inputs:
+        for room in list(input_data.get("rooms", [])) + list(input_data.get("labs", [])):
+            seen["rooms"][room].add(name)
+        for pool in (input_data.get("teachers", {}), input_data.get("lab_teachers", {})):
+            for listed in pool.values():
+                for teacher in (listed if isinstance(listed, list) else [listed]):
+                    if teacher:
+                        seen["teachers"][teacher].add(name)
+    return {kind: sorted(k for k, owners in found.items() if len(owners) > 1) for kind, found in seen.items()}
+
+
+def run_batch_generation(departments, compare_independent=True):
+    """
+    Generate several department inputs against one shared room/teacher pool.
+
+    Departments are solved in the given order; each one sees every slot the
+    earlier ones booked as reserved, so the combined plan never double-books a
+    shared room or teacher. With `compare_independent`, each later department
+    is also solved alone and the double bookings that plan would have had are
+    reported as clashes avoided (the first department is identical either way).
+    """
+    reserved = {"rooms": set(), "teachers": set()}
+    results = []
+    independent = []
+    for index, (name, input_data) in enumerate(departments):
+        with timed_metric("serene_generation_duration_seconds"):
+            outcome = run_generation_pipeline(input_data, reserved=reserved)
+        occupancy = rows_occupancy(outcome["timetable"])
+        if compare_independent:
+            if index == 0:
+                independent.append((name, occupancy))
+            else:
+                with timed_metric("serene_generation_duration_seconds"):
+                    alone = run_generation_pipeline(input_data)
+                independent.append((name, rows_occupancy(alone["timetable"])))
+        reserved["rooms"] |= occupancy["rooms"]
+        reserved["teachers"] |= occupancy["teachers"]
+        results.append((name, outcome, occupancy))
+
+    return {
+        "departments": [
+            {
+                "name": name,
+                "timetable": outcome["timetable"],
+                "unfulfilled": outcome["unfulfilled"],
+                "suggestions": outcome["suggestions"],
+                "what_if": outcome["what_if"],
+                "statistics": outcome["statistics"]
+            }
+            for name, outcome, _ in results
+        ],
+        "shared_resources": shared_resources(departments),
+        "remaining_clashes": count_cross_clashes([(name, occ) for name, _, occ in results]),
+        "clashes_avoided": count_cross_clashes(independent) if compare_independent else None
+    }
+
+
+# Constraints that change lab placement; the rest only affect theory passes.
+SWEEP_LAB_KEYS = ("lab_capacity", "lab_session_duration", "max_lectures_per_day_teacher")
+SWEEP_THEORY_KEYS = ("max_lectures_per_subject_per_day", "max_lectures_per_day_section")
+SWEEP_COLUMNS = (
+    "unfulfilled", "unscheduled_labs", "utilization_percentage", "section_idle_gaps",
+    "teacher_idle_gaps", "teacher_max_consecutive", "subject_spread", "lab_day_fairness"
+)
+
+
+def apply_sweep_values(data, values):
+    """Copy of compiled `data` with sweep values set; lab_capacity is top-level, the rest are constraints."""
+    data = dict(data)
+    data["constraints"] = dict(data.get("constraints", {}))
+    for key, value in values.items():
+        if key == "lab_capacity":
+            data["lab_capacity"] = value
+        else:
+            data["constraints"][key] = value
+    return data
+
+
+def run_sweep_task(data, fixed_teachers, fixed_classrooms, lab_values, variants):
+    """
+    Process-pool worker: place labs once for `lab_values`, then run the theory
+    passes for every (index, theory_values) variant on a copy of that placement.
+    """
+    lab_data = apply_sweep_values(copy.deepcopy(data), lab_values)
+    lab_timetable = assign_all_labs(lab_data, make_empty_timetable(lab_data), fixed_teachers, fixed_classrooms)
+    stats_input = {"days": data["days"], "slots": data["slots"], "classes": []}
+
+    rows = []
+    for index, theory_values in variants:
+        variant_data = apply_sweep_values(lab_data, theory_values)
+        timetable, unfulfilled, _, _ = run_theory_passes(
+            variant_data, copy.deepcopy(lab_timetable), fixed_teachers, fixed_classrooms
+        )
+        stats = calculate_timetable_stats(timetable, stats_input)
+        quality = stats["quality"]
+        rows.append((index, [
+            sum(sum(subs.values()) for subs in unfulfilled.values()),
+            quality["unscheduled_labs"],
+            round(stats["utilization_percentage"], 2),
+            quality["totals"]["section_idle_gaps"],
+            quality["totals"]["teacher_idle_gaps"],
+            quality["totals"]["teacher_max_consecutive"],
+            quality["subject_spread"],
+            quality["lab_day_fairness"]
+        ]))
+    return rows
+
+
+_SWEEP_POOL = {"pid": None, "pool": None}
+
+
+def get_sweep_pool():
+    """Process-wide sweep pool of SWEEP_MAX_WORKERS, created on first use.
+
+    Workers come from a forkserver (spawn where that is unavailable), never from
+    a fork of this threaded worker, and concurrent sweeps queue on the same pool.
+    """
+    with _BACKGROUND_LOCK:
+        if _SWEEP_POOL["pid"] != os.getpid() or _SWEEP_POOL["pool"] is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _SWEEP_POOL["pool"] = ProcessPoolExecutor(
+                max_workers=SWEEP_MAX_WORKERS, mp_context=multiprocessing.get_context(method)
+            )
+            _SWEEP_POOL["pid"] = os.getpid()
+        return _SWEEP_POOL["pool"]
+
+
+def reset_sweep_pool(pool):
+    with _BACKGROUND_LOCK:
+        if _SWEEP_POOL["pool"] is pool:
+            _SWEEP_POOL["pool"] = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_constraint_sweep(request_data, grid, max_workers=None):
+    """
+    Generate every combination of `grid` ({constraint: [values]}) and tabulate the outcomes.
+
+    The input is compiled once. Combinations are grouped by their lab-affecting
+    values so labs are placed once per group and only the theory passes rerun;
+    groups (split further when there are spare workers) run on the shared sweep pool.
+    """
+    keys = list(grid)
+    combinations = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    data = transform_classes_to_sections(request_data)
+    fixed_classrooms = assign_fixed_classrooms(data)
+    fixed_teachers = create_fixed_teacher_mapping(data)
+
+    groups = defaultdict(list)
+    for index, combo in enumerate(combinations):
+        lab_values = tuple((k, combo[k]) for k in keys if k in SWEEP_LAB_KEYS)
+        groups[lab_values].append((index, {k: v for k, v in combo.items() if k in SWEEP_THEORY_KEYS}))
+
+    workers = max(1, min(max_workers or SWEEP_MAX_WORKERS, len(combinations)))
+    per_group = max(1, workers // len(groups))
+    tasks = []
+    for lab_values, variants in groups.items():
+        size = math.ceil(len(variants) / min(per_group, len(variants)))
+        for start in range(0, len(variants), size):
+            tasks.append((data, fixed_teachers, fixed_classrooms, dict(lab_values), variants[start:start + size]))
+
+    if workers > 1 and len(tasks) > 1:
+        pool = get_sweep_pool()
+        try:
+            outputs = list(pool.map(run_sweep_task, *zip(*tasks)))
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for the next sweep.
+            reset_sweep_pool(pool)
+            raise
+    else:
+        outputs = [run_sweep_task(*task) for task in tasks]
+
+    table = [None] * len(combinations)
+    for output in outputs:
+        for index, row in output:
+            table[index] = [combinations[index][k] for k in keys] + row
+
+    column = {name: i + len(keys) for i, name in enumerate(SWEEP_COLUMNS)}
+    best = min(range(len(table)), key=lambda i: (
+        table[i][column["unfulfilled"]],
+        table[i][column["unscheduled_labs"]],
+        table[i][column["section_idle_gaps"]] + table[i][column["teacher_idle_gaps"]]
+    ))
+    return {
+        "columns": keys + list(SWEEP_COLUMNS),
+        "rows": table,
+        "best": best,
+        "lab_placements": len(tasks),
+        "workers": min(workers, len(tasks))
+    }
+
+
+@app.route('/generate_timetable', methods=['POST'])
+@require_roles('admin')
+def generate_timetable_api():
+    try:
+        request_data = request.json
+        if not request_data:
+            return jsonify({"error": "No input data"}), 400
+
+        profile = new_generation_profile() if generation_profile_requested() else None
+        with generation_profiling(profile):
+            # Validate input data structure
+            with profile_phase("validate"):
+                validation_result = validate_input_data(request_data)
+            if not validation_result['valid']:
+                return jsonify({
+                    "error": "Invalid input data",
+                    "validation_errors": validation_result['errors'],
+                    "validation_warnings": validation_result['warnings']
+                }), 400
+
+            inc_metric("serene_generation_jobs_in_progress")
+            try:
+                with timed_metric("serene_generation_duration_seconds"):
+                    outcome = run_generation_pipeline(request_data)
+            finally:
+                inc_metric("serene_generation_jobs_in_progress", -1)
+
+        response = {
+            "success": True,
+            "timetable": outcome["timetable"],
+            "unfulfilled": outcome["unfulfilled"],
+            "suggestions": outcome["suggestions"],
+            "what_if": outcome["what_if"],
+            "statistics": outcome["statistics"],
+            "validation_warnings": validation_result.get('warnings', [])
+        }
+        if profile is not None:
+            exported = export_generation_profile(profile)
+            record_generation_profile(exported)
+            response["profile"] = exported
+        return jsonify(response)
+
+    except Exception as e:
+        print(f"Error generating timetable: {str(e)}")
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
+
+@app.route('/generate_timetable/batch', methods=['POST'])
+@require_roles('admin')
+def generate_timetable_batch_api():
+    """Generate several departments against one shared room/teacher pool."""
+    try:
+        payload = request.json or {}
+        departments = payload.get("departments")
+        if not isinstance(departments, list) or not departments:
+            return jsonify({"error": "departments must be a non-empty list of {name, input}"}), 400
+        if len(departments) > BATCH_GENERATION_MAX_DEPARTMENTS:
+            return jsonify({"error": f"Batch generation is limited to {BATCH_GENERATION_MAX_DEPARTMENTS} departments"}), 413
+
+        named_inputs = []
+        invalid = []
+        warnings = {}
+        for i, department in enumerate(departments):
+            department = department if isinstance(department, dict) else {}
+            name = str(department.get("name") or f"department_{i + 1}")
+            input_data = department.get("input")
+            if not isinstance(input_data, dict):
+                invalid.append({"name": name, "errors": ["input must be an object"]})
+                continue
+            validation_result = validate_input_data(input_data)
+            if not validation_result["valid"]:
+                invalid.append({"name": name, "errors": validation_result["errors"]})
+                continue
+            warnings[name] = validation_result.get("warnings", [])
+            named_inputs.append((name, input_data))
+        if invalid:
+            return jsonify({"error": "Invalid input data", "departments": invalid}), 400
+        if len({name for name, _ in named_inputs}) != len(named_inputs):
+            return jsonify({"error": "Department names must be unique"}), 400
+
+        inc_metric("serene_generation_jobs_in_progress")
+        try:
+            outcome = run_batch_generation(named_inputs, compare_independent=payload.get("compare_independent", True) is not False)
+        finally:
+            inc_metric("serene_generation_jobs_in_progress", -1)
+
+        for department in outcome["departments"]:
+            department["validation_warnings"] = warnings.get(department["name"], [])
+        return jsonify({"success": True, **outcome})
+    except Exception as e:
+        print(f"Error generating timetable batch: {str(e)}")
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
+
+def timetable_entries(timetable):
+    """(section, day, slot, entry) for every booked entry of a nested timetable."""
+    for section_name, section_schedule in timetable.items():
+        for day, day_schedule in section_schedule.items():
+            for slot, entries in day_schedule.items():
+                for entry in entries:
+                    if entry and entry[0] not in ('FREE', 'LUNCH'):
+                        yield section_name, day, slot, entry
+
+
+def rows_entries(rows):
+    """Same shape as timetable_entries() for flat result rows."""
+    for row in rows:
+        yield row.get("section"), row.get("day"), row.get("slot"), (
+            row.get("subject"), row.get("room"), row.get("teacher"), row.get("group")
+        )
+
+
+def build_stats_occupancy(entries, days, slots):
+    """
+    Fold booked entries into bitmasks over the teaching (day, slot) layout.
+
+    Sections, teachers and rooms get one busy mask each; (section, subject)
+    pairs get a day mask and a lecture count; lab sessions are counted per
+    (section, group) and per day. Unscheduled lab placeholders are only counted.
+    """
+    layout = slot_bit_layout(days, slots)
+    day_index = {day: i for i, day in enumerate(days)}
+    width = len([s for s in slots if s != "Lunch Break"])
+    occupancy = {
+        "layout": layout,
+        "width": width,
+        "sections": defaultdict(int),
+        "teachers": defaultdict(int),
+        "rooms": defaultdict(int),
+        "subject_days": defaultdict(int),
+        "subject_lectures": defaultdict(int),
+        "subject_count": defaultdict(int),
+        "lab_group_sessions": defaultdict(int),
+        "lab_day_sessions": [0] * len(days),
+        "sessions": 0,
+        "unscheduled_labs": 0
+    }
+    lab_starts = set()
+    for section, day, slot, entry in entries:
+        subject = entry[0]
+        if subject and str(subject).endswith("-UNSCHED"):
+            occupancy["unscheduled_labs"] += 1
+            continue
+        bit = layout.get((day, slot))
+        if bit is None:
+            continue
+        occupancy["sessions"] += 1
+        occupancy["sections"][section] |= 1 << bit
+        room = entry[1] if len(entry) > 1 else None
+        teacher = entry[2] if len(entry) > 2 else None
+        group = entry[3] if len(entry) > 3 else None
+        if room:
+            occupancy["rooms"][room] |= 1 << bit
+        if teacher:
+            occupancy["teachers"][teacher] |= 1 << bit
+        if subject:
+            occupancy["subject_count"][subject] += 1
+        if group:
+            # A lab block repeats on each of its slots; count the session once.
+            block = (section, subject, group, day)
+            if block not in lab_starts:
+                lab_starts.add(block)
+                occupancy["lab_group_sessions"][(section, group)] += 1
+                occupancy["lab_day_sessions"][day_index[day]] += 1
+        elif subject:
+            occupancy["subject_days"][(section, subject)] |= 1 << day_index[day]
+            occupancy["subject_lectures"][(section, subject)] += 1
+    return occupancy
+
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+
+def longest_run(mask):
+    """Length of the longest run of set bits."""
+    run = 0
+    while mask:
+        mask &= mask >> 1
+        run += 1
+    return run
+
+
+def day_bits(mask, day, width):
+    return (mask >> (day * width)) & ((1 << width) - 1)
+
+
+def idle_gaps(mask, n_days, width):
+    """Free teaching slots between the first and last booked slot of each day, summed."""
+    gaps = 0
+    for day in range(n_days):
+        bits = day_bits(mask, day, width)
+        if bits:
+            low = (bits & -bits).bit_length() - 1
+            gaps += bits.bit_length() - low - popcount(bits)
+    return gaps
+
+
+def longest_daily_run(mask, n_days, width, lunch_cut):
+    """Most consecutive booked slots in one day; lunch (after bit `lunch_cut`) breaks a run."""
+    best = 0
+    for day in range(n_days):
+        bits = day_bits(mask, day, width)
+        if lunch_cut is None:
+            best = max(best, longest_run(bits))
+        else:
+            morning = bits & ((1 << (lunch_cut + 1)) - 1)
+            best = max(best, longest_run(morning), longest_run(bits >> (lunch_cut + 1)))
+    return best
+
+
+def jain_fairness(values):
+    """Jain's index: 1.0 when all values are equal, 1/n when one value holds everything."""
+    values = list(values)
+    total = sum(values)
+    if not values or not total:
+        return 1.0
+    return round(total * total / (len(values) * sum(v * v for v in values)), 4)
+
+
+def summarize_stats_occupancy(occupancy, days, slots):
+    """Utilization and quality metrics from build_stats_occupancy() masks; no per-entry work."""
+    width = occupancy["width"]
+    n_days = len(days)
+    capacity = n_days * width
+    teaching = [s for s in slots if s != "Lunch Break"]
+    lunch_cut = None
+    for i, slot in enumerate(slots):
+        if slot == "Lunch Break" and i > 0 and slots[i - 1] in teaching:
+            lunch_cut = teaching.index(slots[i - 1])
+            break
+
+    def pct(mask):
+        return round(popcount(mask) / capacity * 100, 2) if capacity else 0.0
+
+    section_gaps = {sec: idle_gaps(mask, n_days, width) for sec, mask in occupancy["sections"].items()}
+    teacher_gaps = {t: idle_gaps(mask, n_days, width) for t, mask in occupancy["teachers"].items()}
+    teacher_runs = {t: longest_daily_run(mask, n_days, width, lunch_cut) for t, mask in occupancy["teachers"].items()}
+
+    spread = {}
+    for (sec, subject), day_mask in occupancy["subject_days"].items():
+        lectures = occupancy["subject_lectures"][(sec, subject)]
+        spread[(sec, subject)] = popcount(day_mask) / min(lectures, n_days) if n_days else 1.0
+    clustered = sorted(
+        [{"section": sec, "subject": subject, "days": popcount(occupancy["subject_days"][(sec, subject)]),
+          "lectures": occupancy["subject_lectures"][(sec, subject)]}
+         for (sec, subject), ratio in spread.items() if ratio < 1],
+        key=lambda item: (item["section"], item["subject"])
+    )
+
+    return {
+        "teacher_hours": {t: popcount(mask) for t, mask in occupancy["teachers"].items()},
+        "room_hours": {r: popcount(mask) for r, mask in occupancy["rooms"].items()},
+        "section_utilization": {sec: pct(mask) for sec, mask in occupancy["sections"].items()},
+        "teacher_utilization_percentage": {t: pct(mask) for t, mask in occupancy["teachers"].items()},
+        "room_utilization_percentage": {r: pct(mask) for r, mask in occupancy["rooms"].items()},
+        "quality": {
+            "section_idle_gaps": section_gaps,
+            "teacher_idle_gaps": teacher_gaps,
+            "teacher_max_consecutive": teacher_runs,
+            "subject_spread": round(sum(spread.values()) / len(spread), 4) if spread else 1.0,
+            "clustered_subjects": clustered,
+            "lab_group_fairness": jain_fairness(occupancy["lab_group_sessions"].values()),
+            "lab_day_fairness": jain_fairness(occupancy["lab_day_sessions"]),
+            "lab_sessions_per_day": dict(zip(days, occupancy["lab_day_sessions"])),
+            "unscheduled_labs": occupancy["unscheduled_labs"],
+            "totals": {
+                "section_idle_gaps": sum(section_gaps.values()),
+                "teacher_idle_gaps": sum(teacher_gaps.values()),
+                "teacher_max_consecutive": max(teacher_runs.values(), default=0),
+                "clustered_subjects": len(clustered)
+            }
+        }
+    }
+
+
+@app.route('/admin/constraint_sweep', methods=['POST'])
 @require_roles('admin')
-def generate_timetable_api():
+def constraint_sweep_api():
+    """Run generation for every combination of {"grid": {constraint: [values]}} over {"input": ...}."""
     try:
-        request_data = request.json
-        if not request_data:
-            return jsonify({"error": "No input data"}), 400
+        payload = request.json or {}
+        request_data = payload.get("input")
+        grid = payload.get("grid")
+        if not isinstance(request_data, dict):
+            return jsonify({"error": "input must be a timetable input object"}), 400
+        if not isinstance(grid, dict) or not grid:
+            return jsonify({"error": "grid must map constraint names to lists of values"}), 400
+
+        allowed = SWEEP_LAB_KEYS + SWEEP_THEORY_KEYS
+        unknown = [k for k in grid if k not in allowed]
+        if unknown:
+            return jsonify({"error": f"Unknown sweep keys: {', '.join(unknown)}", "allowed": list(allowed)}), 400
+        for key, values in grid.items():
+            if (not isinstance(values, list) or not values
+                    or not all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in values)):
+                return jsonify({"error": f"{key} must be a non-empty list of positive integers"}), 400
+            grid[key] = list(dict.fromkeys(values))
+        combinations = math.prod(len(values) for values in grid.values())
+        if combinations > SWEEP_MAX_COMBINATIONS:
+            return jsonify({"error": f"Sweep is limited to {SWEEP_MAX_COMBINATIONS} combinations (got {combinations})"}), 413
 
-        # Validate input data structure
         validation_result = validate_input_data(request_data)
-        if not validation_result['valid']:
+        if not validation_result["valid"]:
             return jsonify({
                 "error": "Invalid input data",
-                "validation_errors": validation_result['errors'],
-                "validation_warnings": validation_result['warnings']
+                "validation_errors": validation_result["errors"],
+                "validation_warnings": validation_result["warnings"]
             }), 400
 
-        # Transform classes-based structure to sections-based structure
-        data = transform_classes_to_sections(request_data)
-
-        print(f"Processing {len(data['sections'])} sections from {len(request_data.get('classes', []))} classes")
-
-        fixed_classrooms = assign_fixed_classrooms(data)
-        fixed_teachers = create_fixed_teacher_mapping(data)
-        timetable = make_empty_timetable(data)
-
-        # Assign labs first
-        timetable = assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms)
-        # Assign theory
-        timetable, unfulfilled = assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms)
-
-        # If some unfulfilled, do a relaxed re-try (existing logic)
-        if unfulfilled:
-            for sec in timetable:
-                for day in data["days"]:
-                    for slot in data["slots"]:
-                        if slot == "Lunch Break":
-                            continue
-                        new_entries = []
-                        for entry in timetable[sec][day][slot]:
-                            if len(entry) > 3:
-                                new_entries.append(entry)
-                        timetable[sec][day][slot] = new_entries
-            data_relaxed = copy.deepcopy(data)
-            if "constraints" not in data_relaxed:
-                data_relaxed["constraints"] = {}
-            data_relaxed["constraints"]["max_lectures_per_subject_per_day"] = data_relaxed["constraints"].get("max_lectures_per_subject_per_day", 2) + 1
-            timetable, unfulfilled2 = assign_theory_subjects(data_relaxed, timetable, fixed_teachers, fixed_classrooms)
-            unfulfilled = unfulfilled2
-
-        # Final fallback: if still unfulfilled, allow teacher daily-hour overflow to maximize placement.
-        if unfulfilled:
-            for sec in timetable:
-                for day in data["days"]:
-                    for slot in data["slots"]:
-                        if slot == "Lunch Break":
-                            continue
-                        timetable[sec][day][slot] = [entry for entry in timetable[sec][day][slot] if len(entry) > 3]
-
-            data_overflow = copy.deepcopy(data)
-            if "constraints" not in data_overflow:
-                data_overflow["constraints"] = {}
-            data_overflow["constraints"]["max_lectures_per_subject_per_day"] = data_overflow["constraints"].get("max_lectures_per_subject_per_day", 2) + 1
-            data_overflow["constraints"]["max_lectures_per_day_section"] = data_overflow["constraints"].get("max_lectures_per_day_section", 6) + 1
-            timetable, unfulfilled = assign_theory_subjects(
-                data_overflow,
-                timetable,
-                fixed_teachers,
-                fixed_classrooms,
-                ignore_teacher_daily_limit=True
-            )
-
-        # Generate suggestions if any unfulfilled remain
-        suggestions = {}
-        if unfulfilled:
-            suggestions = generate_suggestions(data, timetable, unfulfilled, fixed_teachers)
-
-        # Calculate statistics
-        stats = calculate_timetable_stats(timetable, request_data)
-
-        result = timetable_to_result(timetable, data)
-        
+        started = time.perf_counter()
+        inc_metric("serene_generation_jobs_in_progress")
+        try:
+            outcome = run_constraint_sweep(request_data, grid)
+        finally:
+            inc_metric("serene_generation_jobs_in_progress", -1)
         return jsonify({
             "success": True,
-            "timetable": result, 
-            "unfulfilled": unfulfilled, 
-            "suggestions": suggestions,
-            "statistics": stats,
-            "validation_warnings": validation_result.get('warnings', [])
+            **outcome,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
         })
-
     except Exception as e:
-        print(f"Error generating timetable: {str(e)}")
+        print(f"Error running constraint sweep: {str(e)}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
 
 def calculate_timetable_stats(timetable, original_data):
     """Calculate statistics for the generated timetable"""
+    days = original_data.get('days', [])
+    slots = original_data.get('slots', [])
+    occupancy = build_stats_occupancy(timetable_entries(timetable), days, slots)
+    summary = summarize_stats_occupancy(occupancy, days, slots)
+
+    total_slots_per_section = len(days) * occupancy["width"]
     stats = {
         'total_sections': len(timetable),
         'total_classes': len(original_data.get('classes', [])),
-        'total_slots_used': 0,
-        'total_slots_available': 0,
-        'teacher_utilization': {},
-        'room_utilization': {},
-        'subject_distribution': {}
+        # Section slots with anything booked; parallel lab groups share one slot.
+        'total_slots_used': sum(popcount(mask) for mask in occupancy["sections"].values()),
+        'total_slots_available': total_slots_per_section * len(timetable),
+        'total_sessions': occupancy["sessions"],
+        'teacher_utilization': summary["teacher_hours"],
+        'room_utilization': summary["room_hours"],
+        'subject_distribution': dict(occupancy["subject_count"]),
+        'section_utilization': summary["section_utilization"],
+        'teacher_utilization_percentage': summary["teacher_utilization_percentage"],
+        'room_utilization_percentage': summary["room_utilization_percentage"],
+        'quality': summary["quality"]
     }
-    
-    # Calculate total slots
-    days = original_data.get('days', [])
-    slots = [s for s in original_data.get('slots', []) if s != 'Lunch Break']
-    total_slots_per_section = len(days) * len(slots)
-    stats['total_slots_available'] = total_slots_per_section * len(timetable)
-    
-    # Count used slots and gather statistics
-    teacher_hours = defaultdict(int)
-    room_hours = defaultdict(int)
-    subject_count = defaultdict(int)
-    
-    for section_name, section_schedule in timetable.items():
-        for day, day_schedule in section_schedule.items():
-            for slot, entries in day_schedule.items():
-                if slot == 'Lunch Break':
-                    continue
-                    
-                for entry in entries:
-                    if not entry or entry[0] in ('FREE', 'LUNCH'):
-                        continue
-                        
-                    stats['total_slots_used'] += 1
-                    
-                    if len(entry) > 1 and entry[1]:  # teacher
-                        teacher_hours[entry[1]] += 1
-                    
-                    if len(entry) > 2 and entry[2]:  # room  
-                        room_hours[entry[2]] += 1
-                    
-                    if entry[0]:  # subject
-                        subject_count[entry[0]] += 1
-    
-    # Calculate utilization percentages
     stats['utilization_percentage'] = (stats['total_slots_used'] / stats['total_slots_available'] * 100) if stats['total_slots_available'] > 0 else 0
-    stats['teacher_utilization'] = dict(teacher_hours)
-    stats['room_utilization'] = dict(room_hours)
-    stats['subject_distribution'] = dict(subject_count)
-    
     return stats
 
 
@@ -2332,6 +5494,26 @@ def validate_input_api():
         }), 500
 
 
+@app.route('/admin/generation_profile', methods=['GET'])
+@require_roles('admin')
+def generation_profile_api():
+    """Last collected generation profile, or cumulative totals as Prometheus text."""
+    if (request.args.get("format") or "").lower() == "prometheus":
+        body = "\n".join(generation_profile_prometheus_lines()) + "\n"
+        return Response(body, mimetype="text/plain; version=0.0.4")
+    if LAST_GENERATION_PROFILE is None:
+        return jsonify({"error": "No generation profile collected yet. Call /generate_timetable?profile=1"}), 404
+    return jsonify({"profile": LAST_GENERATION_PROFILE})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    """Prometheus metrics for this worker process."""
+    if METRICS_TOKEN and request.headers.get("Authorization", "") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(render_prometheus_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/reset_teacher', methods=['POST'])
 @require_roles('admin', 'teacher')
 def reset_teacher_api():
@@ -2364,11 +5546,11 @@ def reset_teacher_api():
 @require_roles('admin')
 def publish_timetable_api():
     try:
-        global PUBLISHED_TIMETABLE
+        already_published = jsonify({
+            "error": "A timetable is already published. Delete it before publishing a new one."
+        }), 409
         if get_latest_published_timetable():
-            return jsonify({
-                "error": "A timetable is already published. Delete it before publishing a new one."
-            }), 409
+            return already_published
 
         payload = request.json or {}
         input_data = payload.get("inputData")
@@ -2379,18 +5561,32 @@ def publish_timetable_api():
         if not timetable_data.get("timetable"):
             return jsonify({"error": "timetableData.timetable is required"}), 400
 
-        PUBLISHED_TIMETABLE = {
+        published = {
             "inputData": input_data,
             "timetableData": timetable_data,
             "baseTimetableData": copy.deepcopy(timetable_data),
             "temporary_changes": [],
             "publishedAt": datetime.utcnow().isoformat() + "Z",
-            "publishedBy": session.get("username")
+            "publishedBy": current_username()
         }
-        save_published_timetable()
-        sync_users_from_timetable(timetable_data.get("timetable", []))
+        start_published_version(published)
+        # Only publish if nobody else did since the check above.
+        if not swap_json_state(PUBLISHED_TIMETABLE_FILE, None,
+                               lambda current: (KEEP_STATE, False) if current else (published, True)):
+            return already_published
+        created_accounts = sync_users_from_timetable(timetable_data.get("timetable", []))
+        publish_event(
+            "timetable_published",
+            {"publishedAt": published["publishedAt"], "version": published["version"]},
+            roles=("teacher", "student")
+        )
 
-        return jsonify({"success": True, "publishedAt": PUBLISHED_TIMETABLE["publishedAt"]})
+        return jsonify({
+            "success": True,
+            "publishedAt": published["publishedAt"],
+            "version": published["version"],
+            "created_accounts": created_accounts
+        })
     except Exception as e:
         return jsonify({"error": f"Publish failed: {str(e)}"}), 500
 
@@ -2408,12 +5604,9 @@ def get_published_timetable_api():
 @require_roles('admin')
 def delete_published_timetable_api():
     try:
-        global PUBLISHED_TIMETABLE, RESCHEDULE_REQUESTS
-        get_latest_published_timetable()
-        PUBLISHED_TIMETABLE = None
-        save_published_timetable()
-        RESCHEDULE_REQUESTS = []
-        save_reschedule_requests()
+        swap_json_state(PUBLISHED_TIMETABLE_FILE, None, lambda current: (None, None))
+        update_json_state(RESCHEDULE_REQUESTS_FILE, [], lambda requests: requests.clear())
+        publish_event("timetable_deleted", roles=("teacher", "student"))
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"error": f"Delete failed: {str(e)}"}), 500
@@ -2427,8 +5620,23 @@ def teacher_timetable_api():
         if not latest:
             return jsonify({"error": "No published timetable found"}), 404
 
+        since, error = timetable_since_arg()
+        if error:
+            return jsonify({"error": error}), 400
         user = get_current_user()
         teacher_name = teacher_display_name(user)
+        teacher_key = teacher_name.strip().lower()
+
+        delta = published_delta_since(latest, since) if since is not None else None
+        if delta is not None:
+            return jsonify({
+                "teacher": teacher_name,
+                "since": since,
+                "version": latest.get("version"),
+                "delta": filter_row_delta(delta, lambda r: (r.get("teacher") or "").strip().lower() == teacher_key),
+                "publishedAt": latest.get("publishedAt")
+            })
+
         all_rows = latest["timetableData"].get("timetable", [])
         rows = filter_teacher_timetable(all_rows, teacher_name)
 
@@ -2438,6 +5646,8 @@ def teacher_timetable_api():
             "slots": latest["inputData"].get("slots", []),
             "classes": latest["inputData"].get("classes", []),
             "timetable": rows,
+            "version": latest.get("version"),
+            "full": True,
             "publishedAt": latest.get("publishedAt")
         })
     except Exception as e:
@@ -2466,7 +5676,8 @@ def teacher_available_theory_slots_api():
             teacher_name,
             day,
             slot,
-            latest["inputData"].get("slots", [])
+            latest["inputData"].get("slots", []),
+            index=get_published_row_index(latest)
         )
         if err:
             return jsonify({"error": err}), 400
@@ -2497,26 +5708,24 @@ def teacher_request_reschedule_api():
         user = get_current_user()
         teacher_name = teacher_display_name(user)
         current_rows = latest["timetableData"].get("timetable", [])
-        assignment = next((
-            row for row in current_rows
-            if (row.get("teacher") or "").strip().lower() == teacher_name.strip().lower()
-            and row.get("day") == day
-            and row.get("slot") == slot
-        ), None)
+        row_index = get_published_row_index(latest)
+        assignment = next(iter(index_lookup(row_index, "teacher", teacher_name, day, slot)), None)
         if not assignment:
             return jsonify({"error": "No assignment found for this teacher at the selected slot"}), 400
 
-        requests = get_latest_reschedule_requests()
-        duplicate = any(
-            r.get("status") == "pending"
-            and r.get("requestType", "unavailable") == request_type
-            and (r.get("teacher") or "").strip().lower() == teacher_name.strip().lower()
-            and r.get("day") == day
-            and r.get("slot") == slot
-            for r in requests
-        )
-        if duplicate:
-            return jsonify({"error": "A pending request already exists for this day/slot"}), 409
+        def is_duplicate(requests):
+            return any(
+                r.get("status") == "pending"
+                and r.get("requestType", "unavailable") == request_type
+                and (r.get("teacher") or "").strip().lower() == teacher_name.strip().lower()
+                and r.get("day") == day
+                and r.get("slot") == slot
+                for r in requests
+            )
+
+        duplicate_error = jsonify({"error": "A pending request already exists for this day/slot"}), 409
+        if is_duplicate(get_latest_reschedule_requests()):
+            return duplicate_error
 
         if request_type == "reslot_theory":
             if assignment.get("group"):
@@ -2528,7 +5737,8 @@ def teacher_request_reschedule_api():
                 teacher_name,
                 day,
                 slot,
-                latest["inputData"].get("slots", [])
+                latest["inputData"].get("slots", []),
+                index=row_index
             )
             if err:
                 return jsonify({"error": err}), 400
@@ -2551,13 +5761,22 @@ def teacher_request_reschedule_api():
             "createdAt": datetime.utcnow().isoformat() + "Z",
             "createdBy": user.get("username")
         }
-        requests.append(new_request)
-        save_reschedule_requests()
+
+        def append(requests):
+            # Re-checked under the lock: two submits of the same slot must not both land.
+            if is_duplicate(requests):
+                return False
+            requests.append(new_request)
+            return True
+
+        if not update_json_state(RESCHEDULE_REQUESTS_FILE, [], append, write_if=bool):
+            return duplicate_error
         add_activity_log(
             "reschedule_request_created",
             f"{teacher_name} requested reschedule on {day} ({slot})",
             {"teacher": teacher_name, "day": day, "slot": slot}
         )
+        publish_event("request_created", {"request": new_request}, teachers=[teacher_name])
 
         teacher_rows = filter_teacher_timetable(current_rows, teacher_name)
         return jsonify({
@@ -2579,10 +5798,24 @@ def student_timetable_api():
         if not latest:
             return jsonify({"error": "No published timetable found"}), 404
 
+        since, error = timetable_since_arg()
+        if error:
+            return jsonify({"error": error}), 400
         user = get_current_user()
         section = user.get("section")
         if not section:
             return jsonify({"error": "Student section is not configured"}), 400
+        section_key = section.strip().lower()
+
+        delta = published_delta_since(latest, since) if since is not None else None
+        if delta is not None:
+            return jsonify({
+                "section": section,
+                "since": since,
+                "version": latest.get("version"),
+                "delta": filter_row_delta(delta, lambda r: (r.get("section") or "").strip().lower() == section_key),
+                "publishedAt": latest.get("publishedAt")
+            })
 
         all_rows = latest["timetableData"].get("timetable", [])
         rows = filter_student_timetable(all_rows, section)
@@ -2593,12 +5826,184 @@ def student_timetable_api():
             "slots": latest["inputData"].get("slots", []),
             "classes": latest["inputData"].get("classes", []),
             "timetable": rows,
+            "version": latest.get("version"),
+            "full": True,
             "publishedAt": latest.get("publishedAt")
         })
     except Exception as e:
         return jsonify({"error": f"Unable to load student timetable: {str(e)}"}), 500
 
 
+@app.route('/rooms/<path:room>/timetable', methods=['GET'])
+@require_auth
+def room_timetable_api(room):
+    try:
+        latest = get_latest_published_timetable()
+        if not latest:
+            return jsonify({"error": "No published timetable found"}), 404
+
+        occupancy = get_room_occupancy(latest)
+        name = occupancy["by_name"].get(room.strip().lower())
+        if not name:
+            return jsonify({"error": "Room not found"}), 404
+
+        layout = occupancy["layout"]
+        mask = occupancy["masks"][name]
+        free_mask = ((1 << len(layout)) - 1) & ~mask
+        rows = sorted(occupancy["rows"].get(name, []), key=lambda r: layout.get((r.get("day"), r.get("slot")), -1))
+        return jsonify({
+            "room": name,
+            "kind": "lab" if name in occupancy["labs"] else "room",
+            "days": latest["inputData"].get("days", []),
+            "slots": latest["inputData"].get("slots", []),
+            "timetable": rows,
+            "free": [{"day": day, "slot": slot} for day, slot in mask_positions(free_mask, layout)],
+            "utilization": round(bin(mask).count("1") / len(layout), 4) if layout else 0.0,
+            "version": latest.get("version"),
+            "publishedAt": latest.get("publishedAt")
+        })
+    except Exception as e:
+        return jsonify({"error": f"Unable to load room timetable: {str(e)}"}), 500
+
+
+@app.route('/rooms/free', methods=['GET'])
+@require_auth
+def free_rooms_api():
+    """Rooms with nothing booked at ?day=&slot= (optionally for ?duration= consecutive slots, ?kind=room|lab)."""
+    try:
+        latest = get_latest_published_timetable()
+        if not latest:
+            return jsonify({"error": "No published timetable found"}), 404
+
+        day = (request.args.get("day") or "").strip()
+        slot = (request.args.get("slot") or "").strip()
+        kind = (request.args.get("kind") or "").strip().lower()
+        if not day or not slot:
+            return jsonify({"error": "day and slot are required"}), 400
+        if kind not in ("", "room", "lab"):
+            return jsonify({"error": "kind must be room or lab"}), 400
+        try:
+            duration = int(request.args.get("duration", 1))
+        except ValueError:
+            return jsonify({"error": "duration must be an integer"}), 400
+        if duration < 1:
+            return jsonify({"error": "duration must be at least 1"}), 400
+
+        occupancy = get_room_occupancy(latest)
+        wanted = block_mask(occupancy["layout"], latest["inputData"].get("slots", []), day, slot, duration)
+        if wanted is None:
+            return jsonify({"error": "day/slot is not a teaching slot, or the block runs past the day or into lunch"}), 400
+
+        labs = occupancy["labs"]
+        masks = occupancy["masks"]
+        candidates = [
+            room for room in occupancy["rooms"]
+            if not kind or (kind == "lab") == (room in labs)
+        ]
+        free = [room for room in candidates if not masks[room] & wanted]
+        return jsonify({
+            "day": day,
+            "slot": slot,
+            "duration": duration,
+            "free": [{"room": room, "kind": "lab" if room in labs else "room"} for room in free],
+            "total": len(candidates),
+            "version": latest.get("version"),
+            "publishedAt": latest.get("publishedAt")
+        })
+    except Exception as e:
+        return jsonify({"error": f"Unable to find free rooms: {str(e)}"}), 500
+
+
+@app.route('/admin/free_slots', methods=['GET'])
+@require_roles('admin')
+def admin_free_slots_api():
+    """Common free (day, slot) starts for ?teacher=...&section=... (repeatable), ranked best first."""
+    try:
+        latest = get_latest_published_timetable()
+        if not latest:
+            return jsonify({"error": "No published timetable found"}), 404
+
+        try:
+            duration = int(request.args.get("duration", 1))
+            max_conflicts = int(request.args.get("max_conflicts", 0))
+            limit = min(int(request.args.get("limit", 10)), 200)
+        except ValueError:
+            return jsonify({"error": "duration, max_conflicts and limit must be integers"}), 400
+        if duration < 1 or max_conflicts < 0 or limit < 1:
+            return jsonify({"error": "duration and limit must be positive, max_conflicts non-negative"}), 400
+
+        occupancy = get_people_occupancy(latest)
+        wanted = {kind: [v.strip().lower() for v in request.args.getlist(kind) if v.strip()] for kind in ("teacher", "section")}
+        if not wanted["teacher"] and not wanted["section"]:
+            return jsonify({"error": "At least one teacher or section is required"}), 400
+        unknown = {kind: [v for v in values if v not in occupancy["names"][kind]] for kind, values in wanted.items()}
+        if unknown["teacher"] or unknown["section"]:
+            return jsonify({"error": "Unknown teachers or sections", "unknown": unknown}), 400
+
+        started = time.perf_counter()
+        candidates, total = find_common_free_slots(
+            latest,
+            list(dict.fromkeys(wanted["teacher"])),
+            list(dict.fromkeys(wanted["section"])),
+            duration=duration,
+            max_conflicts=max_conflicts,
+            limit=limit
+        )
+        return jsonify({
+            "candidates": candidates,
+            "total": total,
+            "duration": duration,
+            "query_ms": round((time.perf_counter() - started) * 1000, 3),
+            "version": latest.get("version"),
+            "publishedAt": latest.get("publishedAt")
+        })
+    except Exception as e:
+        return jsonify({"error": f"Unable to find free slots: {str(e)}"}), 500
+
+
+@app.route('/timetable/grid', methods=['GET'])
+@require_roles('admin', 'teacher', 'student')
+def timetable_grid_api():
+    """Ready-made day -> slot -> cells grid for ?section=, ?teacher= or ?room= (default: the caller's own)."""
+    try:
+        latest = get_latest_published_timetable()
+        if not latest:
+            return jsonify({"error": "No published timetable found"}), 404
+
+        user = get_current_user()
+        role = user.get("role")
+        requested = [(kind, request.args.get(kind).strip()) for kind in GRID_KINDS if (request.args.get(kind) or "").strip()]
+        if len(requested) > 1:
+            return jsonify({"error": "Pass only one of section, teacher or room"}), 400
+        own = {"teacher": ("teacher", teacher_display_name(user)), "student": ("section", user.get("section"))}.get(role)
+        if requested:
+            kind, key = requested[0]
+        elif own and own[1]:
+            kind, key = own
+        else:
+            return jsonify({"error": "section, teacher or room is required"}), 400
+        if role != "admin" and kind != "room" and (not own or own[0] != kind or (own[1] or "").strip().lower() != key.lower()):
+            return jsonify({"error": "Forbidden"}), 403
+
+        grid = get_published_grid(latest, kind, key)
+        if grid is None:
+            return jsonify({"error": f"No published timetable for {kind} {key}"}), 404
+
+        response = jsonify({
+            kind: key,
+            "days": latest["inputData"].get("days", []),
+            "slots": latest["inputData"].get("slots", []),
+            "grid": grid,
+            "version": latest.get("version"),
+            "publishedAt": latest.get("publishedAt")
+        })
+        response.set_etag(f'{latest.get("publishedAt")}|{kind}|{key.lower()}')
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({"error": f"Unable to load timetable grid: {str(e)}"}), 500
+
+
 @app.route('/admin/reschedule_requests', methods=['GET'])
 @require_roles('admin')
 def admin_reschedule_requests_api():
@@ -2608,50 +6013,37 @@ def admin_reschedule_requests_api():
     return jsonify({"requests": requests_sorted})
 
 
+def pending_request_check(req):
+    if req.get("status") != "pending":
+        return f"Request already {req.get('status')}", 400
+    return None
+
+
 @app.route('/admin/reschedule_requests/<int:request_id>/approve', methods=['POST'])
 @require_roles('admin')
 def admin_approve_reschedule_request_api(request_id):
     try:
-        global PUBLISHED_TIMETABLE
-        latest = get_latest_published_timetable()
-        if not latest:
+        if not get_latest_published_timetable():
             return jsonify({"error": "No published timetable found"}), 404
 
-        requests = get_latest_reschedule_requests()
-        req = next((r for r in requests if r.get("id") == request_id), None)
-        if not req:
-            return jsonify({"error": "Request not found"}), 404
-        if req.get("status") != "pending":
-            return jsonify({"error": f"Request already {req.get('status')}"}), 400
-
-        PUBLISHED_TIMETABLE = latest
-        if "baseTimetableData" not in PUBLISHED_TIMETABLE and PUBLISHED_TIMETABLE.get("timetableData"):
-            PUBLISHED_TIMETABLE["baseTimetableData"] = copy.deepcopy(PUBLISHED_TIMETABLE["timetableData"])
+        # Claim the request first so a concurrent approve/reject cannot resolve it too.
+        req, error = take_state_item(
+            RESCHEDULE_REQUESTS_FILE, request_id, pending_request_check, missing="Request not found"
+        )
+        if error:
+            return jsonify({"error": error[0]}), error[1]
 
         now = datetime.utcnow()
         expires_at = datetime.combine((now + timedelta(days=1)).date(), datetime.min.time())
         request_type = req.get("requestType", "unavailable")
-        temp_change = None
         if request_type == "reslot_theory":
-            from_slot = req.get("slot")
-            to_slot = req.get("preferredSlot")
-            rows = PUBLISHED_TIMETABLE["timetableData"].get("timetable", [])
-            updated_rows = apply_theory_reslot(
-                rows,
-                req.get("teacher"),
-                req.get("day"),
-                from_slot,
-                to_slot,
-                PUBLISHED_TIMETABLE.get("inputData", {}).get("slots", [])
-            )
-            PUBLISHED_TIMETABLE["timetableData"]["timetable"] = updated_rows
             temp_change = {
                 "type": "reslot_theory",
                 "requestId": request_id,
                 "teacher": req.get("teacher"),
                 "day": req.get("day"),
-                "fromSlot": from_slot,
-                "toSlot": to_slot,
+                "fromSlot": req.get("slot"),
+                "toSlot": req.get("preferredSlot"),
                 "appliedAt": now.isoformat() + "Z",
                 "expiresAt": expires_at.isoformat() + "Z"
             }
@@ -2666,19 +6058,61 @@ def admin_approve_reschedule_request_api(request_id):
                 "expiresAt": expires_at.isoformat() + "Z"
             }
 
-        PUBLISHED_TIMETABLE.setdefault("temporary_changes", []).append(temp_change)
-        if request_type == "unavailable":
-            rebuild_timetable_from_active_changes()
-        PUBLISHED_TIMETABLE["publishedAt"] = datetime.utcnow().isoformat() + "Z"
-        save_published_timetable()
-
-        req["status"] = "approved"
-        req["expiresAt"] = temp_change["expiresAt"]
-        req["resolvedAt"] = datetime.utcnow().isoformat() + "Z"
-        req["resolvedBy"] = session.get("username")
-        resolved = copy.deepcopy(req)
-        requests[:] = [r for r in requests if r.get("id") != request_id]
-        save_reschedule_requests()
+        def apply(published):
+            if not published:
+                return None
+            applied = {
+                "published": published,
+                "rows_before": list(published.get("timetableData", {}).get("timetable", [])),
+                "row_changes": None
+            }
+            if "baseTimetableData" not in published and published.get("timetableData"):
+                published["baseTimetableData"] = copy.deepcopy(published["timetableData"])
+            if request_type == "reslot_theory":
+                # Move the cached index along instead of rebuilding it; the copy keeps
+                # the current model intact for readers and for a retried update.
+                model = get_published_read_model(published)
+                row_index = copy_row_index(model["row_index"])
+                version = apply_theory_reslot_version(
+                    model["rows"],
+                    req.get("teacher"),
+                    req.get("day"),
+                    temp_change["fromSlot"],
+                    temp_change["toSlot"],
+                    published.get("inputData", {}).get("slots", []),
+                    index=row_index
+                )
+                published["timetableData"]["timetable"] = version["rows"]
+                applied.update(row_changes=row_version_diff(version), rows=version["rows"], row_index=row_index)
+
+            published.setdefault("temporary_changes", []).append(temp_change)
+            if request_type == "unavailable":
+                rebuild_timetable_from_active_changes(published)
+            published["publishedAt"] = datetime.utcnow().isoformat() + "Z"
+            record_published_version(published, applied["rows_before"], applied["row_changes"])
+            return applied
+
+        try:
+            applied = update_json_state(
+                PUBLISHED_TIMETABLE_FILE, None, apply, write_if=lambda result: result is not None
+            )
+        except Exception:
+            restore_state_item(RESCHEDULE_REQUESTS_FILE, req)
+            raise
+        if applied is None:
+            restore_state_item(RESCHEDULE_REQUESTS_FILE, req)
+            return jsonify({"error": "No published timetable found"}), 404
+
+        published = applied["published"]
+        row_changes = applied["row_changes"]
+        if row_changes is not None:
+            advance_published_read_model(published, applied["rows"], applied["row_index"])
+
+        resolved = dict(req)
+        resolved["status"] = "approved"
+        resolved["expiresAt"] = temp_change["expiresAt"]
+        resolved["resolvedAt"] = datetime.utcnow().isoformat() + "Z"
+        resolved["resolvedBy"] = current_username()
         add_activity_log(
             "reschedule_request_approved",
             f"Reschedule approved for {resolved.get('teacher')} on {resolved.get('day')} ({resolved.get('slot')})",
@@ -2686,11 +6120,32 @@ def admin_approve_reschedule_request_api(request_id):
                 "teacher": resolved.get("teacher"),
                 "day": resolved.get("day"),
                 "slot": resolved.get("slot"),
-                "approvedBy": session.get("username")
+                "approvedBy": current_username()
             }
         )
+        if row_changes is not None:
+            # The reslot already knows which rows it replaced; no need to diff the whole timetable.
+            teachers, sections = changed_rows_audience(
+                [c["before"] for c in row_changes], [c["after"] for c in row_changes]
+            )
+        else:
+            teachers, sections = changed_rows_audience(
+                applied["rows_before"], published["timetableData"].get("timetable", [])
+            )
+        publish_event(
+            "change_applied",
+            {"change": temp_change, "request": resolved, "publishedAt": published["publishedAt"],
+             "version": published["version"]},
+            teachers=teachers + [resolved.get("teacher")],
+            sections=sections + [resolved.get("section")]
+        )
 
-        return jsonify({"success": True, "request": resolved, "publishedAt": PUBLISHED_TIMETABLE["publishedAt"]})
+        return jsonify({
+            "success": True,
+            "request": resolved,
+            "publishedAt": published["publishedAt"],
+            "version": published["version"]
+        })
     except Exception as e:
         return jsonify({"error": f"Approve failed: {str(e)}"}), 500
 
@@ -2699,23 +6154,20 @@ def admin_approve_reschedule_request_api(request_id):
 @require_roles('admin')
 def admin_reject_reschedule_request_api(request_id):
     try:
-        requests = get_latest_reschedule_requests()
-        req = next((r for r in requests if r.get("id") == request_id), None)
-        if not req:
-            return jsonify({"error": "Request not found"}), 404
-        if req.get("status") != "pending":
-            return jsonify({"error": f"Request already {req.get('status')}"}), 400
-
         payload = request.json or {}
         admin_note = (payload.get("admin_note") or "Rejected by admin").strip()
 
-        req["status"] = "rejected"
-        req["adminNote"] = admin_note
-        req["resolvedAt"] = datetime.utcnow().isoformat() + "Z"
-        req["resolvedBy"] = session.get("username")
-        rejected = copy.deepcopy(req)
-        requests[:] = [r for r in requests if r.get("id") != request_id]
-        save_reschedule_requests()
+        req, error = take_state_item(
+            RESCHEDULE_REQUESTS_FILE, request_id, pending_request_check, missing="Request not found"
+        )
+        if error:
+            return jsonify({"error": error[0]}), error[1]
+
+        rejected = dict(req)
+        rejected["status"] = "rejected"
+        rejected["adminNote"] = admin_note
+        rejected["resolvedAt"] = datetime.utcnow().isoformat() + "Z"
+        rejected["resolvedBy"] = current_username()
         add_activity_log(
             "reschedule_request_rejected",
             f"Reschedule rejected for {rejected.get('teacher')} on {rejected.get('day')} ({rejected.get('slot')})",
@@ -2723,10 +6175,11 @@ def admin_reject_reschedule_request_api(request_id):
                 "teacher": rejected.get("teacher"),
                 "day": rejected.get("day"),
                 "slot": rejected.get("slot"),
-                "rejectedBy": session.get("username"),
+                "rejectedBy": current_username(),
                 "reason": admin_note
             }
         )
+        publish_event("request_rejected", {"request": rejected}, teachers=[rejected.get("teacher")])
 
         return jsonify({"success": True, "request": rejected})
     except Exception as e:
@@ -2737,46 +6190,72 @@ def admin_reject_reschedule_request_api(request_id):
 @require_roles('admin')
 def admin_activity_feed_api():
     try:
-        cleanup_activity_logs()
-        logs = get_latest_activity_logs()
+        index = get_activity_index()
         now = datetime.utcnow().date()
-        today_logs = []
-        for entry in logs:
-            ts = parse_iso_utc(entry.get("createdAt"))
-            if ts and ts.date() == now:
-                today_logs.append(entry)
-        today_logs.sort(key=lambda e: e.get("createdAt", ""), reverse=True)
-
-        pending_reschedule_items = sorted(
-            [r for r in get_latest_reschedule_requests() if r.get("status") == "pending"],
-            key=lambda r: r.get("createdAt", ""),
-            reverse=True
-        )
-        pending_teacher_items = sorted(
-            [r for r in get_latest_pending_registrations() if r.get("role") == "teacher" and r.get("status") == "pending_admin_approval"],
-            key=lambda r: r.get("created_at", ""),
-            reverse=True
-        )
-        pending_reschedules = len(pending_reschedule_items)
-        pending_teacher_regs = len(pending_teacher_items)
+        day_start = (round(utc_timestamp(datetime(now.year, now.month, now.day)) * 1000000), 0)
+        day_end = (day_start[0] + 24 * 3600 * 1000000, 0)
+        keys = index["keys"]
+        today_logs = index["entries"][bisect.bisect_left(keys, day_start):bisect.bisect_left(keys, day_end)][::-1]
+        pending = get_pending_summary()
 
         return jsonify({
             "date": now.isoformat(),
             "events": today_logs,
+            "cursor": encode_activity_cursor(keys[-1]) if keys else None,
             "pending": {
-                "rescheduleRequests": pending_reschedule_items,
-                "teacherRegistrations": pending_teacher_items
+                "rescheduleRequests": pending["rescheduleRequests"],
+                "teacherRegistrations": pending["teacherRegistrations"]
             },
-            "counts": {
-                "pendingRescheduleRequests": pending_reschedules,
-                "pendingTeacherRegistrations": pending_teacher_regs,
-                "totalPending": pending_reschedules + pending_teacher_regs
-            }
+            "counts": pending["counts"]
         })
     except Exception as e:
         return jsonify({"error": f"Unable to load activity feed: {str(e)}"}), 500
 
 
+@app.route('/admin/activity_feed/events', methods=['GET'])
+@require_roles('admin')
+def admin_activity_events_api():
+    """Cursor-paginated activity, newest first.
+
+    ?before=<cursor> pages back through history; ?since=<cursor> returns only
+    events newer than the cursor (poll again with latest_cursor while has_more).
+    """
+    try:
+        limit = min(ACTIVITY_FEED_MAX_LIMIT, max(1, int(request.args.get("limit", 50))))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    since = request.args.get("since")
+    before = request.args.get("before")
+    since_key = decode_activity_cursor(since) if since else None
+    before_key = decode_activity_cursor(before) if before else None
+    if (since and since_key is None) or (before and before_key is None):
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    index = get_activity_index()
+    keys, entries = index["keys"], index["entries"]
+    next_cursor = None
+    if since_key is not None:
+        # Oldest-first slice after the cursor so a burst larger than `limit` has no gaps.
+        start = bisect.bisect_right(keys, since_key)
+        end = min(len(keys), start + limit)
+        has_more = end < len(keys)
+        latest_cursor = encode_activity_cursor(keys[end - 1]) if end > start else since
+    else:
+        end = bisect.bisect_left(keys, before_key) if before_key is not None else len(keys)
+        start = max(0, end - limit)
+        has_more = start > 0
+        next_cursor = encode_activity_cursor(keys[start]) if has_more else None
+        latest_cursor = encode_activity_cursor(keys[-1]) if keys else None
+
+    return jsonify({
+        "events": entries[start:end][::-1],
+        "has_more": has_more,
+        "next_cursor": next_cursor,
+        "latest_cursor": latest_cursor,
+        "counts": get_pending_summary()["counts"]
+    })
+
+
 @app.route('/admin/users', methods=['GET'])
 @require_roles('admin')
 def admin_users_api():
@@ -2796,6 +6275,189 @@ def admin_users_api():
     })
 
 
+@app.route('/events/stream', methods=['GET'])
+@require_auth
+def events_stream_api():
+    """Server-sent events for the current user's dashboard (reconnects resume via Last-Event-ID)."""
+    user = dict(get_current_user())
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    start_event_reader()
+    subscriber = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+    with _EVENT_SUBSCRIBERS_LOCK:
+        full = len(_EVENT_SUBSCRIBERS) >= EVENT_STREAMS_PER_WORKER
+        if not full:
+            _EVENT_SUBSCRIBERS.add(subscriber)
+    if full:
+        # EventSource gives up on non-200 answers, so ask it to come back later instead.
+        return Response(f"retry: {EVENT_STREAM_BUSY_RETRY_MS}\n\n", mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache"})
+    inc_metric("serene_event_subscribers")
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            if last_event_id:
+                recent = list(_EVENT_RECENT)
+                ids = [event["id"] for event in recent]
+                if last_event_id in ids:
+                    for event in recent[ids.index(last_event_id) + 1:]:
+                        if event_visible_to(event, user):
+                            yield format_sse(event)
+            deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event = subscriber.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                if event_visible_to(event, user):
+                    yield format_sse(event)
+        finally:
+            with _EVENT_SUBSCRIBERS_LOCK:
+                _EVENT_SUBSCRIBERS.discard(subscriber)
+            inc_metric("serene_event_subscribers", -1)
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+@app.route('/admin/sessions/revoke', methods=['POST'])
+@require_roles('admin')
+def admin_revoke_sessions_api():
+    """Revoke outstanding session tokens for {"username": ...} or {"all": true}."""
+    payload = request.json or {}
+    username = (payload.get("username") or "").strip()
+    if payload.get("all"):
+        revoke_sessions()
+        return jsonify({"success": True, "revoked": "all"})
+    if not username:
+        return jsonify({"error": "username or all=true is required"}), 400
+    get_user_index()
+    if username not in USERS:
+        return jsonify({"error": "User not found"}), 404
+    revoke_sessions(username)
+    return jsonify({"success": True, "revoked": username})
+
+
+# ----------------- Health & Readiness -----------------
+
+_WARMUP_LOCK = threading.Lock()
+
+
+def warm_up_read_models():
+    """Load published state and build its read models before taking traffic."""
+    started = time.perf_counter()
+    WARMUP_STATE.update({"ready": False, "started_at": datetime.utcnow().isoformat() + "Z", "error": None})
+    try:
+        get_user_index()
+        published = get_latest_published_timetable()
+        if published:
+            get_published_row_index(published)
+        WARMUP_STATE["ready"] = True
+    except Exception as exc:
+        WARMUP_STATE["error"] = str(exc)
+        print(f"[startup] warm-up failed: {exc}")
+    WARMUP_STATE["finished_at"] = datetime.utcnow().isoformat() + "Z"
+    WARMUP_STATE["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def start_warm_up():
+    """Warm this process's read models in the background (once per process)."""
+    if WARMUP_STATE["pid"] == os.getpid():
+        return
+    with _WARMUP_LOCK:
+        if WARMUP_STATE["pid"] == os.getpid():
+            return
+        WARMUP_STATE.update({"pid": os.getpid(), "ready": False})
+        threading.Thread(target=warm_up_read_models, name="warm-up", daemon=True).start()
+
+
+def check_storage():
+    """Round-trip the active state store and report backend, reachability and latency."""
+    mongo_configured = bool(os.environ.get("MONGO_URI", "").strip())
+    result = {
+        "backend": "mongodb" if MONGO_STATE_COLLECTION is not None else "json_files",
+        "mongo_configured": mongo_configured,
+        "reachable": False,
+        "latency_ms": None,
+        "warnings": []
+    }
+    started = time.perf_counter()
+    try:
+        if MONGO_STATE_COLLECTION is not None:
+            with timed_metric("serene_mongo_operation_duration_seconds", op="ping"):
+                MONGO_CLIENT.admin.command("ping")
+            MONGO_STATE_COLLECTION.find_one({"_id": state_key_for_path(USERS_FILE)}, {"_id": 1})
+        else:
+            probe_path = os.path.join(DATA_DIR, f".healthcheck-{os.getpid()}")
+            with open(probe_path, "w", encoding="utf-8") as f:
+                f.write(datetime.utcnow().isoformat() + "Z")
+            os.remove(probe_path)
+        result["reachable"] = True
+    except Exception as exc:
+        result["error"] = str(exc)
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    if mongo_configured and MONGO_STATE_COLLECTION is None:
+        result["warnings"].append("MONGO_URI is set but MongoDB is unavailable; using per-instance JSON files")
+    if MONGO_STATE_COLLECTION is None and DATA_DIR == fallback_data_dir:
+        result["warnings"].append(f"DATA_DIR is not writable; state lives in ephemeral {fallback_data_dir}")
+    return result
+
+
+def published_read_model_status():
+    # Indexes are rebuilt lazily after a publish, so a stale index is reported but not fatal.
+    published = load_published_timetable()
+    if not published:
+        return {"published": False, "indexes_loaded": True}
+    model = PUBLISHED_READ_MODEL
+    return {
+        "published": True,
+        "publishedAt": published.get("publishedAt"),
+        "indexes_loaded": model.get("row_index") is not None and model.get("version") == published.get("publishedAt")
+    }
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Load balancer readiness: 503 until warm-up finished and storage answers."""
+    storage = check_storage()
+    ready = WARMUP_STATE["ready"] and storage["reachable"]
+    return jsonify({
+        "ready": ready,
+        "warmup": {k: v for k, v in WARMUP_STATE.items() if k != "pid"},
+        "storage": {"backend": storage["backend"], "reachable": storage["reachable"]}
+    }), 200 if ready else 503
+
+
+@app.route('/health/deep', methods=['GET'])
+def deep_health_check():
+    """Storage round-trip, fallback detection and read-model state."""
+    storage = check_storage()
+    read_model = published_read_model_status()
+    if not storage["reachable"]:
+        status = "unhealthy"
+    elif storage["warnings"] or not WARMUP_STATE["ready"]:
+        status = "degraded"
+    else:
+        status = "healthy"
+    return jsonify({
+        "status": status,
+        "pid": os.getpid(),
+        "storage": storage,
+        "read_model": read_model,
+        "warmup": {k: v for k, v in WARMUP_STATE.items() if k != "pid"},
+        "background": {
+            "expiry_scheduler": EXPIRY_SCHEDULER_ENABLED,
+            "expiry_worker_running": _EXPIRY_THREAD_PID == os.getpid()
+        }
+    }), 503 if status == "unhealthy" else 200
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -2820,15 +6482,75 @@ def serve_react(path):
     return send_from_directory(build_dir, 'index.html')
 
 
-init_mongo()
-USERS = load_users()
-PUBLISHED_TIMETABLE = load_published_timetable()
-RESCHEDULE_REQUESTS = load_reschedule_requests()
-PENDING_REGISTRATIONS = load_pending_registrations()
-ACTIVITY_LOGS = load_activity_logs()
-cleanup_pending_registrations()
-cleanup_reschedule_requests()
-cleanup_activity_logs()
+# ----------------- Startup -----------------
+
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        set_metric("serene_startup_duration_seconds", round(elapsed, 6), phase=name)
+        print(f"[startup] {name}: {elapsed * 1000:.1f} ms")
+
+
+def startup():
+    """Connect storage, load state and warm read models for this process.
+
+    With a preloaded app this runs once in the gunicorn master and the warm state
+    is shared copy-on-write with every forked worker (see gunicorn.conf.py).
+    Expiry cleanup is left to the expiry worker unless the scheduler is disabled.
+    """
+    global USERS, PUBLISHED_TIMETABLE, RESCHEDULE_REQUESTS, PENDING_REGISTRATIONS, ACTIVITY_LOGS
+    started = time.perf_counter()
+    with startup_phase("storage"):
+        init_mongo()
+    with startup_phase("state"):
+        USERS = load_users()
+        PUBLISHED_TIMETABLE = load_published_timetable()
+        RESCHEDULE_REQUESTS = load_reschedule_requests()
+        PENDING_REGISTRATIONS = load_pending_registrations()
+        ACTIVITY_LOGS = load_activity_logs()
+    if not EXPIRY_SCHEDULER_ENABLED:
+        with startup_phase("cleanup"):
+            run_expiry_pass({"pending_registrations", "reschedule_requests", "activity_logs"})
+    if PRELOADED_APP:
+        with startup_phase("warm_up"):
+            WARMUP_STATE["pid"] = os.getpid()
+            warm_up_read_models()
+    else:
+        start_warm_up()
+    set_metric("serene_startup_duration_seconds", round(time.perf_counter() - started, 6), phase="total")
+
+
+def after_worker_fork():
+    """Per-worker setup after a preloaded fork: new Mongo client, own background threads."""
+    started = time.perf_counter()
+    # MongoClient is not fork-safe; the master's client must not be reused.
+    init_mongo()
+    if WARMUP_STATE["ready"]:
+        WARMUP_STATE["pid"] = os.getpid()
+    else:
+        start_warm_up()
+    start_expiry_scheduler()
+    start_email_sender()
+    start_event_reader()
+    set_metric("serene_startup_duration_seconds", round(time.perf_counter() - started, 6), phase="post_fork")
+
+
+def in_multiprocessing_child():
+    """True when imported by a sweep pool worker or by the forkserver's `__main__` preload.
+
+    Those processes only run generation functions; they must not connect storage,
+    load state or start warm-up like a serving process.
+    """
+    return (multiprocessing.parent_process() is not None
+            or getattr(multiprocessing.current_process(), "_inheriting", False))
+
+
+if not in_multiprocessing_child():
+    startup()
 
 
 if __name__ == "__main__":
@@ -2837,26 +6559,43 @@ if __name__ == "__main__":
     print("Available endpoints:")
     print("- POST /auth/login - Login")
     print("- POST /auth/register/start - Start registration")
+    print("- GET /auth/register/<id>/email_status - Verification email delivery status")
+    print("- POST /auth/register/<id>/resend_email - Resend a failed verification email")
     print("- POST /auth/register/verify - Verify email for registration")
     print("- POST /auth/logout - Logout")
     print("- GET /auth/me - Current user")
     print("- POST /generate_timetable - Generate a timetable")
+    print("- POST /generate_timetable/batch - Generate departments against a shared room/teacher pool")
+    print("- POST /admin/constraint_sweep - Compare generations across constraint values")
     print("- POST /admin/publish_timetable - Publish timetable")
     print("- GET /admin/published_timetable - Get published timetable")
     print("- DELETE /admin/published_timetable - Delete published timetable")
     print("- GET /admin/reschedule_requests - List teacher requests")
     print("- GET /admin/registration_requests - List teacher registration requests")
     print("- GET /admin/activity_feed - Daily activity feed for bell icon")
+    print("- GET /admin/activity_feed/events - Cursor-paginated activity (?before= / ?since=)")
     print("- POST /admin/registration_requests/<id>/approve - Approve teacher registration")
     print("- POST /admin/registration_requests/<id>/reject - Reject teacher registration")
+    print("- POST /admin/registration_requests/bulk - Approve/reject many teacher registrations")
+    print("- POST /admin/users/import - Bulk create accounts from CSV or JSON lines")
     print("- POST /admin/reschedule_requests/<id>/approve - Approve and apply request")
     print("- POST /admin/reschedule_requests/<id>/reject - Reject request")
+    print("- POST /admin/sessions/revoke - Revoke session tokens for a user or everyone")
     print("- GET /teacher/timetable - Teacher schedule")
     print("- POST /teacher/request_reschedule - Teacher reschedule request")
     print("- GET /student/timetable - Student schedule")
+    print("- GET /timetable/grid - Day x slot grid for a section, teacher or room")
+    print("- GET /rooms/<room>/timetable - Room schedule and free slots")
+    print("- GET /rooms/free - Rooms free at a day/slot")
+    print("- GET /admin/free_slots - Common free slots for teachers/sections")
     print("- POST /validate_input - Validate input data")
+    print("- GET /admin/generation_profile - Last generation profile (?format=prometheus)")
+    print("- GET /metrics - Prometheus metrics")
     print("- POST /reset_teacher - Reset teacher assignment")
+    print("- GET /events/stream - Server-sent dashboard events")
     print("- GET /health - Health check")
+    print("- GET /health/deep - Storage, fallback and read-model checks")
+    print("- GET /ready - Readiness (503 until warm-up completes)")
     
     # Production-ready configuration
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,70 @@
+"""
+Benchmark: login throughput for each password hashing work factor.
+
+Reports logins/sec through /auth/login for a cold verification (full PBKDF2)
+and for repeat logins answered by the verification cache. Run from the
+backend folder:
+
+    python benchmarks/bench_login.py --iterations 100000,260000,600000 --logins 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="serene-bench-"))
+os.environ.setdefault("EXPIRY_SCHEDULER", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as serene  # noqa: E402
+
+PASSWORD = "bench-password"
+
+
+def seed_users(count, iterations):
+    hashes = [serene.hash_password(PASSWORD, iterations) for _ in range(count)]
+
+    def add(users):
+        for i in range(count):
+            username = f"bench_{i}"
+            users[username] = {
+                "username": username,
+                "password": hashes[i],
+                "role": "student",
+                "name": username,
+                "section": "Bench Section"
+            }
+
+    serene.update_json_state(serene.USERS_FILE, {}, add)
+
+
+def logins_per_second(client, count):
+    start = time.perf_counter()
+    for i in range(count):
+        response = client.post("/auth/login", json={"username": f"bench_{i}", "password": PASSWORD})
+        if response.status_code != 200:
+            raise RuntimeError(f"login failed: {response.status_code} {response.get_json()}")
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", default="100000,260000,600000", help="comma separated PBKDF2 work factors")
+    parser.add_argument("--logins", type=int, default=20, help="distinct users logged in per round")
+    args = parser.parse_args()
+
+    client = serene.app.test_client()
+    print(f"{'iterations':>10} {'cold/s':>10} {'cached/s':>10} {'kdf_ms':>10}")
+    for iterations in [int(x) for x in args.iterations.split(",") if x.strip()]:
+        serene.PASSWORD_HASH_ITERATIONS = iterations
+        serene._LOGIN_CACHE.clear()
+        seed_users(args.logins, iterations)
+
+        cold = logins_per_second(client, args.logins)
+        cached = logins_per_second(client, args.logins)
+        print(f"{iterations:>10} {cold:>10.1f} {cached:>10.1f} {1000 / cold:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: rebuilding the published timetable from N active temporary changes.
+
+Compares the previous strategy (one full run_teacher_reset per change) with the
+batched replay_temporary_changes engine. Run from the backend folder:
+
+    python benchmarks/bench_rebuild.py --changes 1,5,10,25,50 --copies 4
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="serene-bench-"))
+os.environ.setdefault("EXPIRY_SCHEDULER", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as serene  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "input_four_timetables.json")
+
+
+def scaled_fixture(copies):
+    """Repeat the bundled department input `copies` times with distinct class names."""
+    with open(FIXTURE, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    data = copy.deepcopy(base)
+    data["classes"] = []
+    for i in range(copies):
+        for class_info in base["classes"]:
+            clone = copy.deepcopy(class_info)
+            clone["name"] = f"{class_info['name']} #{i + 1}" if copies > 1 else class_info["name"]
+            data["classes"].append(clone)
+    return data
+
+
+def generate_rows(input_data):
+    data = serene.transform_classes_to_sections(input_data)
+    fixed_classrooms = serene.assign_fixed_classrooms(data)
+    fixed_teachers = serene.create_fixed_teacher_mapping(data)
+    timetable = serene.make_empty_timetable(data)
+    timetable = serene.assign_all_labs(data, timetable, fixed_teachers, fixed_classrooms)
+    timetable, _ = serene.assign_theory_subjects(data, timetable, fixed_teachers, fixed_classrooms)
+    return serene.timetable_to_result(timetable, data)
+
+
+def sequential_rebuild(input_data, rows, changes):
+    for change in changes:
+        rows = serene.run_teacher_reset(input_data, rows, change["teacher"], change["day"], change["slot"])
+    return rows
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--changes", default="1,5,10,25,50", help="comma separated active-change counts")
+    parser.add_argument("--copies", type=int, default=4, help="how many times to repeat the fixture departments")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    input_data = scaled_fixture(args.copies)
+    rows = generate_rows(input_data)
+    sections = len({r["section"] for r in rows})
+    print(f"{sections} sections, {len(rows)} rows")
+    print(f"{'changes':>8} {'sequential_s':>14} {'batched_s':>12} {'speedup':>9}")
+
+    for count in [int(c) for c in args.changes.split(",") if c.strip()]:
+        picked = random.sample(rows, min(count, len(rows)))
+        changes = [
+            {"type": "unavailable", "teacher": r["teacher"], "day": r["day"], "slot": r["slot"], "appliedAt": str(i)}
+            for i, r in enumerate(picked)
+        ]
+        sequential = best_of(args.repeat, sequential_rebuild, input_data, rows, changes)
+        batched = best_of(args.repeat, serene.replay_temporary_changes, input_data, rows, changes)
+        print(f"{count:>8} {sequential:>14.4f} {batched:>12.4f} {sequential / batched:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Scheduler core benchmarks on synthetic institutions.
+
+Times each generation phase (validation, transform, assign_all_labs,
+assign_theory_subjects, generate_suggestions, run_teacher_reset, stats) for
+fixed scenario sizes and records wall time and peak traced memory per phase.
+Results are written as JSON so two commits can be compared:
+
+    python benchmarks/run_benchmarks.py --output bench_before.json
+    python benchmarks/run_benchmarks.py --compare bench_before.json
+
+The comparison exits with status 1 when a phase got slower than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Teacher mapping uses hash(); pin the hash seed so runs are comparable.
+if os.environ.get("PYTHONHASHSEED") is None:
+    os.environ["PYTHONHASHSEED"] = "0"
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="serene-bench-"))
+os.environ.setdefault("EXPIRY_SCHEDULER", "0")
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import app as serene  # noqa: E402
+from synthetic import generate_institution  # noqa: E402
+
+SCENARIOS = {
+    "xs": 4,
+    "s": 16,
+    "m": 64,
+    "l": 128,
+    "xl": 250,
+    "xxl": 500,
+}
+DEFAULT_SCENARIOS = "xs,s,m,l"
+RESULTS_SCHEMA = 1
+NOISE_FLOOR_S = 0.005
+
+
+def run_pipeline(input_data, seed, trace_memory=False):
+    """Run every phase once; returns {phase: {"wall_s", "peak_kib"}} plus summary counts."""
+    phases = {}
+    state = {}
+
+    def phase(name, func):
+        if trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - start
+        entry = {"wall_s": elapsed}
+        if trace_memory:
+            entry["peak_kib"] = max(0, tracemalloc.get_traced_memory()[1] - base) / 1024
+        phases[name] = entry
+        return value
+
+    random.seed(seed)
+    validation = phase("validate", lambda: serene.validate_input_data(input_data))
+    if not validation["valid"]:
+        raise ValueError(f"synthetic input rejected: {validation['errors']}")
+    data = phase("transform", lambda: serene.transform_classes_to_sections(input_data))
+
+    def setup():
+        state["fixed_classrooms"] = serene.assign_fixed_classrooms(data)
+        state["fixed_teachers"] = serene.create_fixed_teacher_mapping(data)
+        return serene.make_empty_timetable(data)
+
+    timetable = phase("setup", setup)
+    timetable = phase("assign_all_labs", lambda: serene.assign_all_labs(
+        data, timetable, state["fixed_teachers"], state["fixed_classrooms"]))
+    timetable, unfulfilled = phase("assign_theory_subjects", lambda: serene.assign_theory_subjects(
+        data, timetable, state["fixed_teachers"], state["fixed_classrooms"]))
+
+    # Suggestions only run for unfulfilled lectures; probe a few sections when everything fit.
+    probe = unfulfilled or {
+        sec["name"]: {sec["subjects"][0]: 1}
+        for sec in data["sections"][:10] if sec.get("subjects")
+    }
+    phase("generate_suggestions", lambda: serene.generate_suggestions(
+        data, timetable, probe, state["fixed_teachers"]))
+    phase("stats", lambda: serene.calculate_timetable_stats(timetable, input_data))
+    rows = phase("timetable_to_result", lambda: serene.timetable_to_result(timetable, data))
+
+    candidates = [r for r in rows if r.get("teacher")]
+    target = random.Random(seed).choice(candidates) if candidates else None
+    if target:
+        phase("run_teacher_reset", lambda: serene.run_teacher_reset(
+            input_data, rows, target["teacher"], target["day"], target["slot"]))
+
+    summary = {
+        "sections": len(data["sections"]),
+        "rows": len(rows),
+        "unfulfilled_lectures": sum(sum(subs.values()) for subs in unfulfilled.values()),
+        "suggestions_probe": not unfulfilled,
+    }
+    return phases, summary
+
+
+def run_scenario(name, sections, seed, repeat, trace_memory):
+    input_data = generate_institution(sections, seed=seed)
+    timings = {}
+    summary = None
+    for _ in range(repeat):
+        phases, summary = run_pipeline(input_data, seed)
+        for phase, entry in phases.items():
+            timings.setdefault(phase, []).append(entry["wall_s"])
+
+    result = {
+        **summary,
+        "phases": {
+            phase: {
+                "wall_s": statistics.median(values),
+                "wall_s_min": min(values),
+            }
+            for phase, values in timings.items()
+        }
+    }
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            phases, _ = run_pipeline(input_data, seed, trace_memory=True)
+        finally:
+            tracemalloc.stop()
+        for phase, entry in phases.items():
+            result["phases"].setdefault(phase, {})["peak_kib"] = round(entry["peak_kib"], 1)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def print_results(results):
+    print(f"{'scenario':<8} {'phase':<24} {'wall_ms':>10} {'peak_kib':>10}")
+    for name, scenario in results["scenarios"].items():
+        for phase, entry in scenario["phases"].items():
+            peak = entry.get("peak_kib")
+            peak_text = f"{peak:>10.1f}" if peak is not None else f"{'-':>10}"
+            print(f"{name:<8} {phase:<24} {entry['wall_s'] * 1000:>10.2f} {peak_text}")
+        print(f"{name:<8} {'(sections/rows/unfulfilled)':<24} "
+              f"{scenario['sections']}/{scenario['rows']}/{scenario['unfulfilled_lectures']}")
+
+
+def compare_results(baseline, current, threshold):
+    """Print per-phase ratios against a baseline; returns the list of regressions."""
+    regressions = []
+    print(f"\n{'scenario':<8} {'phase':<24} {'base_ms':>10} {'now_ms':>10} {'ratio':>7}")
+    for name, scenario in current["scenarios"].items():
+        base_scenario = baseline.get("scenarios", {}).get(name)
+        if not base_scenario:
+            continue
+        for phase, entry in scenario["phases"].items():
+            base_entry = base_scenario["phases"].get(phase)
+            if not base_entry:
+                continue
+            before = base_entry["wall_s"]
+            now = entry["wall_s"]
+            ratio = now / before if before > 0 else float("inf")
+            flag = ""
+            if ratio > 1 + threshold and now - before > NOISE_FLOOR_S:
+                flag = "  REGRESSION"
+                regressions.append({"scenario": name, "phase": phase, "before_s": before, "now_s": now})
+            print(f"{name:<8} {phase:<24} {before * 1000:>10.2f} {now * 1000:>10.2f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS,
+                        help=f"comma separated names from {', '.join(SCENARIOS)} or 'all'")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown ratio before flagging")
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if args.scenarios == "all" else [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    results = {
+        "schema": RESULTS_SCHEMA,
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "scenarios": {}
+    }
+    for name in names:
+        results["scenarios"][name] = run_scenario(
+            name, SCENARIOS[name], args.seed, args.repeat, trace_memory=not args.no_memory
+        )
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} phase(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
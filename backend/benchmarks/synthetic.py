@@ -0,0 +1,116 @@
+"""
+Synthetic institution generator for scheduler benchmarks.
+
+Produces classes/sections/labs/teachers/rooms input in the same shape as
+input_four_timetables.json (and accepted by validate_input_data), scaled to
+any number of sections. Output is deterministic for a given seed.
+"""
+import math
+import random
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+SLOTS = [
+    "8:30-9:30", "9:30-10:30", "10:30-11:30", "11:30-12:30", "Lunch Break",
+    "1:30-2:30", "2:30-3:30", "3:30-4:30", "4:30-5:30"
+]
+DEPARTMENTS = ["CSE", "IT", "AI & ML", "ECE", "ME", "CE", "EE", "BT"]
+SEMESTERS = ["II", "IV", "VI", "VIII"]
+TEACHER_PREFIXES = ["Dr.", "Mr.", "Ms.", "Prof."]
+
+
+def generate_institution(num_sections, seed=0, theory_per_class=6, labs_per_class=2,
+                         sections_per_class=(1, 3), unavailability_ratio=0.05):
+    """
+    Build an input document with `num_sections` sections.
+
+    Classes hold 1-3 sections each and belong to departments; every class gets
+    its own theory and lab subjects. Teachers are drawn from a per-department
+    roster so most of them teach two subjects, and rooms/labs scale with the
+    section count the way a real campus roughly does.
+    """
+    rng = random.Random(seed)
+    classes = []
+    teachers = {}
+    lab_teachers = {}
+    lab_rooms = {}
+    lab_durations = {}
+    lecture_requirements = {}
+    teacher_unavailability = {}
+
+    labs = [f"LAB {100 + i}" for i in range(max(2, math.ceil(num_sections * 0.6)))]
+    rooms = [f"RN {100 + i}" for i in range(max(2, math.ceil(num_sections * 1.1)))]
+    rosters = {}
+
+    def department_teacher(dept):
+        roster = rosters.setdefault(dept, [])
+        # Reuse an existing teacher half of the time so loads overlap across subjects.
+        if roster and rng.random() < 0.5:
+            return rng.choice(roster)
+        name = f"{rng.choice(TEACHER_PREFIXES)} {dept.replace(' ', '')} Faculty {len(roster) + 1}"
+        roster.append(name)
+        return name
+
+    remaining = num_sections
+    class_no = 0
+    while remaining > 0:
+        dept = DEPARTMENTS[class_no % len(DEPARTMENTS)]
+        semester = SEMESTERS[(class_no // len(DEPARTMENTS)) % len(SEMESTERS)]
+        batch = class_no // (len(DEPARTMENTS) * len(SEMESTERS)) + 1
+        class_name = f"B.TECH {dept} {semester} Sem Batch-{batch}"
+        count = min(remaining, rng.randint(*sections_per_class))
+        remaining -= count
+        class_no += 1
+
+        subjects = [f"{dept} {semester} B{batch} Subject {k + 1}" for k in range(theory_per_class)]
+        lab_subjects = [f"{dept} {semester} B{batch} LAB {k + 1}" for k in range(labs_per_class)]
+        pool_size = max(1, math.ceil(count / 2))
+
+        for subject in subjects:
+            teachers[subject] = sorted({department_teacher(dept) for _ in range(pool_size)})
+            lecture_requirements[subject] = rng.choice([2, 3, 3, 3])
+        for lab in lab_subjects:
+            lab_teachers[lab] = sorted({department_teacher(dept) for _ in range(pool_size)})
+            lab_rooms[lab] = rng.sample(labs, min(len(labs), 2))
+            lab_durations[lab] = rng.choice([2, 2, 2, 3])
+
+        classes.append({
+            "name": class_name,
+            "subjects": subjects,
+            "lab_subjects": lab_subjects,
+            "sections": [
+                {"name": chr(ord("A") + i), "student_count": rng.randint(40, 70)}
+                for i in range(count)
+            ]
+        })
+
+    teaching_slots = [s for s in SLOTS if s != "Lunch Break"]
+    for roster in rosters.values():
+        for name in roster:
+            if rng.random() < unavailability_ratio:
+                teacher_unavailability[name] = [
+                    {"day": rng.choice(DAYS), "slot": rng.choice(teaching_slots)}
+                    for _ in range(rng.randint(1, 2))
+                ]
+
+    return {
+        "classes": classes,
+        "rooms": rooms,
+        "labs": labs,
+        "lab_rooms": lab_rooms,
+        "days": list(DAYS),
+        "slots": list(SLOTS),
+        "teachers": teachers,
+        "lab_teachers": lab_teachers,
+        "teacher_unavailability": teacher_unavailability,
+        "lecture_requirements": lecture_requirements,
+        "lab_durations": lab_durations,
+        "lab_capacity": 30,
+        "constraints": {
+            "max_lectures_per_day_teacher": 5,
+            "max_lectures_per_subject_per_day": 2,
+            "min_lectures_per_day_section": 4,
+            "max_lectures_per_day_section": 6,
+            "lab_session_duration": 2,
+            "distribute_across_week": True
+        }
+    }
@@ -0,0 +1,27 @@
+"""
+Gunicorn settings, picked up automatically by `gunicorn app:app` from backend/.
+
+The app is imported once in the master (preload_app) so storage setup, state
+loading and read-model warm-up happen a single time; forked workers inherit
+that warm state copy-on-write. Set GUNICORN_PRELOAD=0 to import per worker.
+
+Threaded workers keep long-lived /events/stream connections from tying up a
+whole worker process each. Streams are capped per worker (EVENT_STREAMS_PER_WORKER,
+default threads - 2) so API requests always have threads left. API handlers run
+concurrently on the remaining threads.
+"""
+import os
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+if preload_app:
+    os.environ["SERENE_PRELOAD"] = "1"
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    import app as serene
+
+    serene.after_worker_fork()
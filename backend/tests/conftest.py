@@ -0,0 +1,85 @@
+"""
+Shared fixtures: the app runs against a throwaway DATA_DIR with JSON file state,
+no expiry scheduler and immediate revocation checks. Run from the backend folder:
+
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="serene-tests-")
+os.environ["MONGO_URI"] = ""
+os.environ["EXPIRY_SCHEDULER"] = "0"
+os.environ["REVOCATION_CHECK_SECONDS"] = "0"
+os.environ["PASSWORD_HASH_ITERATIONS"] = "1000"
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import app as serene  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    """Empty state store and caches, then the same startup a worker runs."""
+    for name in os.listdir(serene.DATA_DIR):
+        if name.endswith(".json"):
+            os.remove(os.path.join(serene.DATA_DIR, name))
+    serene.USER_INDEX = {}
+    serene.PUBLISHED_READ_MODEL = {}
+    serene.ACTIVITY_INDEX = {}
+    serene.PENDING_SUMMARY = {}
+    serene._REVOCATION_CACHE.update({"checked": 0.0, "revision": None, "value": {"all": 0, "users": {}}})
+    serene._LOGIN_CACHE.clear()
+    serene.startup()
+    yield serene
+
+
+def login(username, password):
+    client = serene.app.test_client()
+    response = client.post("/auth/login", json={"username": username, "password": password})
+    assert response.status_code == 200, response.get_json()
+    return client
+
+
+@pytest.fixture
+def admin():
+    return login("admin", "admin123")
+
+
+@pytest.fixture
+def publish(admin):
+    """Generate the bundled sample input and publish it; returns the publish response."""
+    with open(os.path.join(BACKEND_DIR, "input_four_timetables.json"), encoding="utf-8") as f:
+        input_data = json.load(f)
+
+    def run():
+        serene.random.seed(3)
+        result = admin.post("/generate_timetable", json=input_data).get_json()
+        response = admin.post("/admin/publish_timetable", json={
+            "inputData": input_data,
+            "timetableData": {"timetable": result["timetable"]}
+        })
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+
+    return run
+
+
+def teacher_login(teacher_name):
+    username = next(
+        name for name, user in serene.USERS.items()
+        if user.get("role") == "teacher" and user.get("teacher_name") == teacher_name
+    )
+    return login(username, os.environ.get("DEFAULT_TEACHER_PASSWORD", "teacher123"))
+
+
+def request_unavailable(teacher, row):
+    response = teacher.post("/teacher/request_reschedule", json={
+        "day": row["day"], "slot": row["slot"], "reason": "test"
+    })
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["request"]["id"]
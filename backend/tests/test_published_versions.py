@@ -0,0 +1,46 @@
+from conftest import request_unavailable, serene, teacher_login
+
+
+def first_theory_row(rows):
+    return next(row for row in rows if row.get("teacher") and not row.get("group"))
+
+
+def approve(admin, request_id):
+    response = admin.post(f"/admin/reschedule_requests/{request_id}/approve")
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["version"]
+
+
+def test_since_from_the_current_publication_gets_a_delta(admin, publish):
+    published = publish()
+    row = first_theory_row(serene.load_published_timetable()["timetableData"]["timetable"])
+    teacher = teacher_login(row["teacher"])
+
+    version = approve(admin, request_unavailable(teacher, row))
+    reply = teacher.get(f"/teacher/timetable?since={published['version']}").get_json()
+
+    assert reply["version"] == version
+    assert "full" not in reply
+    assert reply["delta"]["removed"] or reply["delta"]["moved"]
+
+
+def test_stale_since_after_republish_gets_the_full_timetable(admin, publish):
+    publish()
+    row = first_theory_row(serene.load_published_timetable()["timetableData"]["timetable"])
+    teacher = teacher_login(row["teacher"])
+    stale = approve(admin, request_unavailable(teacher, row))
+
+    assert admin.delete("/admin/published_timetable").status_code == 200
+    republished = publish()
+    assert republished["version"] != stale
+
+    reply = teacher.get(f"/teacher/timetable?since={stale}").get_json()
+    assert reply["full"] is True
+    assert reply["version"] == republished["version"]
+    assert reply["timetable"]
+
+    # Still full once the new publication has history of its own.
+    rows = serene.load_published_timetable()["timetableData"]["timetable"]
+    approve(admin, request_unavailable(teacher, first_theory_row([r for r in rows if r["teacher"] == row["teacher"]])))
+    reply = teacher.get(f"/teacher/timetable?since={stale}").get_json()
+    assert reply["full"] is True
@@ -0,0 +1,52 @@
+from conftest import login, serene
+
+
+def authenticated(client, token=None):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    return client.get("/auth/me", headers=headers).get_json()["authenticated"]
+
+
+def test_logout_rejects_bearer_copies_and_other_sessions():
+    client = serene.app.test_client()
+    token = client.post("/auth/login", json={"username": "admin", "password": "admin123"}).get_json()["token"]
+    other = login("admin", "admin123")
+    assert authenticated(serene.app.test_client(), token)
+
+    assert client.post("/auth/logout").status_code == 200
+
+    assert not authenticated(client)
+    assert not authenticated(serene.app.test_client(), token)
+    assert not authenticated(other)
+    assert authenticated(login("admin", "admin123"))
+
+
+def test_admin_revoke_rejects_existing_tokens(admin):
+    student = "s_ai_ml_6th_sem_a"
+    target = login(student, "student123")
+    assert authenticated(target)
+
+    assert admin.post("/admin/sessions/revoke", json={"username": student}).status_code == 200
+    assert not authenticated(target)
+    assert authenticated(admin)
+
+    assert admin.post("/admin/sessions/revoke", json={"all": True}).status_code == 200
+    assert not authenticated(admin)
+
+
+def test_legacy_username_cookie_is_upgraded_then_revocable():
+    client = serene.app.test_client()
+    with client.session_transaction() as session:
+        session["username"] = "admin"
+
+    assert authenticated(client)
+    with client.session_transaction() as session:
+        assert "username" not in session
+        assert session.get("token")
+
+    legacy = serene.app.test_client()
+    with legacy.session_transaction() as session:
+        session["username"] = "admin"
+    serene.revoke_sessions("admin")
+
+    assert not authenticated(client)
+    assert not authenticated(legacy)
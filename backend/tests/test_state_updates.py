@@ -0,0 +1,80 @@
+import threading
+import time
+
+from conftest import login, request_unavailable, serene, teacher_login
+
+
+def theory_rows(limit, skip_teacher=None):
+    """One theory row per teacher from the current timetable."""
+    rows = serene.load_published_timetable()["timetableData"]["timetable"]
+    picked = {}
+    for row in rows:
+        if row.get("teacher") and not row.get("group") and row["teacher"] != skip_teacher:
+            picked.setdefault(row["teacher"], row)
+    return list(picked.values())[:limit]
+
+
+def test_expiry_during_an_approval_keeps_both_changes(admin, publish, monkeypatch):
+    publish()
+    (old_row,) = theory_rows(1)
+    old_id = request_unavailable(teacher_login(old_row["teacher"]), old_row)
+    assert admin.post(f"/admin/reschedule_requests/{old_id}/approve").status_code == 200
+
+    def expire_now(published):
+        for change in published["temporary_changes"]:
+            change["expiresAt"] = "2000-01-01T00:00:00Z"
+    serene.update_json_state(serene.PUBLISHED_TIMETABLE_FILE, None, expire_now)
+
+    # Expiry belongs to the scheduler thread here, so the approval does not sweep it first.
+    monkeypatch.setattr(serene, "EXPIRY_SCHEDULER_ENABLED", True)
+    monkeypatch.setattr(serene, "start_expiry_scheduler", lambda: None)
+    (new_row,) = theory_rows(1, skip_teacher=old_row["teacher"])
+    new_id = request_unavailable(teacher_login(new_row["teacher"]), new_row)
+
+    # Hold the approval inside its state update while the expiry pass starts.
+    in_update = threading.Event()
+    record = serene.record_published_version
+
+    def slow_record(*args, **kwargs):
+        in_update.set()
+        time.sleep(0.3)
+        return record(*args, **kwargs)
+    monkeypatch.setattr(serene, "record_published_version", slow_record)
+
+    responses = []
+    approval = threading.Thread(
+        target=lambda: responses.append(admin.post(f"/admin/reschedule_requests/{new_id}/approve"))
+    )
+    approval.start()
+    assert in_update.wait(5)
+    expiry = threading.Thread(target=serene.run_expiry_pass, args=({"temporary_changes"},))
+    expiry.start()
+    approval.join()
+    expiry.join()
+
+    assert responses[0].status_code == 200, responses[0].get_json()
+    published = serene.load_published_timetable()
+    assert [c["requestId"] for c in published["temporary_changes"]] == [new_id]
+    assert serene.load_reschedule_requests() == []
+
+
+def test_concurrent_approvals_resolve_a_request_once(admin, publish):
+    publish()
+    (row,) = theory_rows(1)
+    request_id = request_unavailable(teacher_login(row["teacher"]), row)
+
+    clients = [login("admin", "admin123") for _ in range(4)]
+    responses = []
+    threads = [
+        threading.Thread(
+            target=lambda c=client: responses.append(c.post(f"/admin/reschedule_requests/{request_id}/approve").status_code)
+        )
+        for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(responses) == [200, 404, 404, 404]
+    assert len(serene.load_published_timetable()["temporary_changes"]) == 1